@@ -1,8 +1,19 @@
 import frappe
 import requests
 import json
+import hashlib
+import threading
+import time
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
+from erpnext_aramex_shipping.api.session_pool import get_session_pool
+from erpnext_aramex_shipping.api.resilience import (
+    AmbiguousRequestError, CircuitOpenError, RetryPolicy, RETRYABLE_STATUS_CODES, get_circuit_breaker, get_retry_policy
+)
+from erpnext_aramex_shipping.api.single_flight import COALESCED_ENDPOINTS, get_request_key, get_single_flight
+
+# Shipments packed into one CreateShipments call unless settings override it
+DEFAULT_SHIPMENT_BATCH_SIZE = 50
 
 #
 class AramexAPI:
@@ -17,6 +28,11 @@ class AramexAPI:
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
+        self.session_pool = get_session_pool(self.settings)
+        self.client_info = self.build_client_info()
+        self.circuit_breaker = get_circuit_breaker(self.base_url, self.settings)
+        self.retry_policies: Dict[str, RetryPolicy] = {}
+        self.single_flight = get_single_flight(self.settings)
     
     def get_aramex_settings(self) -> Dict[str, Any]:
         """Get Aramex API settings from ERPNext configuration"""
@@ -49,8 +65,8 @@ class AramexAPI:
         else:
             return 'https://ws.aramex.net'
     
-    def get_client_info(self) -> Dict[str, Any]:
-        """Get client information for API requests"""
+    def build_client_info(self) -> Dict[str, Any]:
+        """Build the ClientInfo block once for the lifetime of the client"""
         return {
             'UserName': self.settings.get('username'),
             'Password': self.settings.get('password'),
@@ -62,38 +78,134 @@ class AramexAPI:
             'Source': 24  # ERPNext integration source code
         }
     
-    def make_api_request(self, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        """Make a request to Aramex API with error handling"""
+    def get_client_info(self) -> Dict[str, Any]:
+        """Get client information for API requests (shared, treat as read-only)"""
+        return self.client_info
+    
+    def get_retry_policy(self, endpoint: str) -> RetryPolicy:
+        """Get the (cached) retry policy for an endpoint"""
+        policy = self.retry_policies.get(endpoint)
+        if policy is None:
+            policy = self.retry_policies[endpoint] = get_retry_policy(endpoint, self.settings)
+        return policy
+    
+    def send_request(self, url: str, payload: Dict[str, Any], policy: RetryPolicy) -> requests.Response:
+        """
+        POST to Aramex with the endpoint's retry policy and the shared circuit breaker
+        
+        Args:
+            url: Full endpoint URL
+            payload: Request payload
+            policy: Retry policy for the endpoint
+        
+        Returns:
+            The final HTTP response
+        """
+        if not self.circuit_breaker.allow_request():
+            raise CircuitOpenError("Aramex API is temporarily unavailable, please retry shortly")
+        
+        started = time.monotonic()
+        attempt = 0
+        
+        while True:
+            remaining = policy.deadline - (time.monotonic() - started)
+            try:
+                # Reuse a pooled keep-alive session instead of a new connection per call
+                response = self.session_pool.post(
+                    url,
+                    reconnect=policy.idempotent,
+                    headers=self.headers,
+                    json=payload,
+                    timeout=policy.get_timeout(remaining)
+                )
+                
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    self.circuit_breaker.record_success()
+                    return response
+                
+                error = requests.exceptions.HTTPError(
+                    f"{response.status_code} Error for url: {url}", response=response
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+                response = None
+            
+            remaining = policy.deadline - (time.monotonic() - started)
+            if not policy.can_retry(attempt, remaining):
+                # Throttling means the carrier is up, so it does not trip the breaker
+                if response is None or response.status_code != 429:
+                    self.circuit_breaker.record_failure()
+                raise error
+            
+            attempt += 1
+            frappe.logger().warning(f"Retrying Aramex API request to {url} (attempt {attempt}): {str(error)}")
+            time.sleep(min(policy.get_backoff(attempt), remaining - policy.connect_timeout))
+    
+    @staticmethod
+    def is_ambiguous_failure(error: requests.exceptions.RequestException) -> bool:
+        """
+        Whether a failed request may still have reached Aramex
+        
+        Only a connect timeout or a 4xx answer prove the request was not
+        acted on; any other transport error or 5xx answer leaves it unknown.
+        """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return False
+        response = getattr(error, 'response', None)
+        if response is not None:
+            return response.status_code >= 500
+        return True
+    
+    @staticmethod
+    def raise_for_api_errors(result: Dict[str, Any]) -> None:
+        """Raise if an Aramex response reports API-level errors"""
+        if result.get('HasErrors', False):
+            error_messages = []
+            for notification in result.get('Notifications', []):
+                if notification.get('Code') != '000':  # Success code
+                    error_messages.append(notification.get('Message', 'Unknown error'))
+            
+            if error_messages:
+                raise Exception(f"Aramex API Error: {'; '.join(error_messages)}")
+    
+    def make_api_request(self, endpoint: str, payload: Dict[str, Any], raise_errors: bool = True) -> Dict[str, Any]:
+        """Make a request to Aramex API, sharing one call between identical concurrent requests"""
+        if endpoint in COALESCED_ENDPOINTS:
+            key = get_request_key(endpoint, payload)
+            return self.single_flight.do(key, lambda: self.execute_api_request(endpoint, payload, raise_errors))
+        
+        return self.execute_api_request(endpoint, payload, raise_errors)
+    
+    def execute_api_request(self, endpoint: str, payload: Dict[str, Any], raise_errors: bool = True) -> Dict[str, Any]:
+        """
+        Make a request to Aramex API with error handling
+        
+        With `raise_errors` off, a response flagged HasErrors is returned as is
+        so batch callers can read the per-shipment notifications.
+        """
         try:
             url = f"{self.base_url}/{endpoint}"
             
             frappe.logger().info(f"Making Aramex API request to: {url}")
             
-            response = requests.post(
-                url,
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
+            response = self.send_request(url, payload, self.get_retry_policy(endpoint))
             
             response.raise_for_status()
             result = response.json()
             
-            # Check for API-level errors
-            if result.get('HasErrors', False):
-                error_messages = []
-                for notification in result.get('Notifications', []):
-                    if notification.get('Code') != '000':  # Success code
-                        error_messages.append(notification.get('Message', 'Unknown error'))
-                
-                if error_messages:
-                    raise Exception(f"Aramex API Error: {'; '.join(error_messages)}")
+            if raise_errors:
+                self.raise_for_api_errors(result)
             
             return result
             
+        except CircuitOpenError:
+            # Fail fast without flooding the error log while the carrier is down
+            raise
         except requests.exceptions.RequestException as e:
             error_msg = f"Network error connecting to Aramex API: {str(e)}"
             frappe.log_error(error_msg, "Aramex API Network Error")
+            if self.is_ambiguous_failure(e):
+                raise AmbiguousRequestError(error_msg)
             raise Exception(error_msg)
         except Exception as e:
             error_msg = f"Aramex API request failed: {str(e)}"
@@ -101,6 +213,142 @@ class AramexAPI:
             raise Exception(error_msg)
 
 
+# Site config keys that feed get_aramex_settings(); a change to any of them
+# invalidates the cached client
+ARAMEX_CONF_KEYS = (
+    'aramex_settings', 'aramex_username', 'aramex_password', 'aramex_account_number',
+    'aramex_account_pin', 'aramex_account_entity', 'aramex_account_country_code',
+    'aramex_test_mode'
+)
+
+# Process-level AramexAPI clients: site -> (settings hash, client)
+_client_cache: Dict[str, Tuple[str, AramexAPI]] = {}
+_client_cache_lock = threading.Lock()
+
+
+def get_settings_hash() -> str:
+    """Hash the Aramex entries of the already loaded site config"""
+    conf = {key: frappe.conf.get(key) for key in ARAMEX_CONF_KEYS}
+    return hashlib.sha1(json.dumps(conf, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_aramex_client() -> AramexAPI:
+    """
+    Get the memoized AramexAPI client for the current site
+    
+    The client, its settings, base URL, headers and ClientInfo block are built
+    once per site and process, and rebuilt only when the Aramex settings change.
+    
+    Returns:
+        Shared AramexAPI instance
+    """
+    site = getattr(frappe.local, 'site', None) or ''
+    settings_hash = get_settings_hash()
+    
+    cached = _client_cache.get(site)
+    if cached and cached[0] == settings_hash:
+        return cached[1]
+    
+    with _client_cache_lock:
+        cached = _client_cache.get(site)
+        if cached and cached[0] == settings_hash:
+            return cached[1]
+        
+        client = AramexAPI()
+        _client_cache[site] = (settings_hash, client)
+        return client
+
+
+def clear_aramex_client_cache(doc=None, method=None) -> None:
+    """
+    Drop cached clients
+    
+    Settings come from site config, and get_aramex_client already rebuilds
+    a client when the ARAMEX_CONF_KEYS entries change; this only forces a
+    rebuild, e.g. from a console or a test.
+    """
+    with _client_cache_lock:
+        _client_cache.clear()
+
+
+def build_rate_payload(api: AramexAPI, shipment_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the RateCalculator request payload
+    
+    Args:
+        api: Aramex API client
+        shipment_data: Dictionary containing shipment information
+    
+    Returns:
+        CalculateRate request payload
+    """
+    return {
+        'ClientInfo': api.get_client_info(),
+        'Transaction': {
+            'Reference1': shipment_data.get('reference', ''),
+            'Reference2': '',
+            'Reference3': '',
+            'Reference4': '',
+            'Reference5': ''
+        },
+        'OriginAddress': {
+            'Line1': shipment_data.get('origin_address_line1', ''),
+            'Line2': shipment_data.get('origin_address_line2', ''),
+            'Line3': shipment_data.get('origin_address_line3', ''),
+            'City': shipment_data.get('origin_city', ''),
+            'StateOrProvinceCode': shipment_data.get('origin_state', ''),
+            'PostCode': shipment_data.get('origin_postal_code', ''),
+            'CountryCode': shipment_data.get('origin_country_code', 'AE')
+        },
+        'DestinationAddress': {
+            'Line1': shipment_data.get('destination_address_line1', ''),
+            'Line2': shipment_data.get('destination_address_line2', ''),
+            'Line3': shipment_data.get('destination_address_line3', ''),
+            'City': shipment_data.get('destination_city', ''),
+            'StateOrProvinceCode': shipment_data.get('destination_state', ''),
+            'PostCode': shipment_data.get('destination_postal_code', ''),
+            'CountryCode': shipment_data.get('destination_country_code', 'AE')
+        },
+        'ShipmentDetails': {
+            'Dimensions': {
+                'Length': float(shipment_data.get('length', 10)),
+                'Width': float(shipment_data.get('width', 10)),
+                'Height': float(shipment_data.get('height', 10)),
+                'Unit': shipment_data.get('dimension_unit', 'CM')
+            },
+            'ActualWeight': {
+                'Value': float(shipment_data.get('weight', 1)),
+                'Unit': shipment_data.get('weight_unit', 'KG')
+            },
+            'ProductGroup': shipment_data.get('product_group', 'EXP'),
+            'ProductType': shipment_data.get('product_type', 'PPX'),
+            'PaymentType': shipment_data.get('payment_type', 'P'),
+            'PaymentOptions': shipment_data.get('payment_options', ''),
+            'Services': shipment_data.get('services', ''),
+            'NumberOfPieces': int(shipment_data.get('number_of_pieces', 1)),
+            'DescriptionOfGoods': shipment_data.get('description', 'General Goods'),
+            'GoodsOriginCountry': shipment_data.get('goods_origin_country', 'AE')
+        },
+        'PreferredCurrencyCode': shipment_data.get('currency_code', 'AED')
+    }
+
+
+def parse_rate_response(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Convert a CalculateRate response into the rate list returned to callers"""
+    rates = []
+    if result.get('TotalAmount'):
+        rates.append({
+            'service_type': 'Standard',
+            'service_name': 'Aramex Standard Service',
+            'total_amount': result.get('TotalAmount', {}).get('Value', 0),
+            'currency': result.get('TotalAmount', {}).get('CurrencyCode', 'AED'),
+            'transit_time': 'N/A',
+            'description': 'Standard Aramex shipping service'
+        })
+    
+    return rates
+
+
 @frappe.whitelist()
 def get_shipping_rates(shipment_data: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -113,80 +361,23 @@ def get_shipping_rates(shipment_data: Dict[str, Any]) -> Dict[str, Any]:
         Dictionary containing shipping rates and services
     """
     try:
-        api = AramexAPI()
+        api = get_aramex_client()
         
         # Prepare the rate calculation request
-        payload = {
-            'ClientInfo': api.get_client_info(),
-            'Transaction': {
-                'Reference1': shipment_data.get('reference', ''),
-                'Reference2': '',
-                'Reference3': '',
-                'Reference4': '',
-                'Reference5': ''
-            },
-            'OriginAddress': {
-                'Line1': shipment_data.get('origin_address_line1', ''),
-                'Line2': shipment_data.get('origin_address_line2', ''),
-                'Line3': shipment_data.get('origin_address_line3', ''),
-                'City': shipment_data.get('origin_city', ''),
-                'StateOrProvinceCode': shipment_data.get('origin_state', ''),
-                'PostCode': shipment_data.get('origin_postal_code', ''),
-                'CountryCode': shipment_data.get('origin_country_code', 'AE')
-            },
-            'DestinationAddress': {
-                'Line1': shipment_data.get('destination_address_line1', ''),
-                'Line2': shipment_data.get('destination_address_line2', ''),
-                'Line3': shipment_data.get('destination_address_line3', ''),
-                'City': shipment_data.get('destination_city', ''),
-                'StateOrProvinceCode': shipment_data.get('destination_state', ''),
-                'PostCode': shipment_data.get('destination_postal_code', ''),
-                'CountryCode': shipment_data.get('destination_country_code', 'AE')
-            },
-            'ShipmentDetails': {
-                'Dimensions': {
-                    'Length': float(shipment_data.get('length', 10)),
-                    'Width': float(shipment_data.get('width', 10)),
-                    'Height': float(shipment_data.get('height', 10)),
-                    'Unit': shipment_data.get('dimension_unit', 'CM')
-                },
-                'ActualWeight': {
-                    'Value': float(shipment_data.get('weight', 1)),
-                    'Unit': shipment_data.get('weight_unit', 'KG')
-                },
-                'ProductGroup': shipment_data.get('product_group', 'EXP'),
-                'ProductType': shipment_data.get('product_type', 'PPX'),
-                'PaymentType': shipment_data.get('payment_type', 'P'),
-                'PaymentOptions': shipment_data.get('payment_options', ''),
-                'Services': shipment_data.get('services', ''),
-                'NumberOfPieces': int(shipment_data.get('number_of_pieces', 1)),
-                'DescriptionOfGoods': shipment_data.get('description', 'General Goods'),
-                'GoodsOriginCountry': shipment_data.get('goods_origin_country', 'AE')
-            },
-            'PreferredCurrencyCode': shipment_data.get('currency_code', 'AED')
-        }
+        payload = build_rate_payload(api, shipment_data)
         
         # Make API request
         result = api.make_api_request('ShippingAPI.V2/RateCalculator/CalculateRate', payload)
         
         # Process the response
-        rates = []
-        if result.get('TotalAmount'):
-            rates.append({
-                'service_type': 'Standard',
-                'service_name': 'Aramex Standard Service',
-                'total_amount': result.get('TotalAmount', {}).get('Value', 0),
-                'currency': result.get('TotalAmount', {}).get('CurrencyCode', 'AED'),
-                'transit_time': 'N/A',
-                'description': 'Standard Aramex shipping service'
-            })
+        rates = parse_rate_response(result)
         
         return {
             'success': True,
             'rates': rates,
             'message': 'Shipping rates retrieved successfully'
         }
-        
+    
     except Exception as e:
         frappe.log_error(f"Error getting shipping rates: {str(e)}", "Aramex Rate Calculation Error")
         return {
@@ -196,6 +387,231 @@ def get_shipping_rates(shipment_data: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 
+def build_shipment_entry(api: AramexAPI, shipment_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build one element of the CreateShipments `Shipments` array
+    
+    Args:
+        api: Aramex API client
+        shipment_data: Dictionary containing complete shipment information
+    
+    Returns:
+        Shipment entry for the request payload
+    """
+    return {
+        'Reference1': shipment_data.get('reference', ''),
+        'Reference2': '',
+        'Reference3': '',
+        'Shipper': {
+            'Reference1': '',
+            'Reference2': '',
+            'AccountNumber': api.settings.get('account_number'),
+            'PartyAddress': {
+                'Line1': shipment_data.get('shipper_address_line1', ''),
+                'Line2': shipment_data.get('shipper_address_line2', ''),
+                'Line3': shipment_data.get('shipper_address_line3', ''),
+                'City': shipment_data.get('shipper_city', ''),
+                'StateOrProvinceCode': shipment_data.get('shipper_state', ''),
+                'PostCode': shipment_data.get('shipper_postal_code', ''),
+                'CountryCode': shipment_data.get('shipper_country_code', 'AE')
+            },
+            'Contact': {
+                'Department': '',
+                'PersonName': shipment_data.get('shipper_name', ''),
+                'Title': '',
+                'CompanyName': shipment_data.get('shipper_company', ''),
+                'PhoneNumber1': shipment_data.get('shipper_phone', ''),
+                'PhoneNumber1Ext': '',
+                'PhoneNumber2': '',
+                'PhoneNumber2Ext': '',
+                'FaxNumber': '',
+                'CellPhone': shipment_data.get('shipper_mobile', ''),
+                'EmailAddress': shipment_data.get('shipper_email', ''),
+                'Type': ''
+            }
+        },
+        'Consignee': {
+            'Reference1': '',
+            'Reference2': '',
+            'AccountNumber': '',
+            'PartyAddress': {
+                'Line1': shipment_data.get('consignee_address_line1', ''),
+                'Line2': shipment_data.get('consignee_address_line2', ''),
+                'Line3': shipment_data.get('consignee_address_line3', ''),
+                'City': shipment_data.get('consignee_city', ''),
+                'StateOrProvinceCode': shipment_data.get('consignee_state', ''),
+                'PostCode': shipment_data.get('consignee_postal_code', ''),
+                'CountryCode': shipment_data.get('consignee_country_code', 'AE')
+            },
+            'Contact': {
+                'Department': '',
+                'PersonName': shipment_data.get('consignee_name', ''),
+                'Title': '',
+                'CompanyName': shipment_data.get('consignee_company', ''),
+                'PhoneNumber1': shipment_data.get('consignee_phone', ''),
+                'PhoneNumber1Ext': '',
+                'PhoneNumber2': '',
+                'PhoneNumber2Ext': '',
+                'FaxNumber': '',
+                'CellPhone': shipment_data.get('consignee_mobile', ''),
+                'EmailAddress': shipment_data.get('consignee_email', ''),
+                'Type': ''
+            }
+        },
+        'ShipmentDetails': {
+            'Dimensions': {
+                'Length': float(shipment_data.get('length', 10)),
+                'Width': float(shipment_data.get('width', 10)),
+                'Height': float(shipment_data.get('height', 10)),
+                'Unit': shipment_data.get('dimension_unit', 'CM')
+            },
+            'ActualWeight': {
+                'Value': float(shipment_data.get('weight', 1)),
+                'Unit': shipment_data.get('weight_unit', 'KG')
+            },
+            'ProductGroup': shipment_data.get('product_group', 'EXP'),
+            'ProductType': shipment_data.get('product_type', 'PPX'),
+            'PaymentType': shipment_data.get('payment_type', 'P'),
+            'PaymentOptions': shipment_data.get('payment_options', ''),
+            'Services': shipment_data.get('services', ''),
+            'NumberOfPieces': int(shipment_data.get('number_of_pieces', 1)),
+            'DescriptionOfGoods': shipment_data.get('description', 'General Goods'),
+            'GoodsOriginCountry': shipment_data.get('goods_origin_country', 'AE'),
+            'CashOnDeliveryAmount': {
+                'Value': float(shipment_data.get('cod_amount', 0)),
+                'CurrencyCode': shipment_data.get('currency_code', 'AED')
+            },
+            'InsuranceAmount': {
+                'Value': float(shipment_data.get('insurance_amount', 0)),
+                'CurrencyCode': shipment_data.get('currency_code', 'AED')
+            },
+            'CollectAmount': {
+                'Value': float(shipment_data.get('collect_amount', 0)),
+                'CurrencyCode': shipment_data.get('currency_code', 'AED')
+            }
+        }
+    }
+
+
+def build_shipments_payload(api: AramexAPI, shipments_data: List[Dict[str, Any]], reference: str = '') -> Dict[str, Any]:
+    """
+    Build a CreateShipments request payload carrying several shipments
+    
+    Args:
+        api: Aramex API client
+        shipments_data: List of dictionaries containing complete shipment information
+        reference: Transaction reference for the whole request
+    
+    Returns:
+        CreateShipments request payload
+    """
+    return {
+        'ClientInfo': api.get_client_info(),
+        'Transaction': {
+            'Reference1': reference,
+            'Reference2': '',
+            'Reference3': '',
+            'Reference4': '',
+            'Reference5': ''
+        },
+        'Shipments': [build_shipment_entry(api, shipment_data) for shipment_data in shipments_data],
+        'LabelInfo': {
+            'ReportID': 9201,
+            'ReportType': 'URL'
+        }
+    }
+
+
+def build_shipment_payload(api: AramexAPI, shipment_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the CreateShipments request payload
+    
+    Args:
+        api: Aramex API client
+        shipment_data: Dictionary containing complete shipment information
+    
+    Returns:
+        CreateShipments request payload
+    """
+    return build_shipments_payload(api, [shipment_data], shipment_data.get('reference', ''))
+
+
+def parse_shipment_response(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a CreateShipments response into the result returned to callers"""
+    if result.get('Shipments') and len(result['Shipments']) > 0:
+        shipment = result['Shipments'][0]
+        return {
+            'success': True,
+            'shipment_id': shipment.get('ID', ''),
+            'reference': shipment.get('Reference1', ''),
+            'foreign_hawb': shipment.get('ForeignHAWB', ''),
+            'label_url': shipment.get('ShipmentLabel', {}).get('LabelURL', ''),
+            'message': 'Shipment created successfully'
+        }
+    else:
+        return {
+            'success': False,
+            'message': 'Failed to create shipment - no shipment data returned'
+        }
+
+
+def parse_shipment_entry(shipment: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert one processed shipment of a CreateShipments response into a caller result"""
+    if shipment.get('HasErrors'):
+        error_messages = [
+            notification.get('Message', 'Unknown error')
+            for notification in shipment.get('Notifications') or []
+            if notification.get('Code') != '000'
+        ]
+        return {
+            'success': False,
+            'reference': shipment.get('Reference1', ''),
+            'message': f"Aramex API Error: {'; '.join(error_messages) or 'Unknown error'}"
+        }
+    
+    return {
+        'success': True,
+        'shipment_id': shipment.get('ID', ''),
+        'reference': shipment.get('Reference1', ''),
+        'foreign_hawb': shipment.get('ForeignHAWB', ''),
+        'label_url': (shipment.get('ShipmentLabel') or {}).get('LabelURL', ''),
+        'message': 'Shipment created successfully'
+    }
+
+
+def parse_shipments_response(result: Dict[str, Any], shipments_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Map a batched CreateShipments response back onto its input shipments
+    
+    Processed shipments are matched on Reference1 when every input carries a
+    distinct reference, otherwise by position.
+    
+    Args:
+        result: CreateShipments response
+        shipments_data: Shipments sent in the request, in order
+    
+    Returns:
+        One create_shipment-style result per input, in order
+    """
+    processed = result.get('Shipments') or []
+    references = [shipment_data.get('reference') for shipment_data in shipments_data]
+    
+    if all(references) and len(set(references)) == len(references):
+        by_reference = {shipment.get('Reference1'): shipment for shipment in processed}
+        matched = [by_reference.get(reference) for reference in references]
+    else:
+        matched = processed[:len(shipments_data)] + [None] * (len(shipments_data) - len(processed))
+    
+    return [
+        parse_shipment_entry(shipment) if shipment is not None else {
+            'success': False,
+            'reference': shipment_data.get('reference', ''),
+            'message': 'Failed to create shipment - no shipment data returned'
+        }
+        for shipment_data, shipment in zip(shipments_data, matched)
+    ]
+
+
 @frappe.whitelist()
 def create_shipment(shipment_data: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -208,137 +624,24 @@ def create_shipment(shipment_data: Dict[str, Any]) -> Dict[str, Any]:
         Dictionary containing shipment creation result
     """
     try:
-        api = AramexAPI()
+        api = get_aramex_client()
         
         # Prepare the shipment creation request
-        payload = {
-            'ClientInfo': api.get_client_info(),
-            'Transaction': {
-                'Reference1': shipment_data.get('reference', ''),
-                'Reference2': '',
-                'Reference3': '',
-                'Reference4': '',
-                'Reference5': ''
-            },
-            'Shipments': [{
-                'Reference1': shipment_data.get('reference', ''),
-                'Reference2': '',
-                'Reference3': '',
-                'Shipper': {
-                    'Reference1': '',
-                    'Reference2': '',
-                    'AccountNumber': api.settings.get('account_number'),
-                    'PartyAddress': {
-                        'Line1': shipment_data.get('shipper_address_line1', ''),
-                        'Line2': shipment_data.get('shipper_address_line2', ''),
-                        'Line3': shipment_data.get('shipper_address_line3', ''),
-                        'City': shipment_data.get('shipper_city', ''),
-                        'StateOrProvinceCode': shipment_data.get('shipper_state', ''),
-                        'PostCode': shipment_data.get('shipper_postal_code', ''),
-                        'CountryCode': shipment_data.get('shipper_country_code', 'AE')
-                    },
-                    'Contact': {
-                        'Department': '',
-                        'PersonName': shipment_data.get('shipper_name', ''),
-                        'Title': '',
-                        'CompanyName': shipment_data.get('shipper_company', ''),
-                        'PhoneNumber1': shipment_data.get('shipper_phone', ''),
-                        'PhoneNumber1Ext': '',
-                        'PhoneNumber2': '',
-                        'PhoneNumber2Ext': '',
-                        'FaxNumber': '',
-                        'CellPhone': shipment_data.get('shipper_mobile', ''),
-                        'EmailAddress': shipment_data.get('shipper_email', ''),
-                        'Type': ''
-                    }
-                },
-                'Consignee': {
-                    'Reference1': '',
-                    'Reference2': '',
-                    'AccountNumber': '',
-                    'PartyAddress': {
-                        'Line1': shipment_data.get('consignee_address_line1', ''),
-                        'Line2': shipment_data.get('consignee_address_line2', ''),
-                        'Line3': shipment_data.get('consignee_address_line3', ''),
-                        'City': shipment_data.get('consignee_city', ''),
-                        'StateOrProvinceCode': shipment_data.get('consignee_state', ''),
-                        'PostCode': shipment_data.get('consignee_postal_code', ''),
-                        'CountryCode': shipment_data.get('consignee_country_code', 'AE')
-                    },
-                    'Contact': {
-                        'Department': '',
-                        'PersonName': shipment_data.get('consignee_name', ''),
-                        'Title': '',
-                        'CompanyName': shipment_data.get('consignee_company', ''),
-                        'PhoneNumber1': shipment_data.get('consignee_phone', ''),
-                        'PhoneNumber1Ext': '',
-                        'PhoneNumber2': '',
-                        'PhoneNumber2Ext': '',
-                        'FaxNumber': '',
-                        'CellPhone': shipment_data.get('consignee_mobile', ''),
-                        'EmailAddress': shipment_data.get('consignee_email', ''),
-                        'Type': ''
-                    }
-                },
-                'ShipmentDetails': {
-                    'Dimensions': {
-                        'Length': float(shipment_data.get('length', 10)),
-                        'Width': float(shipment_data.get('width', 10)),
-                        'Height': float(shipment_data.get('height', 10)),
-                        'Unit': shipment_data.get('dimension_unit', 'CM')
-                    },
-                    'ActualWeight': {
-                        'Value': float(shipment_data.get('weight', 1)),
-                        'Unit': shipment_data.get('weight_unit', 'KG')
-                    },
-                    'ProductGroup': shipment_data.get('product_group', 'EXP'),
-                    'ProductType': shipment_data.get('product_type', 'PPX'),
-                    'PaymentType': shipment_data.get('payment_type', 'P'),
-                    'PaymentOptions': shipment_data.get('payment_options', ''),
-                    'Services': shipment_data.get('services', ''),
-                    'NumberOfPieces': int(shipment_data.get('number_of_pieces', 1)),
-                    'DescriptionOfGoods': shipment_data.get('description', 'General Goods'),
-                    'GoodsOriginCountry': shipment_data.get('goods_origin_country', 'AE'),
-                    'CashOnDeliveryAmount': {
-                        'Value': float(shipment_data.get('cod_amount', 0)),
-                        'CurrencyCode': shipment_data.get('currency_code', 'AED')
-                    },
-                    'InsuranceAmount': {
-                        'Value': float(shipment_data.get('insurance_amount', 0)),
-                        'CurrencyCode': shipment_data.get('currency_code', 'AED')
-                    },
-                    'CollectAmount': {
-                        'Value': float(shipment_data.get('collect_amount', 0)),
-                        'CurrencyCode': shipment_data.get('currency_code', 'AED')
-                    }
-                }
-            }],
-            'LabelInfo': {
-                'ReportID': 9201,
-                'ReportType': 'URL'
-            }
-        }
+        payload = build_shipment_payload(api, shipment_data)
         
         # Make API request
         result = api.make_api_request('ShippingAPI.V2/Shipping/CreateShipments', payload)
         
         # Process the response
-        if result.get('Shipments') and len(result['Shipments']) > 0:
-            shipment = result['Shipments'][0]
-            return {
-                'success': True,
-                'shipment_id': shipment.get('ID', ''),
-                'reference': shipment.get('Reference1', ''),
-                'foreign_hawb': shipment.get('ForeignHAWB', ''),
-                'label_url': shipment.get('ShipmentLabel', {}).get('LabelURL', ''),
-                'message': 'Shipment created successfully'
-            }
-        else:
-            return {
-                'success': False,
-                'message': 'Failed to create shipment - no shipment data returned'
-            }
-        
+        return parse_shipment_response(result)
+    
+    except AmbiguousRequestError as e:
+        # Aramex may have created the waybill, so the caller must not resend
+        return {
+            'success': False,
+            'needs_review': True,
+            'message': f'No answer from Aramex, the shipment may have been created: {str(e)}'
+        }
     except Exception as e:
         frappe.log_error(f"Error creating shipment: {str(e)}", "Aramex Shipment Creation Error")
         return {
@@ -347,6 +650,66 @@ def create_shipment(shipment_data: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 
+@frappe.whitelist()
+def create_shipments(shipments_data: List[Dict[str, Any]], batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Create many shipments using as few CreateShipments calls as possible
+    
+    Args:
+        shipments_data: List of dictionaries containing complete shipment information
+        batch_size: Shipments per call, defaults to the `shipment_batch_size` setting
+    
+    Returns:
+        Dictionary containing one create_shipment-style result per input, in order
+    """
+    try:
+        api = get_aramex_client()
+        batch_size = max(1, int(batch_size or api.settings.get('shipment_batch_size', DEFAULT_SHIPMENT_BATCH_SIZE)))
+        results = []
+        
+        for start in range(0, len(shipments_data), batch_size):
+            batch = shipments_data[start:start + batch_size]
+            payload = build_shipments_payload(api, batch, batch[0].get('reference', ''))
+            
+            try:
+                # HasErrors is set as soon as one shipment fails, so read the
+                # per-shipment notifications instead of failing the batch
+                result = api.make_api_request('ShippingAPI.V2/Shipping/CreateShipments', payload, raise_errors=False)
+                if not result.get('Shipments'):
+                    api.raise_for_api_errors(result)
+                results.extend(parse_shipments_response(result, batch))
+            
+            except AmbiguousRequestError as e:
+                results.extend({
+                    'success': False,
+                    'needs_review': True,
+                    'reference': shipment_data.get('reference', ''),
+                    'message': f'No answer from Aramex, the shipment may have been created: {str(e)}'
+                } for shipment_data in batch)
+            except Exception as e:
+                results.extend({
+                    'success': False,
+                    'reference': shipment_data.get('reference', ''),
+                    'message': f'Error creating shipment: {str(e)}'
+                } for shipment_data in batch)
+        
+        created = sum(1 for result in results if result['success'])
+        
+        return {
+            'success': created > 0,
+            'results': results,
+            'message': f'Created {created} of {len(shipments_data)} shipments'
+        }
+    
+    except Exception as e:
+        frappe.log_error(f"Error creating shipments: {str(e)}", "Aramex Shipment Creation Error")
+        return {
+            'success': False,
+            'results': [],
+            'message': f'Error creating shipments: {str(e)}'
+        }
+
+
 @frappe.whitelist()
 def generate_shipping_label(shipment_id: str) -> Dict[str, Any]:
     """
@@ -359,7 +722,7 @@ def generate_shipping_label(shipment_id: str) -> Dict[str, Any]:
         Dictionary containing label information
     """
     try:
-        api = AramexAPI()
+        api = get_aramex_client()
         
         # Prepare the label printing request
         payload = {
@@ -402,60 +765,84 @@ def generate_shipping_label(shipment_id: str) -> Dict[str, Any]:
         }
 
 
+def build_tracking_payload(api: AramexAPI, shipment_ids: List[str], last_update_only: bool = False) -> Dict[str, Any]:
+    """
+    Build the TrackShipments request payload
+    
+    Args:
+        api: Aramex API client
+        shipment_ids: Aramex shipment IDs or tracking numbers
+        last_update_only: Ask only for the latest tracking update of each shipment
+    
+    Returns:
+        TrackShipments request payload
+    """
+    return {
+        'ClientInfo': api.get_client_info(),
+        'Transaction': {
+            'Reference1': '',
+            'Reference2': '',
+            'Reference3': '',
+            'Reference4': '',
+            'Reference5': ''
+        },
+        'Shipments': list(shipment_ids),
+        'GetLastTrackingUpdateOnly': last_update_only
+    }
+
+
+def parse_tracking_response(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Convert a TrackShipments response into the tracking results returned to callers"""
+    tracking_results = []
+    if result.get('TrackingResults'):
+        for tracking_result in result['TrackingResults']:
+            tracking_events = []
+            if tracking_result.get('TrackingUpdateEvents'):
+                for event in tracking_result['TrackingUpdateEvents']:
+                    tracking_events.append({
+                        'date': event.get('UpdateDateTime', ''),
+                        'location': event.get('UpdateLocation', ''),
+                        'status': event.get('UpdateDescription', ''),
+                        'comments': event.get('Comments', ''),
+                        'code': event.get('UpdateCode', '')
+                    })
+            
+            tracking_results.append({
+                'waybill_number': tracking_result.get('WaybillNumber', ''),
+                'reference': tracking_result.get('Reference', ''),
+                'status': tracking_result.get('UpdateCode', ''),
+                'problem_code': tracking_result.get('ProblemCode', ''),
+                'gross_weight': tracking_result.get('GrossWeight', 0),
+                'charged_weight': tracking_result.get('ChargedWeight', 0),
+                'events': tracking_events
+            })
+    
+    return tracking_results
+
+
 @frappe.whitelist()
-def track_shipment(shipment_id: str) -> Dict[str, Any]:
+def track_shipment(shipment_id: str, last_update_only: bool = False) -> Dict[str, Any]:
     """
     Track a shipment using Aramex API
     
     Args:
         shipment_id: Aramex shipment ID or tracking number
+        last_update_only: Ask only for the latest tracking update
         
     Returns:
         Dictionary containing tracking information
     """
     try:
-        api = AramexAPI()
+        api = get_aramex_client()
         
         # Prepare the tracking request
-        payload = {
-            'ClientInfo': api.get_client_info(),
-            'Transaction': {
-                'Reference1': '',
-                'Reference2': '',
-                'Reference3': '',
-                'Reference4': '',
-                'Reference5': ''
-            },
-            'Shipments': [shipment_id],
-            'GetLastTrackingUpdateOnly': False
-        }
+        payload = build_tracking_payload(api, [shipment_id], last_update_only)
         
         # Make API request
         result = api.make_api_request('ShippingAPI.V2/Tracking/TrackShipments', payload)
         
         # Process the response
-        tracking_results = []
-        if result.get('TrackingResults'):
-            for tracking_result in result['TrackingResults']:
-                tracking_events = []
-                if tracking_result.get('TrackingUpdateEvents'):
-                    for event in tracking_result['TrackingUpdateEvents']:
-                        tracking_events.append({
-                            'date': event.get('UpdateDateTime', ''),
-                            'location': event.get('UpdateLocation', ''),
-                            'status': event.get('UpdateDescription', ''),
-                            'comments': event.get('Comments', '')
-                        })
-                
-                tracking_results.append({
-                    'waybill_number': tracking_result.get('WaybillNumber', ''),
-                    'reference': tracking_result.get('Reference', ''),
-                    'status': tracking_result.get('UpdateCode', ''),
-                    'problem_code': tracking_result.get('ProblemCode', ''),
-                    'gross_weight': tracking_result.get('GrossWeight', 0),
-                    'charged_weight': tracking_result.get('ChargedWeight', 0),
-                    'events': tracking_events
-                })
+        tracking_results = parse_tracking_response(result)
         
         return {
             'success': True,
@@ -473,76 +860,71 @@ def track_shipment(shipment_id: str) -> Dict[str, Any]:
 
 
 @frappe.whitelist()
-def get_shipments(filters: Dict[str, Any] = None) -> Dict[str, Any]:
+def get_shipments(filters: Dict[str, Any] = None, cursor: Optional[str] = None, limit: int = 50,
+                  order: str = 'desc', since: Optional[str] = None) -> Dict[str, Any]:
     """
     Get shipments for dashboard display
     
+    With `since`, only the shipments inserted, updated or deleted after that
+    cursor are returned, whatever the filters, so a client can merge them
+    into the list it already holds. With a `search` filter, shipments are
+    ranked by how well they match it through the trigram index.
+    
     Args:
-        filters: Optional filters for shipments
+        filters: Optional filters: status, period or from_date/to_date,
+            customer, tracking_id and search
+        cursor: next_cursor returned with the previous page
+        limit: Number of shipments per page
+        order: `desc` for newest first, `asc` for oldest first
+        since: Sync cursor returned with a page or a previous sync
         
     Returns:
-        Dictionary containing shipments list
+        Dictionary containing one page of shipments, or the changes since the
+        sync cursor, and the cursor to sync from next
     """
+    from erpnext_aramex_shipping.shipment.listing import (
+        list_shipments, list_changes, get_sync_cursor, to_dashboard_row, MAX_SYNC_ROWS
+    )
+    from erpnext_aramex_shipping.shipment.search import search_shipments
+    
     try:
-        # In a real implementation, this would query the database
-        # For now, we'll return mock data for demonstration
-        
-        mock_shipments = [
-            {
-                'tracking_id': '1234567890',
-                'customer_name': 'John Doe',
-                'destination': 'Dubai, UAE',
-                'status': 'delivered',
-                'weight': 2.5,
-                'created_at': '2024-01-15',
-                'service_type': 'standard'
-            },
-            {
-                'tracking_id': '1234567891',
-                'customer_name': 'Jane Smith',
-                'destination': 'Abu Dhabi, UAE',
-                'status': 'in_transit',
-                'weight': 1.8,
-                'created_at': '2024-01-16',
-                'service_type': 'express'
-            },
-            {
-                'tracking_id': '1234567892',
-                'customer_name': 'Bob Johnson',
-                'destination': 'Sharjah, UAE',
-                'status': 'pending',
-                'weight': 3.2,
-                'created_at': '2024-01-17',
-                'service_type': 'standard'
-            },
-            {
-                'tracking_id': '1234567893',
-                'customer_name': 'Alice Brown',
-                'destination': 'Ajman, UAE',
-                'status': 'failed',
-                'weight': 0.5,
-                'created_at': '2024-01-14',
-                'service_type': 'priority'
+        if since:
+            changes = list_changes(since, MAX_SYNC_ROWS)
+            
+            return {
+                'success': True,
+                'shipments': [to_dashboard_row(row) for row in changes['rows']],
+                'deleted': changes['deleted'],
+                'since': changes['next_since'],
+                'has_more': changes['has_more'],
+                'message': f"{len(changes['rows'])} changed and {len(changes['deleted'])} deleted shipments"
             }
-        ]
         
-        # Apply filters if provided
-        if filters:
-            if filters.get('status'):
-                mock_shipments = [s for s in mock_shipments if s['status'] == filters['status']]
-            if filters.get('search'):
-                search_term = filters['search'].lower()
-                mock_shipments = [s for s in mock_shipments 
-                                if search_term in s['customer_name'].lower() or 
-                                   search_term in s['tracking_id'].lower() or
-                                   search_term in s['destination'].lower()]
+        if isinstance(filters, str):
+            filters = json.loads(filters)
+        
+        # Taken before the page is read, so changes made meanwhile are synced later
+        sync_cursor = get_sync_cursor()
+        if filters and filters.get('search'):
+            page = search_shipments(filters['search'], filters, cursor, limit)
+        else:
+            page = list_shipments(filters, cursor, limit, order)
         
         return {
             'success': True,
-            'shipments': mock_shipments,
+            'shipments': [to_dashboard_row(row) for row in page['rows']],
+            'next_cursor': page['next_cursor'],
+            'has_more': page['has_more'],
+            'since': sync_cursor,
             'message': 'Shipments retrieved successfully'
         }
-        
+    
+    except (ValueError, json.JSONDecodeError) as e:
+        return {
+            'success': False,
+            'shipments': [],
+            'message': f'Invalid shipment filters: {str(e)}'
+        }
     except Exception as e:
         frappe.log_error(f"Error getting shipments: {str(e)}", "Aramex Get Shipments Error")
         return {
@@ -607,26 +989,17 @@ def get_dashboard_stats() -> Dict[str, Any]:
     """
     Get dashboard statistics
     
+    Reads counters kept up to date by the Aramex Shipment doc_events, so the
+    cost does not grow with the number of shipments.
+    
     Returns:
         Dictionary containing dashboard statistics
     """
+    from erpnext_aramex_shipping.shipment.stats import ensure_reconciled, read_stats
+    
     try:
-        # Mock dashboard stats
-        stats = {
-            'total_shipments': 156,
-            'delivered_shipments': 98,
-            'in_transit_shipments': 45,
-            'failed_shipments': 13,
-            'today_shipments': 12,
-            'this_week_shipments': 34,
-            'this_month_shipments': 89,
-            'average_delivery_time': 2.5,
-            'top_destinations': [
-                {'destination': 'Dubai, UAE', 'count': 45},
-                {'destination': 'Abu Dhabi, UAE', 'count': 32},
-                {'destination': 'Sharjah, UAE', 'count': 28}
-            ]
-        }
+        ensure_reconciled()
+        stats = read_stats()
         
         return {
             'success': True,
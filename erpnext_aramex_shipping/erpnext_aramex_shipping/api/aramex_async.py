@@ -0,0 +1,336 @@
+import frappe
+import asyncio
+import contextvars
+import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any, Awaitable, Iterable
+
+from erpnext_aramex_shipping.api.aramex import (
+    AramexAPI, get_aramex_client,
+    build_rate_payload, parse_rate_response,
+    build_shipment_payload, parse_shipment_response,
+    build_tracking_payload, parse_tracking_response
+)
+from erpnext_aramex_shipping.api.resilience import (
+    AmbiguousRequestError, CircuitOpenError, RetryPolicy, RETRYABLE_STATUS_CODES
+)
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - optional dependency
+    aiohttp = None
+
+# Default number of Aramex requests allowed in flight at once
+DEFAULT_CONCURRENCY = 20
+
+
+class AsyncAramexAPI:
+    """
+    Asyncio counterpart of AramexAPI for concurrent fan-out
+    
+    Shares settings, ClientInfo, payload builders, retry policies and the
+    circuit breaker with the synchronous client, but sends requests through a
+    single aiohttp session so hundreds of calls can be in flight at once:
+        
+        async with AsyncAramexAPI() as api:
+            results = await gather_limited([api.track_shipment(i) for i in ids], 50)
+    
+    aiohttp is optional. Without it, requests go through the synchronous
+    client's send_request on a thread pool of `concurrency` workers, so the
+    gather helpers keep working, with one thread per request in flight. The
+    threads only send HTTP and write to frappe.logger(); errors are logged
+    to the database from the event loop, on the caller's thread.
+    """
+    
+    def __init__(self, api: Optional[AramexAPI] = None, concurrency: int = DEFAULT_CONCURRENCY):
+        self.api = api or get_aramex_client()
+        self.concurrency = max(1, int(concurrency))
+        self.session = None
+        self.executor = None
+    
+    async def __aenter__(self) -> 'AsyncAramexAPI':
+        if aiohttp is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='aramex')
+            return self
+        
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=30)
+        self.session = aiohttp.ClientSession(connector=connector, headers=self.api.headers)
+        return self
+    
+    async def __aexit__(self, *exc_info) -> None:
+        if self.executor:
+            # Drop calls not yet started and wait for running ones, which the
+            # endpoint's retry-policy deadline bounds, so no thread outlives
+            # the caller's request
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+            return
+        
+        await self.session.close()
+        self.session = None
+    
+    async def send_request(self, url: str, payload: Dict[str, Any], policy: RetryPolicy) -> Dict[str, Any]:
+        """POST with the endpoint's retry policy and the shared circuit breaker"""
+        breaker = self.api.circuit_breaker
+        if not breaker.allow_request():
+            raise CircuitOpenError("Aramex API is temporarily unavailable, please retry shortly")
+        
+        started = time.monotonic()
+        attempt = 0
+        
+        while True:
+            remaining = policy.deadline - (time.monotonic() - started)
+            connect_timeout, read_timeout = policy.get_timeout(remaining)
+            timeout = aiohttp.ClientTimeout(total=remaining, sock_connect=connect_timeout, sock_read=read_timeout)
+            status = None
+            
+            try:
+                async with self.session.post(url, json=payload, timeout=timeout) as response:
+                    status = response.status
+                    if status not in RETRYABLE_STATUS_CODES:
+                        response.raise_for_status()
+                        result = await response.json(content_type=None)
+                        breaker.record_success()
+                        return result
+                    
+                    error = Exception(f"{status} Error for url: {url}")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            
+            remaining = policy.deadline - (time.monotonic() - started)
+            if not policy.can_retry(attempt, remaining):
+                # Throttling means the carrier is up, so it does not trip the breaker
+                if status != 429:
+                    breaker.record_failure()
+                raise error
+            
+            attempt += 1
+            await asyncio.sleep(min(policy.get_backoff(attempt), remaining - policy.connect_timeout))
+    
+    def post_json(self, url: str, payload: Dict[str, Any], policy: RetryPolicy) -> Dict[str, Any]:
+        """Blocking POST for the thread pool; uses HTTP and Redis only, never the database"""
+        response = self.api.send_request(url, payload, policy)
+        response.raise_for_status()
+        return response.json()
+    
+    async def send_threaded_request(self, url: str, payload: Dict[str, Any], policy: RetryPolicy) -> Dict[str, Any]:
+        """POST through the thread pool, for when aiohttp is not installed"""
+        # Each thread runs in a copy of the caller's context so frappe.local
+        # (site, config, cache prefix) is the caller's
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        try:
+            return await loop.run_in_executor(self.executor, context.run, self.post_json, url, payload, policy)
+        except requests.exceptions.RequestException as e:
+            # Logged here, on the thread that owns the database connection
+            error_msg = f"Network error connecting to Aramex API: {str(e)}"
+            frappe.log_error(error_msg, "Aramex API Network Error")
+            if AramexAPI.is_ambiguous_failure(e):
+                raise AmbiguousRequestError(error_msg)
+            raise Exception(error_msg)
+    
+    async def make_api_request(self, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Make a request to Aramex API and raise on API-level errors"""
+        url = f"{self.api.base_url}/{endpoint}"
+        policy = self.api.get_retry_policy(endpoint)
+        
+        if self.executor:
+            result = await self.send_threaded_request(url, payload, policy)
+        else:
+            result = await self.send_request(url, payload, policy)
+        
+        self.api.raise_for_api_errors(result)
+        return result
+    
+    async def get_shipping_rates(self, shipment_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Async version of aramex.get_shipping_rates, same result shape"""
+        try:
+            payload = build_rate_payload(self.api, shipment_data)
+            result = await self.make_api_request('ShippingAPI.V2/RateCalculator/CalculateRate', payload)
+            
+            return {
+                'success': True,
+                'rates': parse_rate_response(result),
+                'message': 'Shipping rates retrieved successfully'
+            }
+        
+        except Exception as e:
+            frappe.logger().error(f"Error getting shipping rates: {str(e)}")
+            return {
+                'success': False,
+                'rates': [],
+                'message': f'Error retrieving shipping rates: {str(e)}'
+            }
+    
+    async def create_shipment(self, shipment_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Async version of aramex.create_shipment, same result shape"""
+        try:
+            payload = build_shipment_payload(self.api, shipment_data)
+            result = await self.make_api_request('ShippingAPI.V2/Shipping/CreateShipments', payload)
+            return parse_shipment_response(result)
+        
+        except Exception as e:
+            frappe.logger().error(f"Error creating shipment: {str(e)}")
+            return {
+                'success': False,
+                'message': f'Error creating shipment: {str(e)}'
+            }
+    
+    async def track_shipments(self, shipment_ids: List[str], last_update_only: bool = False) -> Dict[str, Any]:
+        """Track one or more shipments in a single TrackShipments call"""
+        try:
+            payload = build_tracking_payload(self.api, shipment_ids, last_update_only)
+            result = await self.make_api_request('ShippingAPI.V2/Tracking/TrackShipments', payload)
+            
+            return {
+                'success': True,
+                'tracking_results': parse_tracking_response(result),
+                'message': 'Tracking information retrieved successfully'
+            }
+        
+        except Exception as e:
+            frappe.logger().error(f"Error tracking shipments: {str(e)}")
+            return {
+                'success': False,
+                'tracking_results': [],
+                'message': f'Error tracking shipment: {str(e)}'
+            }
+    
+    async def track_shipment(self, shipment_id: str) -> Dict[str, Any]:
+        """Async version of aramex.track_shipment, same result shape"""
+        return await self.track_shipments([shipment_id])
+
+
+async def gather_limited(awaitables: Iterable[Awaitable], limit: int = DEFAULT_CONCURRENCY) -> List[Any]:
+    """
+    Await many awaitables with at most `limit` running at once
+    
+    Args:
+        awaitables: Coroutines to run
+        limit: Maximum number running concurrently
+    
+    Returns:
+        Results in the same order as the input
+    """
+    semaphore = asyncio.Semaphore(max(1, int(limit)))
+    
+    async def run(awaitable):
+        async with semaphore:
+            return await awaitable
+    
+    return await asyncio.gather(*(run(awaitable) for awaitable in awaitables))
+
+
+async def gather_with_deadline(awaitables: Iterable[Awaitable], deadline: float,
+                               limit: int = DEFAULT_CONCURRENCY) -> List[Optional[Any]]:
+    """
+    Await many awaitables, abandoning whatever is still running at the deadline
+    
+    Args:
+        awaitables: Coroutines to run
+        deadline: Seconds to wait for the whole group
+        limit: Maximum number running concurrently
+    
+    Returns:
+        Results in the same order as the input; None for each one cut off
+    """
+    semaphore = asyncio.Semaphore(max(1, int(limit)))
+    
+    async def run(awaitable):
+        async with semaphore:
+            return await awaitable
+    
+    tasks = [asyncio.ensure_future(run(awaitable)) for awaitable in awaitables]
+    if not tasks:
+        return []
+    
+    done, pending = await asyncio.wait(tasks, timeout=max(float(deadline), 0))
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    
+    return [task.result() if task in done and not task.exception() else None for task in tasks]
+
+
+def run_async(coroutine: Awaitable) -> Any:
+    """Run a coroutine to completion from synchronous code (web request or background job)"""
+    return asyncio.run(coroutine)
+
+
+def gather_shipping_rates(shipments: List[Dict[str, Any]], concurrency: int = DEFAULT_CONCURRENCY) -> List[Dict[str, Any]]:
+    """
+    Quote many shipments concurrently
+    
+    Args:
+        shipments: List of shipment data dictionaries, as for get_shipping_rates
+        concurrency: Maximum number of requests in flight
+    
+    Returns:
+        One get_shipping_rates-style result per input, in order
+    """
+    async def run():
+        async with AsyncAramexAPI(concurrency=concurrency) as api:
+            return await gather_limited([api.get_shipping_rates(data) for data in shipments], concurrency)
+    
+    return run_async(run())
+
+
+def gather_shipping_rates_by_deadline(shipments: List[Dict[str, Any]], deadline: float,
+                                      concurrency: int = DEFAULT_CONCURRENCY) -> List[Optional[Dict[str, Any]]]:
+    """
+    Quote many shipments concurrently within an overall deadline
+    
+    Args:
+        shipments: List of shipment data dictionaries, as for get_shipping_rates
+        deadline: Seconds to wait for all quotes
+        concurrency: Maximum number of requests in flight
+    
+    Returns:
+        One get_shipping_rates-style result per input, in order; None where
+        the quote did not arrive before the deadline
+    """
+    async def run():
+        async with AsyncAramexAPI(concurrency=concurrency) as api:
+            return await gather_with_deadline([api.get_shipping_rates(data) for data in shipments], deadline, concurrency)
+    
+    return run_async(run())
+
+
+def gather_tracking(shipment_ids: List[str], concurrency: int = DEFAULT_CONCURRENCY) -> List[Dict[str, Any]]:
+    """
+    Track many shipments concurrently, one waybill per call
+    
+    Args:
+        shipment_ids: Aramex shipment IDs or tracking numbers
+        concurrency: Maximum number of requests in flight
+    
+    Returns:
+        One track_shipment-style result per input, in order
+    """
+    async def run():
+        async with AsyncAramexAPI(concurrency=concurrency) as api:
+            return await gather_limited([api.track_shipment(shipment_id) for shipment_id in shipment_ids], concurrency)
+    
+    return run_async(run())
+
+
+def gather_tracking_batches(batches: List[List[str]], concurrency: int = DEFAULT_CONCURRENCY,
+                            last_update_only: bool = False) -> List[Dict[str, Any]]:
+    """
+    Track batches of waybills concurrently, one TrackShipments call per batch
+    
+    Args:
+        batches: Lists of Aramex shipment IDs, each within the per-call limit
+        concurrency: Maximum number of requests in flight
+        last_update_only: Ask only for the latest tracking update of each shipment
+    
+    Returns:
+        One track_shipments-style result per batch, in order
+    """
+    async def run():
+        async with AsyncAramexAPI(concurrency=concurrency) as api:
+            return await gather_limited([api.track_shipments(batch, last_update_only) for batch in batches], concurrency)
+    
+    return run_async(run())
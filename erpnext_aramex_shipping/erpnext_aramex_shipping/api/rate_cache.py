@@ -0,0 +1,263 @@
+import frappe
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Any, Tuple
+
+from erpnext_aramex_shipping.api.aramex import get_aramex_client
+
+# Defaults used when the Aramex settings do not override them
+DEFAULT_TTL = 900
+DEFAULT_MAX_ENTRIES = 2048
+
+# Aramex bills weight in half-kilo (one-pound) steps; dimensions are rounded up
+# to whole units before the volumetric weight is computed
+WEIGHT_BRACKETS = {'KG': 0.5, 'LB': 1.0}
+DIMENSION_BRACKET = 1.0
+
+REDIS_KEY_PREFIX = 'aramex_rate'
+STATS_KEY = 'aramex_rate_cache_stats'
+
+# Hit and miss counts are added up in process and written to the shared
+# counters once STATS_FLUSH_EVENTS have accumulated, or by the first event
+# STATS_FLUSH_INTERVAL seconds after the oldest unwritten one, so serving a
+# quote from the local LRU does not touch Redis at all
+STATS_FLUSH_EVENTS = 100
+STATS_FLUSH_INTERVAL = 10
+
+
+def round_up(value: Any, bracket: float) -> float:
+    """Round a numeric value up to the next billing bracket"""
+    return math.ceil(float(value or 0) / bracket - 1e-9) * bracket
+
+
+def normalize_rate_profile(shipment_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reduce shipment data to the fields that determine an Aramex rate
+    
+    Args:
+        shipment_data: Dictionary containing shipment information
+    
+    Returns:
+        Normalized profile; identical carts on the same lane map to the same profile
+    """
+    weight_unit = (shipment_data.get('weight_unit') or 'KG').upper()
+    services = shipment_data.get('services') or ''
+    
+    return {
+        'origin_city': (shipment_data.get('origin_city') or '').strip().lower(),
+        'origin_country': (shipment_data.get('origin_country_code') or 'AE').upper(),
+        'destination_city': (shipment_data.get('destination_city') or '').strip().lower(),
+        'destination_country': (shipment_data.get('destination_country_code') or 'AE').upper(),
+        'weight': round_up(shipment_data.get('weight', 1), WEIGHT_BRACKETS.get(weight_unit, 0.5)),
+        'weight_unit': weight_unit,
+        'dimensions': sorted(
+            round_up(shipment_data.get(field, 10), DIMENSION_BRACKET)
+            for field in ('length', 'width', 'height')
+        ),
+        'dimension_unit': (shipment_data.get('dimension_unit') or 'CM').upper(),
+        'pieces': int(shipment_data.get('number_of_pieces', 1) or 1),
+        'product_group': shipment_data.get('product_group') or 'EXP',
+        'product_type': shipment_data.get('product_type') or 'PPX',
+        'payment_type': shipment_data.get('payment_type') or 'P',
+        'services': sorted(s.strip().upper() for s in services.split(',') if s.strip()),
+        'currency': (shipment_data.get('currency_code') or 'AED').upper()
+    }
+
+
+def get_rate_cache_key(shipment_data: Dict[str, Any]) -> str:
+    """Stable cache key for the normalized rate profile of a shipment"""
+    profile = normalize_rate_profile(shipment_data)
+    return hashlib.sha1(json.dumps(profile, sort_keys=True).encode()).hexdigest()
+
+
+class RateCache:
+    """
+    Two-level rate quote cache
+    
+    A per-process LRU holds recent quotes with no network round trip; Redis
+    shares quotes between workers. Both levels expire entries after `ttl`
+    seconds. Hit and miss counts reach the shared counters in batches (see
+    STATS_FLUSH_EVENTS), so the counters lag each worker by a few seconds.
+    """
+    
+    def __init__(self, ttl: int = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.ttl = int(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self._entries: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Counts not yet written to Redis, per site: site -> (first event time, counts)
+        self._pending: Dict[str, Tuple[float, Dict[str, int]]] = {}
+    
+    def get_local_key(self, key: str) -> str:
+        """Scope in-process keys to the current site"""
+        return f"{getattr(frappe.local, 'site', None) or ''}:{key}"
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached quote for a key, or None"""
+        local_key = self.get_local_key(key)
+        now = time.time()
+        value = None
+        
+        with self._lock:
+            entry = self._entries.get(local_key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(local_key)
+                value = entry[1]
+            elif entry:
+                del self._entries[local_key]
+        
+        if value is not None:
+            self.hits += 1
+            self.count('hits')
+            return value
+        
+        cached = None
+        try:
+            cached = frappe.cache().get_value(f"{REDIS_KEY_PREFIX}:{key}")
+        except Exception:
+            pass
+        
+        if cached and cached.get('expires_at', 0) > now:
+            self.store_local(local_key, cached['expires_at'], cached['value'])
+            self.hits += 1
+            self.count('hits')
+            return cached['value']
+        
+        self.misses += 1
+        self.count('misses')
+        return None
+    
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Cache a quote in both levels"""
+        expires_at = time.time() + self.ttl
+        self.store_local(self.get_local_key(key), expires_at, value)
+        
+        try:
+            frappe.cache().set_value(
+                f"{REDIS_KEY_PREFIX}:{key}",
+                {'expires_at': expires_at, 'value': value},
+                expires_in_sec=self.ttl
+            )
+        except Exception as e:
+            frappe.logger().warning(f"Could not store Aramex rate in Redis: {str(e)}")
+    
+    def store_local(self, local_key: str, expires_at: float, value: Dict[str, Any]) -> None:
+        """Insert into the in-process LRU, evicting the least recently used entries"""
+        with self._lock:
+            self._entries[local_key] = (expires_at, value)
+            self._entries.move_to_end(local_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        """Drop every in-process entry"""
+        with self._lock:
+            self._entries.clear()
+    
+    def count(self, counter: str) -> None:
+        """Add to a hit/miss counter, written to Redis once enough events or time have passed"""
+        site = getattr(frappe.local, 'site', None) or ''
+        now = time.monotonic()
+        
+        with self._lock:
+            since, counts = self._pending.setdefault(site, (now, {}))
+            counts[counter] = counts.get(counter, 0) + 1
+            due = sum(counts.values()) >= STATS_FLUSH_EVENTS or now - since >= STATS_FLUSH_INTERVAL
+        
+        if due:
+            self.flush_counts()
+    
+    def flush_counts(self) -> None:
+        """Write the current site's pending hit/miss counts to the shared counters"""
+        with self._lock:
+            pending = self._pending.pop(getattr(frappe.local, 'site', None) or '', None)
+        if not pending:
+            return
+        
+        try:
+            redis = frappe.cache()
+            key = redis.make_key(STATS_KEY)
+            pipeline = redis.pipeline()
+            for counter, amount in pending[1].items():
+                pipeline.hincrby(key, counter, amount)
+            pipeline.execute()
+        except Exception:
+            pass
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_rate_cache: Optional[RateCache] = None
+_rate_cache_lock = threading.Lock()
+
+
+def get_rate_cache(settings: Optional[Dict[str, Any]] = None) -> RateCache:
+    """
+    Get the process-wide rate cache
+    
+    Args:
+        settings: Aramex settings; `rate_cache_ttl` and `rate_cache_size` tune the cache
+    
+    Returns:
+        Shared RateCache instance, rebuilt if its configuration changed
+    """
+    global _rate_cache
+    
+    settings = settings or {}
+    ttl = int(settings.get('rate_cache_ttl', DEFAULT_TTL))
+    max_entries = int(settings.get('rate_cache_size', DEFAULT_MAX_ENTRIES))
+    
+    cache = _rate_cache
+    if cache is None or cache.ttl != ttl or cache.max_entries != max_entries:
+        with _rate_cache_lock:
+            cache = _rate_cache
+            if cache is None or cache.ttl != ttl or cache.max_entries != max_entries:
+                cache = _rate_cache = RateCache(ttl, max_entries)
+    
+    return cache
+
+
+@frappe.whitelist()
+def get_rate_cache_stats() -> Dict[str, Any]:
+    """
+    Get rate cache hit and miss counters
+    
+    Shared counters include this worker's latest counts; other workers
+    write theirs in batches, so theirs may lag (see STATS_FLUSH_EVENTS).
+    
+    Returns:
+        Dictionary containing shared and per-process counters
+    """
+    try:
+        cache = get_rate_cache(get_aramex_client().settings)
+        cache.flush_counts()
+        # Raw HMGET: RedisWrapper.hgetall re-prefixes the key and unpickles values
+        hits, misses = (int(value or 0) for value in frappe.cache().hmget(frappe.cache().make_key(STATS_KEY), ['hits', 'misses']))
+        
+        return {
+            'success': True,
+            'stats': {
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else 0,
+                'process_hits': cache.hits,
+                'process_misses': cache.misses,
+                'process_entries': len(cache)
+            },
+            'message': 'Rate cache statistics retrieved successfully'
+        }
+    
+    except Exception as e:
+        frappe.log_error(f"Error getting rate cache stats: {str(e)}", "Aramex Rate Cache Error")
+        return {
+            'success': False,
+            'stats': {},
+            'message': f'Error retrieving rate cache statistics: {str(e)}'
+        }
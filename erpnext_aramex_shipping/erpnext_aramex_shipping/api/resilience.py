@@ -0,0 +1,179 @@
+import frappe
+import random
+from typing import Dict, Any, Optional, Tuple
+
+# Endpoints that are safe to resend: quoting, tracking and label printing do
+# not create anything on the Aramex side. CreateShipments is never retried.
+IDEMPOTENT_ENDPOINTS = {
+    'ShippingAPI.V2/RateCalculator/CalculateRate',
+    'ShippingAPI.V2/Tracking/TrackShipments',
+    'ShippingAPI.V2/Shipping/PrintLabel'
+}
+
+# HTTP statuses worth another attempt on an idempotent endpoint
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+DEFAULT_RETRY_POLICY = {
+    'max_retries': 2,
+    'backoff_base': 0.25,
+    'backoff_max': 2.0,
+    'connect_timeout': 5,
+    'read_timeout': 20,
+    'deadline': 30
+}
+
+DEFAULT_BREAKER_SETTINGS = {
+    'failure_threshold': 5,
+    'failure_window': 60,
+    'cooldown': 30
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised when the Aramex circuit breaker is open and requests fail fast"""
+    pass
+
+
+class AmbiguousRequestError(Exception):
+    """
+    Raised when a request was sent but its outcome is unknown
+    
+    A read timeout, a dropped connection or a 5xx answer may come after
+    Aramex acted on the request, so a CreateShipments call failing this way
+    may still have created the waybill.
+    """
+    pass
+
+
+class RetryPolicy:
+    """
+    Retry and timeout policy for a single Aramex endpoint
+    """
+    
+    def __init__(self, endpoint: str, idempotent: bool, max_retries: int, backoff_base: float,
+                 backoff_max: float, connect_timeout: float, read_timeout: float, deadline: float):
+        self.endpoint = endpoint
+        self.idempotent = idempotent
+        self.max_retries = int(max_retries) if idempotent else 0
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self.connect_timeout = float(connect_timeout)
+        self.read_timeout = float(read_timeout)
+        self.deadline = float(deadline)
+    
+    def get_timeout(self, remaining: float) -> Tuple[float, float]:
+        """Separate connect and read timeouts, capped by the time left before the deadline"""
+        remaining = max(remaining, 0.1)
+        return (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+    
+    def get_backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter for the given retry attempt (1-based)"""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+    
+    def can_retry(self, attempt: int, remaining: float) -> bool:
+        """Check whether another attempt is allowed and still fits before the deadline"""
+        return attempt < self.max_retries and remaining > self.connect_timeout
+
+
+def get_retry_policy(endpoint: str, settings: Dict[str, Any]) -> RetryPolicy:
+    """
+    Build the retry policy for an endpoint
+    
+    Args:
+        endpoint: Aramex endpoint path
+        settings: Aramex settings; `retry_policy` overrides the defaults for every
+            endpoint and `retry_policies` overrides them per endpoint
+    
+    Returns:
+        RetryPolicy for the endpoint
+    """
+    policy = dict(DEFAULT_RETRY_POLICY)
+    policy.update(settings.get('retry_policy') or {})
+    policy.update((settings.get('retry_policies') or {}).get(endpoint, {}))
+    
+    idempotent = policy.pop('idempotent', endpoint in IDEMPOTENT_ENDPOINTS)
+    return RetryPolicy(endpoint, idempotent, **policy)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared by every worker through Redis
+    
+    After `failure_threshold` failures within `failure_window` seconds the
+    circuit opens and requests fail fast for `cooldown` seconds. Once the
+    cooldown expires a single worker is let through as a probe; its success
+    closes the circuit and its failure opens it again.
+    """
+    
+    def __init__(self, name: str, failure_threshold: int, failure_window: int, cooldown: int):
+        self.name = name
+        self.failure_threshold = int(failure_threshold)
+        self.failure_window = int(failure_window)
+        self.cooldown = int(cooldown)
+    
+    def get_key(self, suffix: str) -> str:
+        """Site-scoped Redis key for this breaker"""
+        return frappe.cache().make_key(f"aramex_circuit:{self.name}:{suffix}")
+    
+    def allow_request(self) -> bool:
+        """Check whether a request may be sent to the carrier"""
+        try:
+            cache = frappe.cache()
+            # Raw GET: RedisWrapper.exists would prefix the already scoped key again
+            if cache.get(self.get_key('open')) is not None:
+                return False
+            
+            failures = cache.get(self.get_key('failures'))
+            if failures is None or int(failures) < self.failure_threshold:
+                return True
+            
+            # Circuit was tripped and the cooldown expired: allow one probe at a time
+            return bool(cache.set(self.get_key('probe'), 1, nx=True, ex=self.cooldown))
+        except Exception:
+            # Never let a Redis problem block carrier calls
+            return True
+    
+    def record_success(self) -> None:
+        """Close the circuit after a successful call"""
+        try:
+            frappe.cache().delete(self.get_key('failures'), self.get_key('probe'))
+        except Exception:
+            pass
+    
+    def record_failure(self) -> None:
+        """Count a failure and open the circuit once the threshold is reached"""
+        try:
+            cache = frappe.cache()
+            failures_key = self.get_key('failures')
+            
+            pipeline = cache.pipeline()
+            pipeline.incr(failures_key)
+            pipeline.expire(failures_key, self.failure_window + self.cooldown)
+            failures = pipeline.execute()[0]
+            
+            if failures >= self.failure_threshold:
+                cache.set(self.get_key('open'), 1, ex=self.cooldown)
+                cache.delete(self.get_key('probe'))
+                frappe.logger().warning(
+                    f"Aramex circuit '{self.name}' opened after {failures} failures"
+                )
+        except Exception:
+            pass
+
+
+def get_circuit_breaker(name: str, settings: Optional[Dict[str, Any]] = None) -> CircuitBreaker:
+    """
+    Get the circuit breaker for an Aramex host
+    
+    Args:
+        name: Breaker name, usually the API base URL
+        settings: Aramex settings; `circuit_breaker` overrides the defaults
+    
+    Returns:
+        CircuitBreaker instance
+    """
+    options = dict(DEFAULT_BREAKER_SETTINGS)
+    options.update((settings or {}).get('circuit_breaker') or {})
+    return CircuitBreaker(name, **options)
+
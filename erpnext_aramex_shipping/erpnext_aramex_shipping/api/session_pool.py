@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Defaults used when the Aramex settings do not override them
+DEFAULT_POOL_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 60
+DEFAULT_MAX_CONNECTIONS = 10
+
+
+class SessionPool:
+    """
+    Per-process pool of keep-alive requests.Session objects
+    
+    Sessions are checked out for the duration of a single call and returned
+    afterwards, so TCP and TLS connections to the Aramex host are reused
+    between requests instead of being opened for every call.
+    """
+    
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS):
+        self.pool_size = max(1, int(pool_size))
+        self.idle_timeout = float(idle_timeout)
+        self.max_connections = max(1, int(max_connections))
+        self._idle: Deque[Tuple[requests.Session, float]] = deque()
+        self._lock = threading.Lock()
+    
+    def create_session(self) -> requests.Session:
+        """Create a new session with a keep-alive connection adapter"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    
+    def acquire(self) -> Tuple[requests.Session, bool]:
+        """
+        Check out a session, evicting any that have been idle too long
+        
+        Returns:
+            Tuple of the session and whether it was reused from the pool
+        """
+        now = time.monotonic()
+        session = None
+        expired = []
+        
+        with self._lock:
+            if self._idle:
+                candidate, released_at = self._idle.pop()
+                if now - released_at <= self.idle_timeout:
+                    session = candidate
+                else:
+                    # The most recently used session is stale, so all of them are
+                    expired.append(candidate)
+                    expired.extend(idle for idle, _ in self._idle)
+                    self._idle.clear()
+        
+        for stale in expired:
+            stale.close()
+        
+        if session is None:
+            return self.create_session(), False
+        
+        return session, True
+    
+    def release(self, session: requests.Session) -> None:
+        """Return a session to the pool, or close it if the pool is already full"""
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((session, time.monotonic()))
+                return
+        
+        session.close()
+    
+    def post(self, url: str, reconnect: bool = True, **kwargs) -> requests.Response:
+        """
+        POST through a pooled session
+        
+        A connection error on a reused session usually means the server closed
+        the keep-alive connection while it sat in the pool. In that case the
+        idle sessions are dropped and, when `reconnect` is set, the request is
+        retried once on a fresh one.
+        """
+        session, reused = self.acquire()
+        try:
+            response = session.post(url, **kwargs)
+        except requests.exceptions.ConnectionError:
+            session.close()
+            if not reused:
+                raise
+            
+            self.clear()
+            if not reconnect:
+                raise
+            
+            session = self.create_session()
+            try:
+                response = session.post(url, **kwargs)
+            except Exception:
+                session.close()
+                raise
+        except Exception:
+            session.close()
+            raise
+        
+        self.release(session)
+        return response
+    
+    def clear(self) -> None:
+        """Close and drop every idle session"""
+        with self._lock:
+            sessions = [session for session, _ in self._idle]
+            self._idle.clear()
+        
+        for session in sessions:
+            session.close()
+    
+    def __len__(self) -> int:
+        return len(self._idle)
+
+
+_pools: Dict[Tuple[int, float, int], SessionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_session_pool(settings: Optional[Dict] = None) -> SessionPool:
+    """
+    Get the process-wide session pool for the given Aramex settings
+    
+    Args:
+        settings: Aramex settings; `session_pool_size`, `session_idle_timeout`
+            and `session_max_connections` tune the pool
+    
+    Returns:
+        Shared SessionPool instance
+    """
+    settings = settings or {}
+    key = (
+        int(settings.get('session_pool_size', DEFAULT_POOL_SIZE)),
+        float(settings.get('session_idle_timeout', DEFAULT_IDLE_TIMEOUT)),
+        int(settings.get('session_max_connections', DEFAULT_MAX_CONNECTIONS))
+    )
+    
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = SessionPool(*key)
+                _pools[key] = pool
+    
+    return pool
+
+
+def close_session_pools() -> None:
+    """Close every pooled session in this process"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    
+    for pool in pools:
+        pool.clear()
@@ -0,0 +1,188 @@
+import frappe
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, Any, Callable, Optional
+
+# Read-only endpoints whose identical concurrent requests are coalesced
+COALESCED_ENDPOINTS = {
+    'ShippingAPI.V2/RateCalculator/CalculateRate',
+    'ShippingAPI.V2/Tracking/TrackShipments'
+}
+
+DEFAULT_WAIT_TIMEOUT = 30
+# How long a finished result stays readable for followers that subscribed late
+RESULT_TTL = 5
+
+
+def get_request_key(endpoint: str, payload: Dict[str, Any]) -> str:
+    """
+    Key identifying identical requests
+    
+    The Transaction block only carries caller references, so it is left out;
+    everything else, including ClientInfo, must match.
+    """
+    normalized = {key: value for key, value in payload.items() if key != 'Transaction'}
+    digest = hashlib.sha1(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{endpoint}:{digest}"
+
+
+class InFlightCall:
+    """A request being executed by a leader that other callers wait on"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[str] = None
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent requests onto one outstanding call
+    
+    Within a process, threads with the same key wait on the first caller.
+    Across workers, the leader holds a Redis lock and publishes its result on
+    a pub/sub channel; followers subscribe and reuse that result. If the
+    leader does not answer within the wait timeout the follower makes the
+    call itself, so coalescing never turns into an outage.
+    """
+    
+    def __init__(self, wait_timeout: float = DEFAULT_WAIT_TIMEOUT, distributed: bool = True):
+        self.wait_timeout = float(wait_timeout)
+        self.distributed = distributed
+        self._calls: Dict[str, InFlightCall] = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Run `fn` once for all concurrent callers with the same key
+        
+        Args:
+            key: Request key, see get_request_key
+            fn: Callable performing the request
+        
+        Returns:
+            The shared result of `fn`
+        """
+        local_key = f"{getattr(frappe.local, 'site', None) or ''}:{key}"
+        
+        with self._lock:
+            call = self._calls.get(local_key)
+            leader = call is None
+            if leader:
+                call = self._calls[local_key] = InFlightCall()
+        
+        if not leader:
+            if call.done.wait(self.wait_timeout):
+                if call.error is not None:
+                    raise Exception(call.error)
+                return call.result
+            return fn()
+        
+        try:
+            call.result = self.do_distributed(key, fn) if self.distributed else fn()
+            return call.result
+        except Exception as e:
+            call.error = str(e)
+            raise
+        finally:
+            call.done.set()
+            with self._lock:
+                self._calls.pop(local_key, None)
+    
+    def do_distributed(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Coalesce across workers through a Redis lock and pub/sub channel"""
+        try:
+            cache = frappe.cache()
+            lock_key = cache.make_key(f"aramex_inflight:{key}:lock")
+            result_key = cache.make_key(f"aramex_inflight:{key}:result")
+            acquired = cache.set(lock_key, 1, nx=True, ex=max(int(self.wait_timeout), 1))
+        except Exception:
+            return fn()
+        
+        if acquired:
+            return self.lead(cache, lock_key, result_key, fn)
+        
+        shared = self.follow(cache, result_key)
+        if shared is None:
+            return fn()
+        
+        if shared.get('error') is not None:
+            raise Exception(shared['error'])
+        return shared['result']
+    
+    def lead(self, cache, lock_key: str, result_key: str, fn: Callable[[], Any]) -> Any:
+        """Run the request and publish its outcome to waiting workers"""
+        outcome = {'result': None, 'error': None}
+        try:
+            outcome['result'] = fn()
+            return outcome['result']
+        except Exception as e:
+            outcome['error'] = str(e)
+            raise
+        finally:
+            try:
+                message = json.dumps(outcome, default=str)
+                pipeline = cache.pipeline()
+                pipeline.set(result_key, message, ex=RESULT_TTL)
+                pipeline.publish(result_key, message)
+                pipeline.delete(lock_key)
+                pipeline.execute()
+            except Exception:
+                pass
+    
+    def follow(self, cache, result_key: str) -> Optional[Dict[str, Any]]:
+        """Wait for the leader's outcome; None if it never arrives"""
+        pubsub = cache.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(result_key)
+            
+            # The leader may have finished before we subscribed
+            stored = cache.get(result_key)
+            if stored is not None:
+                return json.loads(stored)
+            
+            deadline = time.monotonic() + self.wait_timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                
+                message = pubsub.get_message(timeout=min(remaining, 1.0))
+                if message and message.get('type') == 'message':
+                    return json.loads(message['data'])
+        except Exception:
+            return None
+        finally:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
+
+
+_single_flights: Dict[tuple, SingleFlight] = {}
+
+
+def get_single_flight(settings: Optional[Dict[str, Any]] = None) -> SingleFlight:
+    """
+    Get the process-wide single-flight group
+    
+    Args:
+        settings: Aramex settings; `single_flight_timeout` bounds how long
+            followers wait and `single_flight_distributed` toggles the Redis layer
+    
+    Returns:
+        Shared SingleFlight instance
+    """
+    settings = settings or {}
+    options = (
+        float(settings.get('single_flight_timeout', DEFAULT_WAIT_TIMEOUT)),
+        bool(settings.get('single_flight_distributed', True))
+    )
+    
+    group = _single_flights.get(options)
+    if group is None:
+        group = _single_flights.setdefault(options, SingleFlight(*options))
+    
+    return group
@@ -0,0 +1,102 @@
+import frappe
+from erpnext_aramex_shipping.shipment.events import create_event_table
+from erpnext_aramex_shipping.shipment.search import SEARCH_TABLE, create_search_table
+
+# Destination columns copied out of shipment_data so the dashboard can show
+# and filter them without reading the JSON blob
+DESTINATION_FIELDS = [
+    {
+        'fieldname': 'destination_city',
+        'label': 'Destination City',
+        'fieldtype': 'Data',
+        'insert_after': 'consignee_company',
+        'read_only': 1
+    },
+    {
+        'fieldname': 'destination_country_code',
+        'label': 'Destination Country Code',
+        'fieldtype': 'Data',
+        'insert_after': 'destination_city',
+        'read_only': 1
+    }
+]
+
+# Indexes backing get_shipments: keyset pagination on (creation_date, name),
+# alone and behind the status and customer filters
+LIST_INDEXES = {
+    'creation_date_name': ['creation_date', 'name'],
+    'status_creation_date_name': ['status', 'creation_date', 'name'],
+    'consignee_name_creation_date': ['consignee_name', 'creation_date']
+}
+
+
+def after_migrate():
+    """Bring Aramex Shipment columns, indexes and side tables up to date after every migrate"""
+    add_destination_fields()
+    add_shipment_indexes()
+    create_event_table()
+    add_search_index()
+
+
+def add_destination_fields():
+    """Add the destination columns and fill them for shipments created before they existed"""
+    if not frappe.db.table_exists('Aramex Shipment'):
+        return
+    
+    from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+    
+    try:
+        create_custom_fields({'Aramex Shipment': DESTINATION_FIELDS}, update=True)
+        frappe.db.sql("""
+            UPDATE `tabAramex Shipment`
+            SET `destination_city` = JSON_UNQUOTE(JSON_EXTRACT(`shipment_data`, '$.destination_city')),
+                `destination_country_code` = JSON_UNQUOTE(JSON_EXTRACT(`shipment_data`, '$.destination_country_code'))
+            WHERE `destination_city` IS NULL AND JSON_VALID(`shipment_data`)
+        """)
+        frappe.db.commit()
+    except Exception as e:
+        frappe.log_error(f"Error adding destination fields: {str(e)}", "Aramex Install Error")
+
+
+def add_shipment_indexes():
+    """
+    Add the indexes the label, tracking and listing paths rely on
+    
+    Failures are logged rather than raised so that duplicate shipment IDs
+    left over from before the unique index existed do not block a migrate.
+    """
+    if not frappe.db.table_exists('Aramex Shipment'):
+        return
+    
+    try:
+        frappe.db.add_unique('Aramex Shipment', ['aramex_shipment_id'], constraint_name='unique_aramex_shipment_id')
+    except Exception as e:
+        frappe.log_error(f"Error adding unique index on aramex_shipment_id: {str(e)}", "Aramex Install Error")
+    
+    for index_name, fields in LIST_INDEXES.items():
+        try:
+            frappe.db.add_index('Aramex Shipment', fields, index_name=index_name)
+        except Exception as e:
+            frappe.log_error(f"Error adding index {index_name}: {str(e)}", "Aramex Install Error")
+
+
+def add_search_index():
+    """
+    Create the shipment search table and, while it is empty, queue a full index build
+    
+    The build runs in the background so that a migrate over millions of
+    shipments does not wait on it; hooks keep the index current afterwards.
+    """
+    if not frappe.db.table_exists('Aramex Shipment'):
+        return
+    
+    try:
+        create_search_table()
+        if not frappe.db.sql(f"SELECT 1 FROM `{SEARCH_TABLE}` LIMIT 1"):
+            frappe.enqueue(
+                'erpnext_aramex_shipping.shipment.search.rebuild_search_index',
+                queue='long',
+                timeout=6 * 3600
+            )
+    except Exception as e:
+        frappe.log_error(f"Error creating shipment search index: {str(e)}", "Aramex Install Error")
@@ -0,0 +1,239 @@
+/**
+ * Client-side shipment search
+ * A lowercased trigram index over the searchable shipment fields, built once
+ * per load and updated with each change. Large lists are indexed and searched
+ * in a Web Worker running this same file, so typing never waits on a scan.
+ */
+// The worker runs this same file, from wherever the page loaded it
+const SEARCH_WORKER_URL = typeof document !== 'undefined' && document.currentScript
+    ? document.currentScript.src
+    : null;
+
+// Lists longer than this are indexed in a worker
+const SEARCH_WORKER_THRESHOLD = 5000;
+
+/**
+ * Trigram index mapping each three-character sequence to the keys of the
+ * texts containing it
+ */
+class ShipmentSearchIndex {
+    constructor() {
+        this.texts = new Map();
+        this.grams = new Map();
+    }
+
+    /**
+     * Distinct trigrams of a lowercased text
+     */
+    static trigrams(text) {
+        const grams = new Set();
+        for (let i = 0; i + 3 <= text.length; i++) {
+            grams.add(text.slice(i, i + 3));
+        }
+        return grams;
+    }
+
+    /**
+     * Replace the whole index
+     *
+     * @param {Array} entries - [key, text] pairs
+     */
+    reset(entries) {
+        this.texts = new Map();
+        this.grams = new Map();
+        this.upsert(entries);
+    }
+
+    /**
+     * Add or re-index entries
+     *
+     * @param {Array} entries - [key, text] pairs
+     */
+    upsert(entries) {
+        entries.forEach(([key, text]) => {
+            text = (text || '').toLowerCase();
+            if (this.texts.get(key) === text) return;
+            
+            this.remove([key]);
+            this.texts.set(key, text);
+            ShipmentSearchIndex.trigrams(text).forEach(gram => {
+                if (!this.grams.has(gram)) this.grams.set(gram, new Set());
+                this.grams.get(gram).add(key);
+            });
+        });
+    }
+
+    /**
+     * Drop entries from the index
+     */
+    remove(keys) {
+        keys.forEach(key => {
+            const text = this.texts.get(key);
+            if (text === undefined) return;
+            
+            this.texts.delete(key);
+            ShipmentSearchIndex.trigrams(text).forEach(gram => {
+                const postings = this.grams.get(gram);
+                postings.delete(key);
+                if (!postings.size) this.grams.delete(gram);
+            });
+        });
+    }
+
+    /**
+     * Keys of the texts containing the query
+     *
+     * Candidates come from intersecting the query's trigram postings,
+     * smallest first, and are confirmed with a substring check. Queries
+     * shorter than a trigram scan the prebuilt lowercased texts.
+     *
+     * @returns {Array|null} Matching keys, or null for an empty query
+     */
+    search(query) {
+        query = (query || '').trim().toLowerCase();
+        if (!query) return null;
+        
+        if (query.length < 3) {
+            return [...this.texts].filter(([, text]) => text.includes(query)).map(([key]) => key);
+        }
+        
+        const postings = [];
+        for (const gram of ShipmentSearchIndex.trigrams(query)) {
+            const keys = this.grams.get(gram);
+            if (!keys) return [];
+            postings.push(keys);
+        }
+        postings.sort((a, b) => a.size - b.size);
+        
+        const [smallest, ...rest] = postings;
+        return [...smallest].filter(key =>
+            rest.every(keys => keys.has(key)) && this.texts.get(key).includes(query)
+        );
+    }
+}
+
+/**
+ * Search over a shipment list, in the page or in a worker depending on its size
+ */
+class ShipmentSearch {
+    /**
+     * @param {Function} getKey - Key of a shipment
+     * @param {Function} getText - Searchable text of a shipment
+     */
+    constructor(getKey, getText) {
+        this.getKey = getKey;
+        this.getText = getText;
+        this.index = new ShipmentSearchIndex();
+        this.worker = null;
+        this.requests = new Map();
+        this.nextRequestId = 0;
+    }
+
+    entries(shipments) {
+        return shipments.map(shipment => [this.getKey(shipment), this.getText(shipment)]);
+    }
+
+    /**
+     * Rebuild the index for a freshly loaded list
+     */
+    setShipments(shipments) {
+        if (shipments.length > SEARCH_WORKER_THRESHOLD && typeof Worker !== 'undefined' && SEARCH_WORKER_URL) {
+            this.index = null;
+            this.post({ type: 'reset', entries: this.entries(shipments) });
+        } else {
+            this.stopWorker();
+            this.index = new ShipmentSearchIndex();
+            this.index.reset(this.entries(shipments));
+        }
+    }
+
+    /**
+     * Index added or changed shipments
+     */
+    upsert(shipments) {
+        if (!shipments.length) return;
+        if (this.worker) {
+            this.post({ type: 'upsert', entries: this.entries(shipments) });
+        } else {
+            this.index.upsert(this.entries(shipments));
+        }
+    }
+
+    /**
+     * Drop removed shipments by key
+     */
+    remove(keys) {
+        if (!keys.length) return;
+        if (this.worker) {
+            this.post({ type: 'remove', keys });
+        } else {
+            this.index.remove(keys);
+        }
+    }
+
+    /**
+     * Keys of the shipments matching a query
+     *
+     * @returns {Promise<Set|null>} Matching keys, or null for an empty query
+     */
+    async search(query) {
+        if (!this.worker) {
+            const keys = this.index.search(query);
+            return keys && new Set(keys);
+        }
+        
+        const id = ++this.nextRequestId;
+        const keys = await new Promise(resolve => {
+            this.requests.set(id, resolve);
+            this.post({ type: 'search', id, query });
+        });
+        return keys && new Set(keys);
+    }
+
+    post(message) {
+        if (!this.worker) {
+            this.worker = new Worker(SEARCH_WORKER_URL);
+            this.worker.onmessage = (e) => {
+                const resolve = this.requests.get(e.data.id);
+                this.requests.delete(e.data.id);
+                if (resolve) resolve(e.data.keys);
+            };
+        }
+        this.worker.postMessage(message);
+    }
+
+    stopWorker() {
+        if (!this.worker) return;
+        this.worker.terminate();
+        this.worker = null;
+        // Searches still waiting on the worker match nothing
+        this.requests.forEach(resolve => resolve([]));
+        this.requests.clear();
+    }
+}
+
+// Inside a worker, this file serves index requests posted by ShipmentSearch
+if (typeof window === 'undefined' && typeof importScripts === 'function') {
+    const index = new ShipmentSearchIndex();
+    self.onmessage = (e) => {
+        const message = e.data;
+        if (message.type === 'reset') {
+            index.reset(message.entries);
+        } else if (message.type === 'upsert') {
+            index.upsert(message.entries);
+        } else if (message.type === 'remove') {
+            index.remove(message.keys);
+        } else if (message.type === 'search') {
+            self.postMessage({ id: message.id, keys: index.search(message.query) });
+        }
+    };
+}
+
+// Export for the dashboards and for testing
+if (typeof window !== 'undefined') {
+    window.ShipmentSearch = ShipmentSearch;
+    window.ShipmentSearchIndex = ShipmentSearchIndex;
+}
+if (typeof module !== 'undefined' && module.exports) {
+    module.exports = { ShipmentSearch, ShipmentSearchIndex };
+}
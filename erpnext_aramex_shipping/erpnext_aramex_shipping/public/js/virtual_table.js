@@ -0,0 +1,174 @@
+/**
+ * Virtualized table body
+ * Renders only the rows inside the visible window of a scrolling container.
+ * A small pool of <tr> elements is recycled while scrolling and a row is only
+ * re-filled when the data bound to it changes.
+ */
+class VirtualTable {
+    /**
+     * @param {Object} options
+     * @param {HTMLElement} options.scrollContainer - Element with a bounded height that scrolls
+     * @param {HTMLElement} options.tbody - Table body the rows are rendered into
+     * @param {Function} options.createRow - Builds an empty <tr> with its cells
+     * @param {Function} options.updateRow - Fills a <tr> from a row object
+     * @param {Function} options.getKey - Key identifying a row, used by patchRow
+     * @param {number} options.rowHeight - Estimated row height in pixels, replaced by the measured one
+     * @param {number} options.overscan - Rows rendered above and below the visible window
+     * @param {Function} options.onEndReached - Called when the window reaches the last rows
+     */
+    constructor(options) {
+        this.scrollContainer = options.scrollContainer;
+        this.tbody = options.tbody;
+        this.createRow = options.createRow;
+        this.updateRow = options.updateRow;
+        this.getKey = options.getKey || (row => row.name);
+        this.rowHeight = options.rowHeight || 48;
+        this.overscan = options.overscan || 6;
+        this.onEndReached = options.onEndReached || null;
+        
+        this.rows = [];
+        this.indexByKey = new Map();
+        this.pool = [];
+        this.start = 0;
+        this.measured = false;
+        this.frame = null;
+        
+        this.topSpacer = this.createSpacer();
+        this.bottomSpacer = this.createSpacer();
+        this.tbody.replaceChildren(this.topSpacer, this.bottomSpacer);
+        
+        this.scrollContainer.addEventListener('scroll', () => this.scheduleRender(), { passive: true });
+        window.addEventListener('resize', () => this.scheduleRender());
+    }
+
+    /**
+     * Row standing in for the rows above or below the window
+     */
+    createSpacer() {
+        const spacer = document.createElement('tr');
+        spacer.className = 'virtual-spacer';
+        spacer.setAttribute('aria-hidden', 'true');
+        
+        const cell = document.createElement('td');
+        cell.colSpan = 100;
+        spacer.appendChild(cell);
+        return spacer;
+    }
+
+    /**
+     * Replace the rows; nodes still showing the same row objects are left untouched
+     */
+    setRows(rows) {
+        this.rows = rows;
+        this.indexByKey = new Map(rows.map((row, index) => [this.getKey(row), index]));
+        this.render();
+    }
+
+    /**
+     * Replace a single row by key and re-fill its <tr> if it is rendered
+     *
+     * @returns {boolean} Whether the row is in the table
+     */
+    patchRow(row) {
+        const index = this.indexByKey.get(this.getKey(row));
+        if (index === undefined) return false;
+        
+        this.rows[index] = row;
+        const element = this.pool[index - this.start];
+        if (element && element.boundRow !== row) {
+            this.updateRow(element, row);
+            element.boundRow = row;
+        }
+        return true;
+    }
+
+    scrollToTop() {
+        this.scrollContainer.scrollTop = 0;
+    }
+
+    /**
+     * Render on the next animation frame, once per frame however many scroll events fire
+     */
+    scheduleRender() {
+        if (this.frame) return;
+        this.frame = requestAnimationFrame(() => this.render());
+    }
+
+    /**
+     * Render the visible window
+     */
+    render() {
+        if (this.frame) {
+            cancelAnimationFrame(this.frame);
+            this.frame = null;
+        }
+        
+        const viewport = this.scrollContainer.clientHeight || this.rowHeight * 10;
+        const size = Math.ceil(viewport / this.rowHeight) + this.overscan * 2;
+        const first = Math.floor(this.scrollContainer.scrollTop / this.rowHeight) - this.overscan;
+        const start = Math.max(0, Math.min(first, this.rows.length - size));
+        const end = Math.min(this.rows.length, start + size);
+        
+        // Move the nodes that scrolled out of one end of the window to the other
+        const shift = start - this.start;
+        if (shift > 0 && shift < this.pool.length) {
+            const recycled = this.pool.splice(0, shift);
+            recycled.forEach(element => this.tbody.insertBefore(element, this.bottomSpacer));
+            this.pool.push(...recycled);
+        } else if (shift < 0 && -shift < this.pool.length) {
+            const recycled = this.pool.splice(this.pool.length + shift);
+            const firstElement = this.pool[0] || this.bottomSpacer;
+            recycled.forEach(element => this.tbody.insertBefore(element, firstElement));
+            this.pool.unshift(...recycled);
+        }
+        this.start = start;
+        
+        while (this.pool.length < end - start) {
+            const element = this.createRow();
+            this.tbody.insertBefore(element, this.bottomSpacer);
+            this.pool.push(element);
+        }
+        while (this.pool.length > end - start) {
+            this.pool.pop().remove();
+        }
+        
+        this.pool.forEach((element, offset) => {
+            const row = this.rows[start + offset];
+            if (element.boundRow !== row) {
+                this.updateRow(element, row);
+                element.boundRow = row;
+            }
+        });
+        
+        this.setSpacerHeight(this.topSpacer, start * this.rowHeight);
+        this.setSpacerHeight(this.bottomSpacer, (this.rows.length - end) * this.rowHeight);
+        
+        if (!this.measured && this.pool.length) {
+            const height = this.pool[0].getBoundingClientRect().height;
+            if (height) {
+                this.measured = true;
+                if (Math.abs(height - this.rowHeight) > 1) {
+                    this.rowHeight = height;
+                    this.scheduleRender();
+                }
+            }
+        }
+        
+        if (this.onEndReached && this.rows.length && end >= this.rows.length - this.overscan) {
+            this.onEndReached();
+        }
+    }
+
+    setSpacerHeight(spacer, height) {
+        spacer.style.height = `${height}px`;
+        spacer.style.display = height ? '' : 'none';
+    }
+}
+
+// Export for the dashboards and for testing
+if (typeof window !== 'undefined') {
+    window.VirtualTable = VirtualTable;
+}
+if (typeof module !== 'undefined' && module.exports) {
+    module.exports = VirtualTable;
+}
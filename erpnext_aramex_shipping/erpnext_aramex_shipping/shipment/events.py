@@ -0,0 +1,183 @@
+import frappe
+import re
+from typing import Dict, List, Optional, Any
+from datetime import datetime, timezone
+
+# Append-only store of Aramex tracking events. It is a plain table rather
+# than a child DocType so that polls can add events with one INSERT IGNORE
+# and never rewrite the parent Aramex Shipment row.
+EVENT_TABLE = 'aramex_tracking_event'
+
+# Rows per multi-row INSERT
+INSERT_CHUNK_SIZE = 1000
+
+# Aramex serializes dates as /Date(1704096000000+0400)/
+ARAMEX_DATE_PATTERN = re.compile(r'/Date\((-?\d+)([+-]\d{4})?\)/')
+
+
+def create_event_table() -> None:
+    """Create the tracking event table, keyed on (waybill, UpdateDateTime, code)"""
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{EVENT_TABLE}` (
+            `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            `waybill` VARCHAR(140) NOT NULL,
+            `update_datetime` VARCHAR(64) NOT NULL,
+            `update_code` VARCHAR(32) NOT NULL DEFAULT '',
+            `event_time` DATETIME(6) NULL,
+            `location` VARCHAR(255) NULL,
+            `description` TEXT NULL,
+            `comments` TEXT NULL,
+            `creation` DATETIME(6) NOT NULL,
+            PRIMARY KEY (`id`),
+            UNIQUE KEY `unique_tracking_event` (`waybill`, `update_datetime`, `update_code`),
+            KEY `waybill_event_time` (`waybill`, `event_time`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+def parse_aramex_datetime(value: Any) -> Optional[datetime]:
+    """
+    Parse an Aramex UpdateDateTime into a naive datetime in server time
+    
+    Accepts the /Date(ms+zone)/ form returned by the JSON API and ISO strings.
+    """
+    if not value:
+        return None
+    
+    match = ARAMEX_DATE_PATTERN.match(str(value))
+    if match:
+        moment = datetime.fromtimestamp(int(match.group(1)) / 1000, tz=timezone.utc)
+        return moment.astimezone().replace(tzinfo=None)
+    
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    
+    return moment.astimezone().replace(tzinfo=None) if moment.tzinfo else moment
+
+
+def build_event_rows(tracking_results: List[Dict[str, Any]], now: datetime) -> List[tuple]:
+    """Flatten parsed tracking results into event table rows"""
+    rows = []
+    for tracking_result in tracking_results:
+        waybill = tracking_result.get('waybill_number')
+        if not waybill:
+            continue
+        
+        for event in tracking_result.get('events') or []:
+            if not event.get('date'):
+                continue
+            rows.append((
+                waybill,
+                str(event['date']),
+                event.get('code') or '',
+                parse_aramex_datetime(event['date']),
+                event.get('location'),
+                event.get('status'),
+                event.get('comments'),
+                now
+            ))
+    
+    return rows
+
+
+def append_tracking_events(tracking_results: List[Dict[str, Any]]) -> int:
+    """
+    Append tracking events, skipping ones already stored
+    
+    Args:
+        tracking_results: Results as returned by parse_tracking_response
+    
+    Returns:
+        Number of new events stored
+    """
+    rows = build_event_rows(tracking_results, datetime.now())
+    inserted = 0
+    
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + INSERT_CHUNK_SIZE]
+        placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s)'] * len(chunk))
+        frappe.db.sql(
+            f"""
+            INSERT IGNORE INTO `{EVENT_TABLE}`
+                (`waybill`, `update_datetime`, `update_code`, `event_time`,
+                 `location`, `description`, `comments`, `creation`)
+            VALUES {placeholders}
+            """,
+            tuple(value for row in chunk for value in row)
+        )
+        inserted += frappe.db._cursor.rowcount
+    
+    return inserted
+
+
+def get_newest_event_time(tracking_result: Dict[str, Any]) -> Optional[datetime]:
+    """Time of the newest event in a tracking result, whatever order its events are in"""
+    times = [parse_aramex_datetime(event.get('date')) for event in tracking_result.get('events') or []]
+    times = [time for time in times if time]
+    return max(times) if times else None
+
+
+def get_latest_event_times(waybills: List[str]) -> Dict[str, datetime]:
+    """
+    Time of the newest stored event per waybill, read from the
+    (waybill, event_time) index
+    
+    Args:
+        waybills: Aramex shipment IDs
+    
+    Returns:
+        Event times by waybill, for waybills with stored events
+    """
+    if not waybills:
+        return {}
+    
+    rows = frappe.db.sql(
+        f"""
+        SELECT `waybill`, MAX(`event_time`) AS `event_time`
+        FROM `{EVENT_TABLE}`
+        WHERE `waybill` IN ({', '.join(['%s'] * len(waybills))})
+        GROUP BY `waybill`
+        """,
+        tuple(waybills),
+        as_dict=True
+    )
+    return {row['waybill']: row['event_time'] for row in rows if row['event_time']}
+
+
+def get_stored_events(waybills: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Stored tracking events per waybill, newest first
+    
+    Args:
+        waybills: Aramex shipment IDs
+    
+    Returns:
+        Events in the shape of parse_tracking_response, by waybill
+    """
+    events: Dict[str, List[Dict[str, Any]]] = {waybill: [] for waybill in waybills}
+    if not waybills:
+        return events
+    
+    rows = frappe.db.sql(
+        f"""
+        SELECT `waybill`, `update_datetime`, `update_code`, `location`, `description`, `comments`
+        FROM `{EVENT_TABLE}`
+        WHERE `waybill` IN ({', '.join(['%s'] * len(waybills))})
+        ORDER BY `waybill`, `event_time` DESC, `id` DESC
+        """,
+        tuple(waybills),
+        as_dict=True
+    )
+    
+    for row in rows:
+        events[row['waybill']].append({
+            'date': row['update_datetime'],
+            'location': row['location'] or '',
+            'status': row['description'] or '',
+            'comments': row['comments'] or '',
+            'code': row['update_code']
+        })
+    
+    return events
@@ -0,0 +1,280 @@
+import frappe
+import json
+from typing import Dict, Optional, Any
+from erpnext_aramex_shipping.api.aramex import get_aramex_client
+from erpnext_aramex_shipping.shipment.shipment import validate_shipment_data, create_aramex_shipment
+from erpnext_aramex_shipping.shipment.references import new_reference
+
+# Queue used for shipment creation unless settings override it; add it to the
+# bench workers in common_site_config.json to give it dedicated workers
+DEFAULT_SHIPMENT_QUEUE = 'aramex'
+FALLBACK_SHIPMENT_QUEUE = 'long'
+
+# How long an idempotency key and its outcome are remembered, in seconds
+DEFAULT_IDEMPOTENCY_TTL = 86400
+
+REALTIME_EVENT = 'aramex_shipment_created'
+
+
+def new_idempotency_key() -> str:
+    """
+    Key for a request sent without one
+    
+    Unique per call: two identical shipments are two waybills, so the key is
+    never derived from the shipment data. Clients retry with the returned key.
+    """
+    return frappe.generate_hash(length=32)
+
+
+def get_job_state_key(idempotency_key: str, user: str) -> str:
+    """
+    Site-scoped Redis key holding the state of a shipment job
+    
+    Keys are scoped by user, so one user's key never reads or blocks the
+    job of another.
+    """
+    return frappe.cache().make_key(f"aramex_shipment_job:{user}:{idempotency_key}")
+
+
+def get_job_state(idempotency_key: str, user: str) -> Optional[Dict[str, Any]]:
+    """Read the stored state of a shipment job"""
+    state = frappe.cache().get(get_job_state_key(idempotency_key, user))
+    return json.loads(state) if state else None
+
+
+def set_job_state(idempotency_key: str, user: str, state: Dict[str, Any], ttl: int, only_new: bool = False) -> bool:
+    """Store the state of a shipment job; with `only_new`, only if no state exists yet"""
+    return bool(frappe.cache().set(
+        get_job_state_key(idempotency_key, user),
+        json.dumps(state, default=str),
+        ex=ttl,
+        nx=only_new
+    ))
+
+
+def get_shipment_queue(settings: Dict[str, Any]) -> str:
+    """Queue for shipment jobs, falling back to `long` when the bench has no such workers"""
+    from frappe.utils.background_jobs import get_queue_list
+    
+    queue = settings.get('shipment_queue', DEFAULT_SHIPMENT_QUEUE)
+    return queue if queue in get_queue_list() else FALLBACK_SHIPMENT_QUEUE
+
+
+@frappe.whitelist()
+def enqueue_aramex_shipment(shipment_data: str, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Validate a shipment and create it with Aramex in a background job
+    
+    Sending the same idempotency key again returns the existing job, or its
+    result once finished, instead of creating a second waybill. Requests
+    without a key get a new one in the response, to be sent with retries.
+    Keys are scoped to the session user.
+    
+    Args:
+        shipment_data: JSON string containing complete shipment information
+        idempotency_key: Client-chosen key identifying this shipment request
+    
+    Returns:
+        Dictionary containing the job handle, or the result of an earlier run
+    """
+    try:
+        # Parse JSON data
+        if isinstance(shipment_data, str):
+            data = json.loads(shipment_data)
+        else:
+            data = shipment_data
+        
+        # Validate before queueing so the client hears about bad input at once
+        validation_errors = validate_shipment_data(data)
+        
+        if validation_errors:
+            return {
+                'success': False,
+                'message': f"Validation errors: {'; '.join(validation_errors)}"
+            }
+        
+        idempotency_key = idempotency_key or new_idempotency_key()
+        user = frappe.session.user
+        
+        settings = get_aramex_client().settings
+        
+        # Fix the reference now so a re-run of the job sends the same Reference1
+        if not data.get('reference'):
+            data['reference'] = new_reference('SHIP', settings)
+        
+        ttl = int(settings.get('idempotency_ttl', DEFAULT_IDEMPOTENCY_TTL))
+        job_id = f"aramex_shipment::{user}::{idempotency_key}"
+        state = {'status': 'queued', 'job_id': job_id, 'reference': data['reference']}
+        
+        if not set_job_state(idempotency_key, user, state, ttl, only_new=True):
+            existing = get_job_state(idempotency_key, user) or state
+            return {
+                'success': True,
+                'duplicate': True,
+                'idempotency_key': idempotency_key,
+                **existing,
+                'message': 'Shipment request already received'
+            }
+        
+        try:
+            frappe.enqueue(
+                'erpnext_aramex_shipping.shipment.jobs.process_shipment_job',
+                queue=get_shipment_queue(settings),
+                job_id=job_id,
+                shipment_data=data,
+                idempotency_key=idempotency_key,
+                user=user
+            )
+        except Exception:
+            # Nothing was queued, let the client retry with the same key
+            frappe.cache().delete(get_job_state_key(idempotency_key, user))
+            raise
+        
+        return {
+            'success': True,
+            'duplicate': False,
+            'idempotency_key': idempotency_key,
+            **state,
+            'message': 'Shipment creation queued'
+        }
+    
+    except json.JSONDecodeError:
+        return {
+            'success': False,
+            'message': 'Invalid JSON data provided'
+        }
+    except Exception as e:
+        frappe.log_error(f"Error in enqueue_aramex_shipment: {str(e)}", "Shipment Queue Error")
+        return {
+            'success': False,
+            'message': f'Error queueing shipment: {str(e)}'
+        }
+
+
+def find_created_shipment(reference: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Stored Aramex Shipment created under a reference, if any"""
+    if not reference:
+        return None
+    return frappe.db.get_value(
+        'Aramex Shipment', {'reference': reference},
+        ['name', 'aramex_shipment_id', 'foreign_hawb', 'label_url'], as_dict=True
+    )
+
+
+def resume_started_job(shipment_data: Dict[str, Any], idempotency_key: str) -> Dict[str, Any]:
+    """
+    Result for a job whose earlier run stopped after it started
+    
+    The earlier run may have created the waybill before it stopped, so the
+    shipment is never sent again: a stored shipment with the job's reference
+    becomes the result, otherwise the job is left for review.
+    
+    Returns:
+        create_aramex_shipment-style result; `needs_review` when nothing was found
+    """
+    reference = shipment_data.get('reference')
+    existing = find_created_shipment(reference)
+    
+    if existing:
+        return {
+            'success': True,
+            'shipment_id': existing.get('aramex_shipment_id'),
+            'reference': reference,
+            'foreign_hawb': existing.get('foreign_hawb'),
+            'label_url': existing.get('label_url'),
+            'erpnext_shipment_id': existing.get('name'),
+            'message': 'Shipment already created'
+        }
+    
+    frappe.log_error(
+        f"Shipment job {idempotency_key} for reference {reference} was interrupted "
+        f"and no shipment was saved; check Aramex before resubmitting",
+        "Shipment Queue Error"
+    )
+    return {
+        'success': False,
+        'needs_review': True,
+        'message': f'Shipment creation for reference {reference} was interrupted and needs review'
+    }
+
+
+def process_shipment_job(shipment_data: Dict[str, Any], idempotency_key: str, user: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Background job creating a queued shipment and publishing the result
+    
+    Args:
+        shipment_data: Dictionary containing complete shipment information
+        idempotency_key: Key the shipment was queued under
+        user: User who queued the shipment, notified through realtime
+    
+    Returns:
+        create_aramex_shipment result
+    """
+    user = user or frappe.session.user
+    settings = get_aramex_client().settings
+    ttl = int(settings.get('idempotency_ttl', DEFAULT_IDEMPOTENCY_TTL))
+    state = get_job_state(idempotency_key, user) or {}
+    
+    # A job re-run after the shipment was created must not create it again
+    if state.get('status') in ('finished', 'needs_review'):
+        return state.get('result')
+    
+    if state.get('status') == 'started':
+        result = resume_started_job(shipment_data, idempotency_key)
+    else:
+        set_job_state(idempotency_key, user, dict(state, status='started'), ttl)
+        result = create_aramex_shipment(shipment_data)
+    
+    if result.get('success'):
+        set_job_state(idempotency_key, user, dict(state, status='finished', result=result), ttl)
+    elif result.get('needs_review'):
+        # Interrupted, or Aramex gave no answer after the request was sent:
+        # kept for the full TTL so the same key cannot create a second waybill
+        set_job_state(idempotency_key, user, dict(state, status='needs_review', result=result), ttl)
+    else:
+        # Rejected by validation or by Aramex; keep the outcome briefly for
+        # the status endpoint, after which the same key may be submitted again
+        set_job_state(idempotency_key, user, dict(state, status='failed', result=result), min(ttl, 300))
+    
+    frappe.publish_realtime(
+        REALTIME_EVENT,
+        {'idempotency_key': idempotency_key, 'job_id': state.get('job_id'), 'result': result},
+        user=user
+    )
+    
+    return result
+
+
+@frappe.whitelist()
+def get_shipment_job_status(idempotency_key: str) -> Dict[str, Any]:
+    """
+    Get the state of a queued shipment, for clients that missed the realtime event
+    
+    Args:
+        idempotency_key: Key the session user queued the shipment under
+    
+    Returns:
+        Dictionary containing the job status and, once done, its result
+    """
+    try:
+        state = get_job_state(idempotency_key, frappe.session.user)
+        
+        if not state:
+            return {
+                'success': False,
+                'message': 'No shipment job found for this idempotency key'
+            }
+        
+        return {
+            'success': True,
+            'idempotency_key': idempotency_key,
+            **state,
+            'message': f"Shipment job is {state.get('status')}"
+        }
+    
+    except Exception as e:
+        frappe.log_error(f"Error getting shipment job status: {str(e)}", "Shipment Queue Error")
+        return {
+            'success': False,
+            'message': f'Error getting shipment job status: {str(e)}'
+        }
@@ -0,0 +1,277 @@
+import frappe
+import base64
+import json
+from typing import Dict, List, Optional, Any, Tuple
+from datetime import datetime, date, timedelta
+from erpnext_aramex_shipping.shipment.statuses import STATUS_GROUPS, get_status_group
+
+DOCTYPE = 'Aramex Shipment'
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Changes returned per delta-sync call
+MAX_SYNC_ROWS = 1000
+# Rows modified in the last seconds are left for the next sync, so a write
+# whose transaction commits a moment after a later one is not skipped. The
+# window must cover the time between a row's `modified` stamp and its
+# commit: the bulk writers in persistence re-stamp rows just before they
+# commit (after their hooks), leaving single saves, which commit at the end
+# of their request or job, as the longest gap.
+SYNC_SETTLE_SECONDS = 5
+
+# Columns read for a dashboard row; shipment_data and tracking_data are never loaded
+LIST_FIELDS = [
+    'name', 'aramex_shipment_id', 'reference', 'consignee_name', 'destination_city',
+    'destination_country_code', 'status', 'weight', 'creation_date', 'last_tracking_update'
+]
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Opaque cursor pointing just after a row in (creation_date, name) order"""
+    value = json.dumps([str(row['creation_date']), row['name']])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Position encoded by encode_cursor"""
+    try:
+        creation_date, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return creation_date, name
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def get_date_range(filters: Dict[str, Any]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """From/to bounds of the date filter, `period` (today, week, month) or explicit dates"""
+    from_date = filters.get('from_date')
+    to_date = filters.get('to_date')
+    
+    period = filters.get('period')
+    if period in ('today', 'week', 'month'):
+        today = datetime.combine(date.today(), datetime.min.time())
+        from_date = today - timedelta(days={'today': 0, 'week': 7, 'month': 30}[period])
+    
+    if isinstance(from_date, str):
+        from_date = datetime.fromisoformat(from_date)
+    if isinstance(to_date, str):
+        to_date = datetime.fromisoformat(to_date)
+        if len(filters['to_date']) <= 10:
+            # A bare date includes the whole day
+            to_date += timedelta(days=1)
+    
+    return from_date, to_date
+
+
+def build_conditions(filters: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    """
+    WHERE conditions for the dashboard filters
+    
+    Every filter maps to a column covered by an index added in install.py:
+    status, creation_date and consignee_name (prefix match).
+    """
+    conditions: List[str] = []
+    values: List[Any] = []
+    
+    status = filters.get('status')
+    if status in STATUS_GROUPS:
+        statuses = sorted(STATUS_GROUPS[status])
+        conditions.append(f"`status` IN ({', '.join(['%s'] * len(statuses))})")
+        values.extend(statuses)
+    elif status == 'in_transit':
+        statuses = sorted(set().union(*STATUS_GROUPS.values()))
+        conditions.append(f"`status` NOT IN ({', '.join(['%s'] * len(statuses))})")
+        values.extend(statuses)
+    elif status:
+        statuses = status if isinstance(status, list) else [status]
+        conditions.append(f"`status` IN ({', '.join(['%s'] * len(statuses))})")
+        values.extend(statuses)
+    
+    from_date, to_date = get_date_range(filters)
+    if from_date:
+        conditions.append("`creation_date` >= %s")
+        values.append(from_date)
+    if to_date:
+        conditions.append("`creation_date` < %s")
+        values.append(to_date)
+    
+    if filters.get('customer'):
+        conditions.append("`consignee_name` LIKE %s")
+        values.append(f"{escape_like(filters['customer'])}%")
+    
+    if filters.get('tracking_id'):
+        conditions.append("`aramex_shipment_id` LIKE %s")
+        values.append(f"{escape_like(filters['tracking_id'])}%")
+    
+    return conditions, values
+
+
+def escape_like(value: str) -> str:
+    """Escape LIKE wildcards in user input"""
+    return str(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def to_dashboard_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a shipment row the way the dashboard and realtime diffs name fields"""
+    destination = ', '.join(part for part in (row.get('destination_city'), row.get('destination_country_code')) if part)
+    return {
+        'name': row['name'],
+        'tracking_id': row.get('aramex_shipment_id'),
+        'reference': row.get('reference'),
+        'customer_name': row.get('consignee_name') or '',
+        'destination': destination,
+        'status': get_status_group(row.get('status')),
+        'aramex_status': row.get('status'),
+        'weight': row.get('weight'),
+        'created_at': row.get('creation_date'),
+        'last_tracking_update': row.get('last_tracking_update')
+    }
+
+
+def list_shipments(filters: Optional[Dict[str, Any]] = None, cursor: Optional[str] = None,
+                   limit: int = DEFAULT_PAGE_SIZE, order: str = 'desc') -> Dict[str, Any]:
+    """
+    One page of shipments in (creation_date, name) order
+    
+    Pages are addressed with a keyset cursor instead of an OFFSET, so each
+    page is an index range scan of `limit` rows however deep it is.
+    
+    Args:
+        filters: status (dashboard group or Aramex status), period or
+            from_date/to_date, customer and tracking_id prefixes
+        cursor: next_cursor of the previous page
+        limit: Rows per page, at most MAX_PAGE_SIZE
+        order: `desc` for newest first, `asc` for oldest first
+    
+    Returns:
+        Dictionary with the rows, next_cursor and has_more
+    """
+    filters = filters or {}
+    limit = min(max(int(limit or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    descending = str(order).lower() != 'asc'
+    comparison = '<' if descending else '>'
+    direction = 'DESC' if descending else 'ASC'
+    
+    conditions, values = build_conditions(filters)
+    if cursor:
+        creation_date, name = decode_cursor(cursor)
+        conditions.append(
+            f"(`creation_date` {comparison} %s OR (`creation_date` = %s AND `name` {comparison} %s))"
+        )
+        values.extend([creation_date, creation_date, name])
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    rows = frappe.db.sql(
+        f"""
+        SELECT {', '.join(f'`{field}`' for field in LIST_FIELDS)}
+        FROM `tab{DOCTYPE}`
+        {where}
+        ORDER BY `creation_date` {direction}, `name` {direction}
+        LIMIT %s
+        """,
+        tuple(values + [limit + 1]),
+        as_dict=True
+    )
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    return {
+        'rows': rows,
+        'next_cursor': encode_cursor(rows[-1]) if has_more else None,
+        'has_more': has_more
+    }
+
+
+def encode_sync_cursor(modified: Any, name: Optional[str], deleted_at: Any) -> str:
+    """
+    Opaque delta-sync cursor
+    
+    `modified` and `name` mark the last row sent; a `name` of None means
+    every row modified up to and including `modified` was sent. `deleted_at`
+    marks the last deletion sent.
+    """
+    value = json.dumps([str(modified), name, str(deleted_at)])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_sync_cursor(cursor: str) -> Tuple[str, Optional[str], str]:
+    """Position encoded by encode_sync_cursor"""
+    try:
+        modified, name, deleted_at = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return modified, name, deleted_at
+    except Exception:
+        raise ValueError('Invalid since cursor')
+
+
+def get_sync_cursor(now: Optional[datetime] = None) -> str:
+    """Cursor to sync from, taken before a full load so no change falls between the two"""
+    watermark = (now or datetime.now()) - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    return encode_sync_cursor(watermark, None, watermark)
+
+
+def list_changes(since: str, limit: int = MAX_SYNC_ROWS, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Shipments inserted, updated or deleted since a sync cursor
+    
+    Rows are read in (modified, name) order from the standard `modified`
+    index and deletions from Deleted Document, so a sync costs the number of
+    changes, not the size of the table. Filters are not applied: a client
+    needs to hear about rows that changed out of its filter too.
+    
+    Args:
+        since: Cursor from get_sync_cursor or a previous call
+        limit: Changed rows per call, at most MAX_SYNC_ROWS
+        now: Current time
+    
+    Returns:
+        Dictionary with the changed rows, the names of deleted shipments,
+        the next cursor and has_more
+    """
+    modified, name, deleted_at = decode_sync_cursor(since)
+    limit = min(max(int(limit or MAX_SYNC_ROWS), 1), MAX_SYNC_ROWS)
+    upper = (now or datetime.now()) - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    
+    if name is None:
+        condition = "`modified` > %s"
+        values: List[Any] = [modified]
+    else:
+        condition = "(`modified` > %s OR (`modified` = %s AND `name` > %s))"
+        values = [modified, modified, name]
+    
+    rows = frappe.db.sql(
+        f"""
+        SELECT {', '.join(f'`{field}`' for field in LIST_FIELDS)}, `modified`
+        FROM `tab{DOCTYPE}`
+        WHERE {condition} AND `modified` <= %s
+        ORDER BY `modified`, `name`
+        LIMIT %s
+        """,
+        tuple(values + [upper, limit + 1]),
+        as_dict=True
+    )
+    
+    deleted = frappe.db.sql(
+        """
+        SELECT `deleted_name`
+        FROM `tabDeleted Document`
+        WHERE `deleted_doctype` = %s AND `creation` > %s AND `creation` <= %s
+        ORDER BY `creation`
+        """,
+        (DOCTYPE, deleted_at, upper)
+    )
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    if has_more:
+        next_since = encode_sync_cursor(rows[-1]['modified'], rows[-1]['name'], upper)
+    else:
+        next_since = encode_sync_cursor(upper, None, upper)
+    
+    return {
+        'rows': rows,
+        'deleted': [row[0] for row in deleted],
+        'next_since': next_since,
+        'has_more': has_more
+    }
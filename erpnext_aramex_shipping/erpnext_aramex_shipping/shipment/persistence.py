@@ -0,0 +1,276 @@
+import frappe
+import re
+from typing import Dict, List, Optional, Any
+from datetime import datetime
+
+DOCTYPE = 'Aramex Shipment'
+
+# Rows per multi-row UPDATE statement
+UPDATE_CHUNK_SIZE = 500
+
+# Columns a bulk update may key on
+KEY_FIELDS = ('name', 'aramex_shipment_id')
+
+# Columns loaded for on_update hooks besides the updated ones, so hooks such
+# as the stats counters see the whole picture without a query per document
+HOOK_CONTEXT_FIELDS = {'status', 'creation_date', 'destination_city', 'destination_country_code'}
+
+FIELDNAME_PATTERN = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+# Document internals prepare_insert calls because Document.insert has no
+# public equivalent; present with these names in Frappe v14 and v15 and
+# checked by the test suite against the installed version
+INSERT_INTERNALS = ('_set_defaults', '_validate_links', '_validate')
+
+
+def get_doc_event_hooks(event: str) -> List[str]:
+    """Methods registered in doc_events for an Aramex Shipment event"""
+    return frappe.get_hooks('doc_events').get(DOCTYPE, {}).get(event, [])
+
+
+def run_doc_events(docs: List[Any], event: str) -> None:
+    """
+    Run the doc_events hooks that a per-document save would have run
+    
+    Bulk writes bypass Document.insert/save, so hooks registered for Aramex
+    Shipment (stats counters, search index, ...) are dispatched here instead.
+    A failing hook is logged and does not undo the write.
+    """
+    for method in get_doc_event_hooks(event):
+        handler = frappe.get_attr(method)
+        for doc in docs:
+            try:
+                handler(doc, event)
+            except Exception as e:
+                frappe.log_error(f"Error running {method} for {doc.name}: {str(e)}", "Shipment Hook Error")
+
+
+def prepare_insert(record: Dict[str, Any]) -> Any:
+    """
+    Build, name and validate a document as Document.insert would, without writing it
+    
+    Runs the steps of Document.insert up to db_insert, in the same order:
+    defaults, owner and timestamps, links, before_insert, naming through the
+    doctype's autoname rule (set_new_name), validate and before_save
+    (run_before_save_methods), then the mandatory and field type checks.
+    Permission checks are left out, as for any backend insert.
+    
+    Raises:
+        frappe.ValidationError: If the record is invalid
+    """
+    doc = frappe.get_doc(dict(record, doctype=DOCTYPE))
+    doc._set_defaults()
+    doc.set_user_and_timestamp()
+    doc.set_docstatus()
+    doc.check_if_latest()
+    doc._validate_links()
+    doc.run_method('before_insert')
+    # A record carrying a name keeps it, as with insert(set_name=...)
+    doc.set_new_name(set_name=record.get('name'))
+    
+    doc.flags.in_insert = True
+    doc.run_before_save_methods()
+    doc._validate()
+    doc.set_docstatus()
+    doc.flags.in_insert = False
+    return doc
+
+
+def touch_modified(keys: List[str], key_field: str = 'name') -> None:
+    """
+    Stamp `modified` of written rows with the current time, just before the commit
+    
+    Rows are stamped when written, but the doc_events hooks run before the
+    commit; re-stamping keeps the stamp within SYNC_SETTLE_SECONDS of the
+    commit however long the hooks took, so delta syncs do not pass over them.
+    """
+    now = datetime.now()
+    for start in range(0, len(keys), UPDATE_CHUNK_SIZE):
+        chunk = keys[start:start + UPDATE_CHUNK_SIZE]
+        frappe.db.sql(
+            f"UPDATE `tab{DOCTYPE}` SET `modified` = %s WHERE `{key_field}` IN ({', '.join(['%s'] * len(chunk))})",
+            tuple([now] + chunk)
+        )
+
+
+def insert_shipments(records: List[Dict[str, Any]], commit: bool = True) -> List[str]:
+    """
+    Insert many Aramex Shipment records with one multi-row INSERT
+    
+    Every record is named and validated before anything is written, so one
+    invalid record fails the whole batch. Rows hold the columns db_insert
+    would write (get_valid_dict), so defaults, naming_series and values set
+    in validate are stored as they would be by Document.insert.
+    
+    Args:
+        records: Document dictionaries, as built by build_shipment_record
+        commit: Commit once after the insert
+    
+    Returns:
+        Names of the inserted records, in order
+    """
+    if not records:
+        return []
+    
+    docs = [prepare_insert(record) for record in records]
+    names = [doc.name for doc in docs]
+    rows = [doc.get_valid_dict(convert_dates_to_str=True, ignore_virtual=True) for doc in docs]
+    fields = sorted({field for row in rows for field in row})
+    validate_fieldnames(fields)
+    
+    frappe.db.bulk_insert(DOCTYPE, fields, [[row.get(field) for field in fields] for row in rows])
+    
+    if get_doc_event_hooks('after_insert'):
+        run_doc_events(docs, 'after_insert')
+        touch_modified(names)
+    
+    if commit:
+        frappe.db.commit()
+    
+    return names
+
+
+def update_shipments(updates: List[Dict[str, Any]], key_field: str = 'name', commit: bool = True) -> int:
+    """
+    Apply many field updates to Aramex Shipment records in one transaction
+    
+    Each chunk of rows is written with a single UPDATE using CASE expressions,
+    so a tracking sweep costs a handful of statements instead of a load, save
+    and commit per document.
+    
+    Args:
+        updates: Dictionaries holding the key field and the fields to change
+        key_field: Column identifying the row, `name` or `aramex_shipment_id`
+        commit: Commit once after all chunks
+    
+    Returns:
+        Number of rows updated
+    """
+    if key_field not in KEY_FIELDS:
+        raise ValueError(f"Cannot update shipments keyed on {key_field}")
+    
+    updates = [update for update in updates if update.get(key_field)]
+    if not updates:
+        return 0
+    
+    hooks = get_doc_event_hooks('on_update')
+    before = load_rows(updates, key_field) if hooks else {}
+    
+    now = datetime.now()
+    updated = 0
+    for start in range(0, len(updates), UPDATE_CHUNK_SIZE):
+        chunk = updates[start:start + UPDATE_CHUNK_SIZE]
+        fields = sorted({field for update in chunk for field in update} - {key_field, 'name', 'doctype'})
+        if not fields:
+            continue
+        validate_fieldnames(fields)
+        
+        assignments = []
+        values: List[Any] = []
+        for field in fields:
+            rows = [update for update in chunk if field in update]
+            cases = ' '.join(['WHEN %s THEN %s'] * len(rows))
+            assignments.append(f"`{field}` = CASE `{key_field}` {cases} ELSE `{field}` END")
+            for update in rows:
+                values.extend([update[key_field], update[field]])
+        
+        keys = [update[key_field] for update in chunk]
+        values.extend([now, frappe.session.user])
+        values.extend(keys)
+        
+        frappe.db.sql(
+            f"""
+            UPDATE `tab{DOCTYPE}`
+            SET {', '.join(assignments)}, `modified` = %s, `modified_by` = %s
+            WHERE `{key_field}` IN ({', '.join(['%s'] * len(keys))})
+            """,
+            tuple(values)
+        )
+        updated += len(chunk)
+    
+    if hooks:
+        docs = []
+        for update in updates:
+            row = before.get(update[key_field])
+            if not row:
+                continue
+            doc = frappe.get_doc({**row, **update, 'doctype': DOCTYPE, 'modified': now})
+            doc._doc_before_save = frappe.get_doc(dict(row, doctype=DOCTYPE))
+            docs.append(doc)
+        run_doc_events(docs, 'on_update')
+        touch_modified([update[key_field] for update in updates], key_field)
+    
+    if commit:
+        frappe.db.commit()
+    
+    return updated
+
+
+def update_shipment_fields(shipment_id: str, values: Dict[str, Any], version_field: Optional[str] = None,
+                           commit: bool = True) -> bool:
+    """
+    Update a few fields of one shipment with a single targeted UPDATE
+    
+    Uses the unique index on aramex_shipment_id instead of looking up the
+    name, loading the whole document (with its shipment_data blob) and
+    saving it back.
+    
+    Args:
+        shipment_id: Aramex shipment ID
+        values: Fields to set
+        version_field: Timestamp field in `values`; the row is only written if
+            its stored value is not newer, so a slow concurrent update cannot
+            overwrite fresher data
+        commit: Commit after the update
+    
+    Returns:
+        True if a row was updated
+    """
+    fields = [field for field in values if field not in ('name', 'doctype', 'aramex_shipment_id')]
+    validate_fieldnames(fields + ([version_field] if version_field else []))
+    
+    hooks = get_doc_event_hooks('on_update')
+    before = load_rows([dict(values, aramex_shipment_id=shipment_id)], 'aramex_shipment_id') if hooks else {}
+    
+    now = datetime.now()
+    condition = ''
+    params: List[Any] = [values[field] for field in fields] + [now, frappe.session.user, shipment_id]
+    if version_field:
+        condition = f" AND (`{version_field}` IS NULL OR `{version_field}` <= %s)"
+        params.append(values[version_field])
+    
+    frappe.db.sql(
+        f"""
+        UPDATE `tab{DOCTYPE}`
+        SET {', '.join(f'`{field}` = %s' for field in fields)}, `modified` = %s, `modified_by` = %s
+        WHERE `aramex_shipment_id` = %s{condition}
+        """,
+        tuple(params)
+    )
+    updated = bool(frappe.db._cursor.rowcount)
+    
+    row = before.get(shipment_id)
+    if updated and row:
+        doc = frappe.get_doc({**row, **values, 'doctype': DOCTYPE, 'modified': now})
+        doc._doc_before_save = frappe.get_doc(dict(row, doctype=DOCTYPE))
+        run_doc_events([doc], 'on_update')
+    
+    if commit:
+        frappe.db.commit()
+    
+    return updated
+
+
+def load_rows(updates: List[Dict[str, Any]], key_field: str) -> Dict[str, Dict[str, Any]]:
+    """Load the current values of the updated fields, keyed on `key_field`"""
+    fields = sorted({field for update in updates for field in update} | HOOK_CONTEXT_FIELDS | {'name', key_field})
+    keys = [update[key_field] for update in updates]
+    rows = frappe.get_all(DOCTYPE, filters={key_field: ['in', keys]}, fields=fields)
+    return {row[key_field]: row for row in rows}
+
+
+def validate_fieldnames(fields: List[str]) -> None:
+    """Reject column names that are not plain identifiers before they reach SQL"""
+    for field in fields:
+        if not FIELDNAME_PATTERN.match(field):
+            raise ValueError(f"Invalid Aramex Shipment field: {field}")
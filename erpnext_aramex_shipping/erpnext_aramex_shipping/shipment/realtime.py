@@ -0,0 +1,74 @@
+import frappe
+from typing import Dict, List, Any
+from erpnext_aramex_shipping.shipment.listing import DOCTYPE
+from erpnext_aramex_shipping.shipment.statuses import get_status_group
+
+REALTIME_EVENT = 'shipment_updated'
+
+# Aramex Shipment fields pushed to dashboards, by the name the dashboard uses
+DASHBOARD_FIELDS = {
+    'name': 'name',
+    'aramex_shipment_id': 'tracking_id',
+    'reference': 'reference',
+    'consignee_name': 'customer_name',
+    'status': 'aramex_status',
+    'weight': 'weight',
+    'creation_date': 'created_at',
+    'last_tracking_update': 'last_tracking_update'
+}
+
+
+def build_shipment_diff(values: Dict[str, Any], created: bool = False) -> Dict[str, Any]:
+    """
+    Compact description of a shipment change for dashboards
+    
+    Only the dashboard fields present in `values` are included, so a status
+    change costs a few bytes instead of the whole row.
+    
+    Args:
+        values: Changed Aramex Shipment fields, including aramex_shipment_id,
+            and name for a new shipment
+        created: The shipment is new, dashboards should add it
+    
+    Returns:
+        Diff keyed by tracking_id
+    """
+    diff = {key: values[field] for field, key in DASHBOARD_FIELDS.items() if field in values}
+    
+    if 'status' in values:
+        diff['status'] = get_status_group(values['status'])
+    if 'destination_city' in values or 'destination_country_code' in values:
+        diff['destination'] = ', '.join(
+            part for part in (values.get('destination_city'), values.get('destination_country_code')) if part
+        )
+    
+    if created:
+        diff['created'] = True
+    
+    return diff
+
+
+def get_shipment_room() -> str:
+    """Socket.IO room of the Aramex Shipment doctype, joined through doctype_subscribe"""
+    from frappe.realtime import get_doctype_room
+    
+    return get_doctype_room(DOCTYPE)
+
+
+def publish_shipment_updates(diffs: List[Dict[str, Any]]) -> None:
+    """
+    Push shipment diffs to open dashboards in one realtime message
+    
+    The message goes to the Aramex Shipment doctype room, which only sockets
+    of users allowed to read shipments can join. Call after the change is
+    committed. A failure to publish is logged and never fails the write that
+    triggered it.
+    """
+    diffs = [diff for diff in diffs if diff.get('tracking_id')]
+    if not diffs:
+        return
+    
+    try:
+        frappe.publish_realtime(REALTIME_EVENT, {'shipments': diffs}, doctype=DOCTYPE, room=get_shipment_room())
+    except Exception as e:
+        frappe.log_error(f"Error publishing shipment updates: {str(e)}", "Aramex Realtime Error")
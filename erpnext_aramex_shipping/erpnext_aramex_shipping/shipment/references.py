@@ -0,0 +1,109 @@
+import frappe
+import threading
+from typing import Dict, Optional, Any, Tuple
+from datetime import datetime
+
+# Sequence numbers reserved per round trip unless settings override it
+DEFAULT_BLOCK_SIZE = 100
+
+SEQUENCE_KEY = 'aramex_reference_seq'
+SEQUENCE_DIGITS = 10
+
+
+class ReferenceAllocator:
+    """
+    Hand out unique, time-sortable shipment references
+    
+    Each process reserves a block of sequence numbers with one Redis INCRBY
+    (or one update of the Series table when Redis is unavailable) and serves
+    references from it in memory, so no call needs a database round trip.
+    References look like `SHIP_20240101120000_0000001234`: the timestamp
+    keeps them sortable by time and the shared sequence keeps them unique
+    across workers. Numbers reserved from the database carry a `D` marker,
+    as that sequence is independent of the Redis one.
+    """
+    
+    def __init__(self, block_size: int = DEFAULT_BLOCK_SIZE):
+        self.block_size = max(1, int(block_size))
+        # site -> (next sequence number, end of the reserved block, marker)
+        self._blocks: Dict[str, Tuple[int, int, str]] = {}
+        self._lock = threading.Lock()
+    
+    def reserve_block(self) -> Tuple[int, str]:
+        """Reserve the next block and return its last sequence number and marker"""
+        try:
+            return int(frappe.cache().incrby(frappe.cache().make_key(SEQUENCE_KEY), self.block_size)), ''
+        except Exception as e:
+            frappe.logger().warning(f"Reserving Aramex references from the database: {str(e)}")
+            return self.reserve_block_from_db(), 'D'
+    
+    def reserve_block_from_db(self) -> int:
+        """Reserve the next block through the Series table"""
+        if not frappe.db.sql("select current from `tabSeries` where name=%s for update", SEQUENCE_KEY):
+            frappe.db.sql("insert into `tabSeries` (name, current) values (%s, 0)", SEQUENCE_KEY)
+        
+        frappe.db.sql(
+            "update `tabSeries` set current = current + %s where name=%s",
+            (self.block_size, SEQUENCE_KEY)
+        )
+        return int(frappe.db.sql("select current from `tabSeries` where name=%s", SEQUENCE_KEY)[0][0])
+    
+    def next_sequence(self) -> str:
+        """Next formatted sequence number for the current site"""
+        site = getattr(frappe.local, 'site', None) or ''
+        
+        with self._lock:
+            next_value, end, marker = self._blocks.get(site, (1, 0, ''))
+            if next_value > end:
+                end, marker = self.reserve_block()
+                next_value = end - self.block_size + 1
+            
+            self._blocks[site] = (next_value + 1, end, marker)
+            return f"{marker}{next_value:0{SEQUENCE_DIGITS}d}"
+    
+    def new_reference(self, prefix: str) -> str:
+        """
+        Allocate a reference
+        
+        Args:
+            prefix: Reference prefix, e.g. SHIP or RATE
+        
+        Returns:
+            Unique reference sortable by creation time
+        """
+        sequence = self.next_sequence()
+        return f"{prefix}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{sequence}"
+
+
+_allocator: Optional[ReferenceAllocator] = None
+_allocator_lock = threading.Lock()
+
+
+def get_reference_allocator(settings: Optional[Dict[str, Any]] = None) -> ReferenceAllocator:
+    """
+    Get the process-wide reference allocator
+    
+    Args:
+        settings: Aramex settings; `reference_block_size` sets how many
+            sequence numbers are reserved at a time
+    
+    Returns:
+        Shared ReferenceAllocator instance
+    """
+    global _allocator
+    
+    block_size = int((settings or {}).get('reference_block_size', DEFAULT_BLOCK_SIZE))
+    
+    allocator = _allocator
+    if allocator is None or allocator.block_size != block_size:
+        with _allocator_lock:
+            allocator = _allocator
+            if allocator is None or allocator.block_size != block_size:
+                allocator = _allocator = ReferenceAllocator(block_size)
+    
+    return allocator
+
+
+def new_reference(prefix: str, settings: Optional[Dict[str, Any]] = None) -> str:
+    """Allocate a unique reference such as `SHIP_20240101120000_0000001234`"""
+    return get_reference_allocator(settings).new_reference(prefix)
@@ -0,0 +1,336 @@
+import frappe
+import base64
+import json
+import math
+from typing import Dict, List, Optional, Any, Set, Tuple
+from erpnext_aramex_shipping.shipment.listing import (
+    DOCTYPE, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, LIST_FIELDS, build_conditions
+)
+
+# Trigram side table, one row per (trigram, shipment). A FULLTEXT index
+# tokenizes on words and cannot match inside tracking numbers or HAWBs, so
+# searches look trigrams up here instead of scanning with LIKE '%term%'.
+SEARCH_TABLE = 'aramex_shipment_trigram'
+
+# Aramex Shipment fields a search matches
+SEARCH_FIELDS = [
+    'aramex_shipment_id', 'foreign_hawb', 'reference', 'consignee_name',
+    'destination_city', 'destination_country_code'
+]
+
+# Rows per multi-row INSERT, and shipments per batch when rebuilding
+INSERT_CHUNK_SIZE = 1000
+REBUILD_BATCH_SIZE = 2000
+
+# Share of a query's trigrams a shipment must contain; below 1.0 a typo in a
+# long term still finds the shipment, ranked below exact matches
+MIN_SIMILARITY = 0.8
+MIN_QUERY_LENGTH = 2
+MAX_QUERY_LENGTH = 64
+
+# Shipments scored per search: those holding one of the query's rarest
+# trigrams and passing the dashboard filters, most recently created first;
+# a query made only of common trigrams ranks the newest matches rather than
+# aggregating the whole table
+MAX_CANDIDATES = 5000
+
+
+def create_search_table() -> None:
+    """Create the trigram table; the primary key serves lookups by trigram"""
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE IF NOT EXISTS `{SEARCH_TABLE}` (
+            `trigram` CHAR(3) NOT NULL,
+            `shipment` VARCHAR(140) NOT NULL,
+            PRIMARY KEY (`trigram`, `shipment`),
+            KEY `shipment` (`shipment`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin
+    """)
+
+
+def normalize(value: Any) -> str:
+    """Lowercase a value and collapse its whitespace"""
+    return ' '.join(str(value).lower().split()) if value else ''
+
+
+def get_trigrams(values: List[Any]) -> Set[str]:
+    """
+    Trigrams of each value, padded with a space on both sides
+    
+    The padding makes every word start a trigram of its own (` du` in
+    `dubai`), which is what two-character queries are matched against.
+    """
+    trigrams: Set[str] = set()
+    for value in values:
+        text = normalize(value)
+        if text:
+            text = f" {text} "
+            trigrams.update(text[i:i + 3] for i in range(len(text) - 2))
+    return trigrams
+
+
+def get_query_trigrams(query: str) -> Tuple[Set[str], Set[str], int]:
+    """
+    Trigrams to look up for a query and how many a shipment must contain
+    
+    Returns:
+        Tuple of the trigrams scored, the query's own trigrams (which the
+        required count is taken from) and the required count
+    
+    Raises:
+        ValueError: If the query is shorter than MIN_QUERY_LENGTH
+    """
+    text = normalize(query)[:MAX_QUERY_LENGTH]
+    if len(text) < MIN_QUERY_LENGTH:
+        raise ValueError(f'Search needs at least {MIN_QUERY_LENGTH} characters')
+    
+    if len(text) < 3:
+        # Too short for a trigram: match the start of a word
+        return {f" {text}"}, {f" {text}"}, 1
+    
+    core = {text[i:i + 3] for i in range(len(text) - 2)}
+    required = max(1, math.ceil(len(core) * MIN_SIMILARITY))
+    # Shipments where a word starts with the query score one more
+    return core | {f" {text[:2]}"}, core, required
+
+
+def get_anchor_trigrams(core: Set[str], required: int) -> List[str]:
+    """
+    Rarest trigrams of a query, at least one of which every match contains
+    
+    A match holds `required` of the query's trigrams, so it misses at most
+    len(core) - required of them and must hold one of any len(core) -
+    required + 1. Postings are counted up to MAX_CANDIDATES per trigram,
+    which bounds the lookup however common a trigram is.
+    """
+    count = len(core) - required + 1
+    if count >= len(core):
+        return sorted(core)
+    
+    trigrams = sorted(core)
+    postings = frappe.db.sql(
+        ' UNION ALL '.join(
+            f"""
+            SELECT %s, COUNT(*) FROM (
+                SELECT 1 FROM `{SEARCH_TABLE}` WHERE `trigram` = %s LIMIT %s
+            ) AS `sample`
+            """
+            for _ in trigrams
+        ),
+        tuple(value for trigram in trigrams for value in (trigram, trigram, MAX_CANDIDATES))
+    )
+    rarest = sorted(postings, key=lambda row: (row[1], row[0]))
+    return [row[0] for row in rarest[:count]]
+
+
+def index_shipments(rows: List[Dict[str, Any]]) -> int:
+    """
+    Replace the trigrams of shipments
+    
+    Args:
+        rows: Dictionaries holding name and the SEARCH_FIELDS
+    
+    Returns:
+        Number of trigram rows written
+    """
+    if not rows:
+        return 0
+    
+    remove_from_index([row['name'] for row in rows])
+    
+    values = [
+        (trigram, row['name'])
+        for row in rows
+        for trigram in sorted(get_trigrams([row.get(field) for field in SEARCH_FIELDS]))
+    ]
+    for start in range(0, len(values), INSERT_CHUNK_SIZE):
+        chunk = values[start:start + INSERT_CHUNK_SIZE]
+        frappe.db.sql(
+            f"""
+            INSERT IGNORE INTO `{SEARCH_TABLE}` (`trigram`, `shipment`)
+            VALUES {', '.join(['(%s, %s)'] * len(chunk))}
+            """,
+            tuple(value for row in chunk for value in row)
+        )
+    
+    return len(values)
+
+
+def remove_from_index(names: List[str]) -> None:
+    """Drop the trigrams of shipments"""
+    if names:
+        frappe.db.sql(
+            f"DELETE FROM `{SEARCH_TABLE}` WHERE `shipment` IN ({', '.join(['%s'] * len(names))})",
+            tuple(names)
+        )
+
+
+def reindex_shipments(names: List[str]) -> int:
+    """Re-index shipments from their stored values"""
+    rows = frappe.get_all(DOCTYPE, filters={'name': ['in', names]}, fields=['name'] + SEARCH_FIELDS)
+    return index_shipments(rows)
+
+
+def on_shipment_insert(doc, method=None) -> None:
+    """doc_events hook: index a new shipment"""
+    try:
+        index_shipments([{field: doc.get(field) for field in ['name'] + SEARCH_FIELDS}])
+    except Exception as e:
+        frappe.log_error(f"Error indexing shipment {doc.name}: {str(e)}", "Aramex Search Error")
+
+
+def on_shipment_update(doc, method=None) -> None:
+    """doc_events hook: re-index a shipment when one of its searched fields changes"""
+    try:
+        before = doc.get_doc_before_save()
+        # New shipments are indexed by on_shipment_insert
+        if not before or all(doc.get(field) == before.get(field) for field in SEARCH_FIELDS):
+            return
+        
+        # Bulk updates pass only the changed fields, so read the stored row
+        reindex_shipments([doc.name])
+    except Exception as e:
+        frappe.log_error(f"Error re-indexing shipment {doc.name}: {str(e)}", "Aramex Search Error")
+
+
+def on_shipment_trash(doc, method=None) -> None:
+    """doc_events hook: drop a deleted shipment from the index"""
+    try:
+        remove_from_index([doc.name])
+    except Exception as e:
+        frappe.log_error(f"Error removing shipment {doc.name} from the search index: {str(e)}", "Aramex Search Error")
+
+
+def rebuild_search_index() -> int:
+    """
+    Background job indexing every shipment, in batches keyed on name
+    
+    Each batch replaces the trigrams of its shipments and commits, so
+    searches keep working while the index is rebuilt.
+    
+    Returns:
+        Number of shipments indexed
+    """
+    last_name = ''
+    indexed = 0
+    
+    while True:
+        rows = frappe.db.sql(
+            f"""
+            SELECT `name`, {', '.join(f'`{field}`' for field in SEARCH_FIELDS)}
+            FROM `tab{DOCTYPE}`
+            WHERE `name` > %s
+            ORDER BY `name`
+            LIMIT %s
+            """,
+            (last_name, REBUILD_BATCH_SIZE),
+            as_dict=True
+        )
+        if not rows:
+            break
+        
+        index_shipments(rows)
+        frappe.db.commit()
+        indexed += len(rows)
+        last_name = rows[-1]['name']
+    
+    frappe.logger().info(f"Aramex shipment search index rebuilt for {indexed} shipments")
+    return indexed
+
+
+def encode_search_cursor(row: Dict[str, Any]) -> str:
+    """Opaque cursor pointing just after a row in (search_score, name) order"""
+    value = json.dumps([int(row['search_score']), row['name']])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> Tuple[int, str]:
+    """Position encoded by encode_search_cursor"""
+    try:
+        score, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(score), name
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def search_shipments(query: str, filters: Optional[Dict[str, Any]] = None, cursor: Optional[str] = None,
+                     limit: int = DEFAULT_PAGE_SIZE, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    One page of shipments matching a search, best matches first
+    
+    Candidates are the shipments in the postings of the query's rarest
+    trigrams (see get_anchor_trigrams) that pass the dashboard filters, at
+    most MAX_CANDIDATES of them by `creation`, newest first. Only those are
+    scored against the rest of the query, so a common trigram never makes
+    the search aggregate its whole posting list, and a narrow filter is
+    applied before the cap rather than after it. Ties are broken by name,
+    descending, and pages follow on from the cursor's (score, name) rather
+    than an offset.
+    
+    Args:
+        query: Text to find in tracking ID, HAWB, reference, customer or destination
+        filters: Dashboard filters applied on top, as for list_shipments
+        cursor: next_cursor of the previous page
+        limit: Rows per page, at most MAX_PAGE_SIZE
+        fields: Aramex Shipment columns to return, LIST_FIELDS by default
+    
+    Returns:
+        Dictionary with the rows (each with a search_score), next_cursor and has_more
+    """
+    trigrams, core, required = get_query_trigrams(query)
+    limit = min(max(int(limit or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    # The cursor is taken from the last row's name
+    fields = list(fields or LIST_FIELDS)
+    if 'name' not in fields:
+        fields.insert(0, 'name')
+    
+    conditions, values = build_conditions(filters or {})
+    anchors = get_anchor_trigrams(core, required)
+    # Candidates hold an anchor trigram; the filters narrow them before the cap
+    conditions.insert(0, f"""`name` IN (
+        SELECT `shipment` FROM `{SEARCH_TABLE}` WHERE `trigram` IN ({', '.join(['%s'] * len(anchors))})
+    )""")
+    values[:0] = anchors
+    
+    page_where = ''
+    page_values: List[Any] = []
+    if cursor:
+        score, name = decode_search_cursor(cursor)
+        page_where = "WHERE `matches`.`score` < %s OR (`matches`.`score` = %s AND `name` < %s)"
+        page_values = [score, score, name]
+    
+    rows = frappe.db.sql(
+        f"""
+        SELECT {', '.join(f'`tab{DOCTYPE}`.`{field}`' for field in fields)},
+            `matches`.`score` AS `search_score`
+        FROM (
+            SELECT `postings`.`shipment`, COUNT(*) AS `score`
+            FROM (
+                SELECT `name` AS `shipment`
+                FROM `tab{DOCTYPE}`
+                WHERE {' AND '.join(conditions)}
+                ORDER BY `creation` DESC
+                LIMIT %s
+            ) AS `candidates`
+            INNER JOIN `{SEARCH_TABLE}` AS `postings`
+                ON `postings`.`shipment` = `candidates`.`shipment`
+                AND `postings`.`trigram` IN ({', '.join(['%s'] * len(trigrams))})
+            GROUP BY `postings`.`shipment`
+            HAVING `score` >= %s
+        ) AS `matches`
+        INNER JOIN `tab{DOCTYPE}` ON `tab{DOCTYPE}`.`name` = `matches`.`shipment`
+        {page_where}
+        ORDER BY `search_score` DESC, `name` DESC
+        LIMIT %s
+        """,
+        tuple(values) + (MAX_CANDIDATES,) + tuple(sorted(trigrams)) + (required,) + tuple(page_values) + (limit + 1,),
+        as_dict=True
+    )
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    return {
+        'rows': rows,
+        'next_cursor': encode_search_cursor(rows[-1]) if has_more else None,
+        'has_more': has_more
+    }
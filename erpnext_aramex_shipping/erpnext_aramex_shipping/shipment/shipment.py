@@ -2,7 +2,33 @@ import frappe
 import json
 from typing import Dict, List, Optional, Any
 from datetime import datetime
-from erpnext_aramex_shipping.api.aramex import get_shipping_rates, create_shipment, generate_shipping_label, track_shipment
+from erpnext_aramex_shipping.api.aramex import (
+    get_shipping_rates, create_shipment, create_shipments, generate_shipping_label, track_shipment, get_aramex_client
+)
+from erpnext_aramex_shipping.api.rate_cache import get_rate_cache, get_rate_cache_key
+from erpnext_aramex_shipping.shipment.references import new_reference
+from erpnext_aramex_shipping.shipment.persistence import insert_shipments, update_shipment_fields
+from erpnext_aramex_shipping.shipment.events import append_tracking_events, get_stored_events
+from erpnext_aramex_shipping.shipment.realtime import build_shipment_diff, publish_shipment_updates
+from erpnext_aramex_shipping.shipment.search import search_shipments
+from erpnext_aramex_shipping.shipment.tracking_cache import (
+    get_cached_tracking, set_cached_tracking, is_stale, schedule_refresh
+)
+from erpnext_aramex_shipping.api.aramex_async import (
+    gather_shipping_rates, gather_shipping_rates_by_deadline, DEFAULT_CONCURRENCY
+)
+
+# Default overall time budget, in seconds, for a rate-shopping request
+DEFAULT_RATE_SHOPPING_DEADLINE = 8
+
+# Default typical transit time in days per product type, overridden per type by
+# the `product_transit_days` setting. CalculateRate does not return transit
+# times, so these are used to label and rank quotes of equal price.
+DEFAULT_PRODUCT_TRANSIT_DAYS = {
+    'PPX': 2,
+    'PDX': 5,
+    'CDS': 3
+}
 
 
 def validate_address_data(address_data: Dict[str, Any], address_type: str) -> List[str]:
@@ -92,6 +118,82 @@ def validate_shipment_data(shipment_data: Dict[str, Any]) -> List[str]:
     return errors
 
 
+def validate_rate_data(shipment_data: Dict[str, Any]) -> List[str]:
+    """
+    Validate the fields needed for a rate calculation
+    
+    Args:
+        shipment_data: Dictionary containing shipment information
+    
+    Returns:
+        List of validation errors
+    """
+    errors = []
+    required_fields = [
+        'origin_city', 'origin_country_code',
+        'destination_city', 'destination_country_code',
+        'weight', 'length', 'width', 'height'
+    ]
+    
+    for field in required_fields:
+        if not shipment_data.get(field):
+            errors.append(f"{field.replace('_', ' ').title()} is required")
+    
+    return errors
+
+
+def get_product_transit_days(settings: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Typical transit days per product type
+    
+    Args:
+        settings: Aramex settings; `product_transit_days` maps product type
+            codes to days, as a dictionary or JSON string
+    
+    Returns:
+        DEFAULT_PRODUCT_TRANSIT_DAYS updated with the configured values
+    """
+    configured = settings.get('product_transit_days') or {}
+    if isinstance(configured, str):
+        configured = json.loads(configured)
+    
+    transit_days = dict(DEFAULT_PRODUCT_TRANSIT_DAYS)
+    transit_days.update({code: int(days) for code, days in configured.items()})
+    return transit_days
+
+
+def get_rate_shopping_products(shipment_data: Dict[str, Any]) -> List[Dict[str, str]]:
+    """
+    List the product group and type combinations to quote for a shipment
+    
+    Domestic lanes are quoted under both product groups, international lanes
+    only under Express.
+    
+    Args:
+        shipment_data: Dictionary containing shipment information
+    
+    Returns:
+        List of dictionaries with product_group and product_type
+    """
+    configuration = get_shipping_configuration()
+    domestic = (shipment_data.get('origin_country_code') or '').upper() == \
+        (shipment_data.get('destination_country_code') or '').upper()
+    
+    products = []
+    for group in configuration.get('product_groups', []):
+        if group['code'] == 'DOM' and not domestic:
+            continue
+        for product_type in configuration.get('product_types', []):
+            products.append({
+                'product_group': group['code'],
+                'product_group_name': group['name'],
+                'product_type': product_type['code'],
+                'product_type_name': product_type['name']
+            })
+    
+    return products
+
+
 @frappe.whitelist()
 def fetch_shipping_rates(shipment_data: str) -> Dict[str, Any]:
     """
@@ -111,18 +213,7 @@ def fetch_shipping_rates(shipment_data: str) -> Dict[str, Any]:
             data = shipment_data
         
         # Validate required data for rate calculation
-        validation_errors = []
-        
-        # Basic validation for rate calculation
-        required_fields = [
-            'origin_city', 'origin_country_code',
-            'destination_city', 'destination_country_code',
-            'weight', 'length', 'width', 'height'
-        ]
-        
-        for field in required_fields:
-            if not data.get(field):
-                validation_errors.append(f"{field.replace('_', ' ').title()} is required")
+        validation_errors = validate_rate_data(data)
         
         if validation_errors:
             return {
@@ -133,10 +224,19 @@ def fetch_shipping_rates(shipment_data: str) -> Dict[str, Any]:
         
         # Add reference number if not provided
         if not data.get('reference'):
-            data['reference'] = f"RATE_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            data['reference'] = new_reference('RATE', get_aramex_client().settings)
         
-        # Call Aramex API
-        result = get_shipping_rates(data)
+        # Serve repeated lanes from the rate cache, call Aramex only on a miss
+        rate_cache = get_rate_cache(get_aramex_client().settings)
+        cache_key = get_rate_cache_key(data)
+        cached = rate_cache.get(cache_key)
+        
+        if cached is not None:
+            result = dict(cached, cached=True)
+        else:
+            result = get_shipping_rates(data)
+            if result.get('success') and result.get('rates'):
+                rate_cache.set(cache_key, result)
         
         # Log the rate request
         frappe.logger().info(f"Rate request for reference {data.get('reference')}: {result.get('message')}")
@@ -158,6 +258,280 @@ def fetch_shipping_rates(shipment_data: str) -> Dict[str, Any]:
         }
 
 
+@frappe.whitelist()
+def fetch_shipping_rates_bulk(shipment_profiles: str, concurrency: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Fetch shipping rates for many shipment profiles, e.g. a day's Sales Orders
+    
+    Identical profiles are quoted once; cache misses are quoted concurrently
+    with at most `concurrency` requests in flight.
+    
+    Args:
+        shipment_profiles: JSON string containing a list of shipment information,
+            each optionally carrying the `sales_order` it was built from
+        concurrency: Maximum number of Aramex requests in flight
+    
+    Returns:
+        Dictionary containing one result per profile, in input order
+    """
+    try:
+        # Parse JSON data
+        if isinstance(shipment_profiles, str):
+            profiles = json.loads(shipment_profiles)
+        else:
+            profiles = shipment_profiles
+        
+        if not isinstance(profiles, list):
+            return {
+                'success': False,
+                'results': [],
+                'message': 'A list of shipment profiles is required'
+            }
+        
+        settings = get_aramex_client().settings
+        if concurrency is None:
+            concurrency = settings.get('rate_bulk_concurrency', DEFAULT_CONCURRENCY)
+        
+        rate_cache = get_rate_cache(settings)
+        reference = new_reference('RATE', settings)
+        
+        # Validate each profile and group identical ones under their cache key
+        results: List[Optional[Dict[str, Any]]] = [None] * len(profiles)
+        keys: List[Optional[str]] = [None] * len(profiles)
+        unique: Dict[str, Dict[str, Any]] = {}
+        
+        for index, data in enumerate(profiles):
+            validation_errors = validate_rate_data(data) if isinstance(data, dict) else ['Shipment profile must be an object']
+            if validation_errors:
+                results[index] = {
+                    'success': False,
+                    'rates': [],
+                    'message': f"Validation errors: {'; '.join(validation_errors)}"
+                }
+                continue
+            
+            keys[index] = get_rate_cache_key(data)
+            unique.setdefault(keys[index], dict(data, reference=data.get('reference') or reference))
+        
+        quotes: Dict[str, Dict[str, Any]] = {}
+        for key in unique:
+            cached = rate_cache.get(key)
+            if cached is not None:
+                quotes[key] = dict(cached, cached=True)
+        
+        missing = [key for key in unique if key not in quotes]
+        if missing:
+            fetched = gather_shipping_rates([unique[key] for key in missing], int(concurrency))
+            for key, result in zip(missing, fetched):
+                quotes[key] = result
+                if result.get('success') and result.get('rates'):
+                    rate_cache.set(key, result)
+        
+        for index, key in enumerate(keys):
+            if key is not None:
+                results[index] = dict(quotes[key])
+        
+        for index, (data, result) in enumerate(zip(profiles, results)):
+            result['index'] = index
+            result['sales_order'] = data.get('sales_order') if isinstance(data, dict) else None
+        
+        succeeded = sum(1 for result in results if result.get('success'))
+        frappe.logger().info(
+            f"Bulk rate request: {len(profiles)} profiles, {len(unique)} unique, "
+            f"{len(missing)} quoted from Aramex, {len(profiles) - succeeded} failed"
+        )
+        
+        return {
+            'success': True,
+            'results': results,
+            'message': f'Shipping rates retrieved for {succeeded} of {len(profiles)} shipments'
+        }
+    
+    except json.JSONDecodeError:
+        return {
+            'success': False,
+            'results': [],
+            'message': 'Invalid JSON data provided'
+        }
+    except Exception as e:
+        frappe.log_error(f"Error in fetch_shipping_rates_bulk: {str(e)}", "Shipment Rate Fetch Error")
+        return {
+            'success': False,
+            'results': [],
+            'message': f'Error fetching shipping rates: {str(e)}'
+        }
+
+
+@frappe.whitelist()
+def shop_shipping_rates(shipment_data: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Quote every allowed product combination for a shipment concurrently
+    
+    Args:
+        shipment_data: JSON string containing shipment information
+        deadline: Seconds to wait for quotes; products still pending are dropped
+    
+    Returns:
+        Dictionary containing rates ranked by price and transit time, and the
+        products that could not be quoted
+    """
+    try:
+        # Parse JSON data
+        if isinstance(shipment_data, str):
+            data = json.loads(shipment_data)
+        else:
+            data = shipment_data
+        
+        validation_errors = validate_rate_data(data)
+        if validation_errors:
+            return {
+                'success': False,
+                'rates': [],
+                'unavailable': [],
+                'message': f"Validation errors: {'; '.join(validation_errors)}"
+            }
+        
+        settings = get_aramex_client().settings
+        if not data.get('reference'):
+            data['reference'] = new_reference('RATE', settings)
+        
+        if deadline is None:
+            deadline = settings.get('rate_shopping_deadline', DEFAULT_RATE_SHOPPING_DEADLINE)
+        
+        rate_cache = get_rate_cache(settings)
+        transit_days = get_product_transit_days(settings)
+        products = get_rate_shopping_products(data)
+        quotes = [dict(data, product_group=p['product_group'], product_type=p['product_type']) for p in products]
+        cache_keys = [get_rate_cache_key(quote) for quote in quotes]
+        results = [rate_cache.get(key) for key in cache_keys]
+        cached = [result is not None for result in results]
+        
+        # Quote the cache misses in parallel; whatever misses the deadline is dropped
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            fetched = gather_shipping_rates_by_deadline([quotes[index] for index in missing], float(deadline), len(missing))
+            for index, result in zip(missing, fetched):
+                results[index] = result
+                if result and result.get('success') and result.get('rates'):
+                    rate_cache.set(cache_keys[index], result)
+        
+        rates = []
+        unavailable = []
+        for product, result, from_cache in zip(products, results, cached):
+            if result is None:
+                unavailable.append(dict(product, reason='No quote before the deadline'))
+                continue
+            if not result.get('success') or not result.get('rates'):
+                unavailable.append(dict(product, reason=result.get('message') or 'No rate returned'))
+                continue
+            
+            for rate in result['rates']:
+                rates.append(dict(
+                    rate,
+                    **product,
+                    service_name=f"Aramex {product['product_group_name']} {product['product_type_name']}",
+                    transit_days=transit_days.get(product['product_type']),
+                    cached=from_cache
+                ))
+        
+        rates.sort(key=lambda rate: (
+            float(rate.get('total_amount') or 0),
+            rate['transit_days'] if rate['transit_days'] is not None else float('inf')
+        ))
+        for rank, rate in enumerate(rates, 1):
+            rate['rank'] = rank
+        
+        frappe.logger().info(
+            f"Rate shopping for reference {data.get('reference')}: "
+            f"{len(rates)} rates, {len(unavailable)} products unavailable"
+        )
+        
+        return {
+            'success': bool(rates),
+            'rates': rates,
+            'unavailable': unavailable,
+            'message': 'Shipping rates retrieved successfully' if rates else 'No product returned a rate'
+        }
+    
+    except json.JSONDecodeError:
+        return {
+            'success': False,
+            'rates': [],
+            'unavailable': [],
+            'message': 'Invalid JSON data provided'
+        }
+    except Exception as e:
+        frappe.log_error(f"Error in shop_shipping_rates: {str(e)}", "Shipment Rate Shopping Error")
+        return {
+            'success': False,
+            'rates': [],
+            'unavailable': [],
+            'message': f'Error shopping shipping rates: {str(e)}'
+        }
+
+
+def apply_shipment_defaults(shipment_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fill in default values for optional shipment fields
+    
+    Args:
+        shipment_data: Dictionary containing shipment information, updated in place
+    
+    Returns:
+        The same dictionary
+    """
+    defaults = {
+        'product_group': 'EXP',
+        'product_type': 'PPX',
+        'payment_type': 'P',
+        'dimension_unit': 'CM',
+        'weight_unit': 'KG',
+        'currency_code': 'AED',
+        'goods_origin_country': shipment_data.get('shipper_country_code', 'AE'),
+        'cod_amount': 0,
+        'insurance_amount': 0,
+        'collect_amount': 0
+    }
+    
+    for key, value in defaults.items():
+        if not shipment_data.get(key):
+            shipment_data[key] = value
+    
+    return shipment_data
+
+
+def build_shipment_record(shipment_data: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the Aramex Shipment document for a created shipment
+    
+    Args:
+        shipment_data: Dictionary containing shipment information
+        result: Successful create_shipment result
+    
+    Returns:
+        Document dictionary for frappe.get_doc
+    """
+    return {
+        'doctype': 'Aramex Shipment',
+        'reference': shipment_data.get('reference'),
+        'aramex_shipment_id': result.get('shipment_id'),
+        'foreign_hawb': result.get('foreign_hawb'),
+        'shipper_name': shipment_data.get('shipper_name'),
+        'shipper_company': shipment_data.get('shipper_company'),
+        'consignee_name': shipment_data.get('consignee_name'),
+        'consignee_company': shipment_data.get('consignee_company'),
+        'destination_city': shipment_data.get('destination_city'),
+        'destination_country_code': shipment_data.get('destination_country_code'),
+        'weight': shipment_data.get('weight'),
+        'dimensions': f"{shipment_data.get('length')}x{shipment_data.get('width')}x{shipment_data.get('height')} {shipment_data.get('dimension_unit')}",
+        'description': shipment_data.get('description'),
+        'status': 'Created',
+        'label_url': result.get('label_url'),
+        'creation_date': datetime.now(),
+        'shipment_data': json.dumps(shipment_data)
+    }
+
+
 @frappe.whitelist()
 def create_aramex_shipment(shipment_data: str) -> Dict[str, Any]:
     """
@@ -187,25 +561,10 @@ def create_aramex_shipment(shipment_data: str) -> Dict[str, Any]:
         
         # Add reference number if not provided
         if not data.get('reference'):
-            data['reference'] = f"SHIP_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            data['reference'] = new_reference('SHIP', get_aramex_client().settings)
         
         # Set default values for optional fields
-        defaults = {
-            'product_group': 'EXP',
-            'product_type': 'PPX',
-            'payment_type': 'P',
-            'dimension_unit': 'CM',
-            'weight_unit': 'KG',
-            'currency_code': 'AED',
-            'goods_origin_country': data.get('shipper_country_code', 'AE'),
-            'cod_amount': 0,
-            'insurance_amount': 0,
-            'collect_amount': 0
-        }
-        
-        for key, value in defaults.items():
-            if not data.get(key):
-                data[key] = value
+        apply_shipment_defaults(data)
         
         # Call Aramex API
         result = create_shipment(data)
@@ -213,27 +572,13 @@ def create_aramex_shipment(shipment_data: str) -> Dict[str, Any]:
         if result.get('success'):
             # Save shipment record in ERPNext
             try:
-                shipment_doc = frappe.get_doc({
-                    'doctype': 'Aramex Shipment',
-                    'reference': data.get('reference'),
-                    'aramex_shipment_id': result.get('shipment_id'),
-                    'foreign_hawb': result.get('foreign_hawb'),
-                    'shipper_name': data.get('shipper_name'),
-                    'shipper_company': data.get('shipper_company'),
-                    'consignee_name': data.get('consignee_name'),
-                    'consignee_company': data.get('consignee_company'),
-                    'weight': data.get('weight'),
-                    'dimensions': f"{data.get('length')}x{data.get('width')}x{data.get('height')} {data.get('dimension_unit')}",
-                    'description': data.get('description'),
-                    'status': 'Created',
-                    'label_url': result.get('label_url'),
-                    'creation_date': datetime.now(),
-                    'shipment_data': json.dumps(data)
-                })
+                record = build_shipment_record(data, result)
+                shipment_doc = frappe.get_doc(record)
                 shipment_doc.insert()
                 frappe.db.commit()
                 
                 result['erpnext_shipment_id'] = shipment_doc.name
+                publish_shipment_updates([build_shipment_diff(dict(record, name=shipment_doc.name), created=True)])
                 
             except Exception as e:
                 frappe.log_error(f"Error saving shipment record: {str(e)}", "Shipment Save Error")
@@ -258,6 +603,99 @@ def create_aramex_shipment(shipment_data: str) -> Dict[str, Any]:
         }
 
 
+@frappe.whitelist()
+def create_aramex_shipments(shipments_data: str, batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Create many shipments with batched Aramex calls after validation
+    
+    Args:
+        shipments_data: JSON string containing a list of complete shipment information
+        batch_size: Shipments per CreateShipments call
+    
+    Returns:
+        Dictionary containing one result per shipment, in input order
+    """
+    try:
+        # Parse JSON data
+        if isinstance(shipments_data, str):
+            shipments = json.loads(shipments_data)
+        else:
+            shipments = shipments_data
+        
+        if not isinstance(shipments, list):
+            return {
+                'success': False,
+                'results': [],
+                'message': 'A list of shipments is required'
+            }
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(shipments)
+        valid = []
+        settings = get_aramex_client().settings
+        
+        for index, data in enumerate(shipments):
+            validation_errors = validate_shipment_data(data) if isinstance(data, dict) else ['Shipment must be an object']
+            if validation_errors:
+                results[index] = {
+                    'success': False,
+                    'message': f"Validation errors: {'; '.join(validation_errors)}"
+                }
+                continue
+            
+            # References must be distinct so responses map back to their input
+            if not data.get('reference'):
+                data['reference'] = new_reference('SHIP', settings)
+            valid.append((index, apply_shipment_defaults(data)))
+        
+        if valid:
+            created = create_shipments([data for _, data in valid], batch_size)
+            outcomes = created.get('results') or [
+                {'success': False, 'message': created.get('message')} for _ in valid
+            ]
+            
+            for (index, data), result in zip(valid, outcomes):
+                results[index] = result
+            
+            # Save all created shipments with one INSERT and one commit
+            created_rows = [(data, result) for (_, data), result in zip(valid, outcomes) if result.get('success')]
+            try:
+                records = [build_shipment_record(data, result) for data, result in created_rows]
+                names = insert_shipments(records)
+                for (_, result), name in zip(created_rows, names):
+                    result['erpnext_shipment_id'] = name
+                publish_shipment_updates([
+                    build_shipment_diff(dict(record, name=name), created=True) for record, name in zip(records, names)
+                ])
+            except Exception as e:
+                frappe.db.rollback()
+                frappe.log_error(f"Error saving shipment records: {str(e)}", "Shipment Save Error")
+                for _, result in created_rows:
+                    result['warning'] = 'Shipment created but failed to save in ERPNext'
+        
+        succeeded = sum(1 for result in results if result.get('success'))
+        frappe.logger().info(f"Batch shipment creation: {succeeded} of {len(shipments)} shipments created")
+        
+        return {
+            'success': succeeded > 0,
+            'results': results,
+            'message': f'Created {succeeded} of {len(shipments)} shipments'
+        }
+    
+    except json.JSONDecodeError:
+        return {
+            'success': False,
+            'results': [],
+            'message': 'Invalid JSON data provided'
+        }
+    except Exception as e:
+        frappe.log_error(f"Error in create_aramex_shipments: {str(e)}", "Shipment Creation Error")
+        return {
+            'success': False,
+            'results': [],
+            'message': f'Error creating shipments: {str(e)}'
+        }
+
+
 @frappe.whitelist()
 def print_shipping_label(shipment_id: str) -> Dict[str, Any]:
     """
@@ -282,18 +720,8 @@ def print_shipping_label(shipment_id: str) -> Dict[str, Any]:
         if result.get('success'):
             # Update shipment record with label URL if exists
             try:
-                shipment_records = frappe.get_all(
-                    'Aramex Shipment',
-                    filters={'aramex_shipment_id': shipment_id},
-                    fields=['name']
-                )
+                update_shipment_fields(shipment_id, {'label_url': result.get('label_url')})
                 
-                if shipment_records:
-                    shipment_doc = frappe.get_doc('Aramex Shipment', shipment_records[0].name)
-                    shipment_doc.label_url = result.get('label_url')
-                    shipment_doc.save()
-                    frappe.db.commit()
-                    
             except Exception as e:
                 frappe.log_error(f"Error updating shipment label URL: {str(e)}", "Label Update Error")
         
@@ -311,12 +739,17 @@ def print_shipping_label(shipment_id: str) -> Dict[str, Any]:
 
 
 @frappe.whitelist()
-def track_aramex_shipment(shipment_id: str) -> Dict[str, Any]:
+def track_aramex_shipment(shipment_id: str, full_history: bool = False) -> Dict[str, Any]:
     """
     Track a shipment and update status
     
+    Results are cached per waybill. A fresh entry is returned as is; a stale
+    one is returned at once while a background job refreshes it, so repeated
+    views of a popular shipment cost one carrier call per TTL.
+    
     Args:
         shipment_id: Aramex shipment ID or tracking number
+        full_history: Bypass the cache and fetch the whole event history from Aramex again
         
     Returns:
         Dictionary containing tracking information
@@ -328,27 +761,86 @@ def track_aramex_shipment(shipment_id: str) -> Dict[str, Any]:
                 'message': 'Shipment ID is required'
             }
         
+        if isinstance(full_history, str):
+            full_history = full_history.lower() in ('1', 'true')
+        
+        settings = get_aramex_client().settings
+        cached = None if full_history else get_cached_tracking(shipment_id)
+        
+        if cached:
+            if is_stale(cached, settings):
+                schedule_refresh(shipment_id, settings)
+            return dict(cached['result'], cached=True)
+        
+        return refresh_shipment_tracking(shipment_id, full_history, settings=settings)
+    
+    except Exception as e:
+        frappe.log_error(f"Error in track_aramex_shipment: {str(e)}", "Shipment Tracking Error")
+        return {
+            'success': False,
+            'message': f'Error tracking shipment: {str(e)}'
+        }
+
+
+def refresh_shipment_tracking(shipment_id: str, full_history: bool = False, previous_status: Optional[str] = None,
+                              settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Track a shipment with Aramex, store new events and cache the result
+    
+    Once a shipment has stored events only its latest update is requested;
+    new events are appended to the event table and the response carries the
+    stored history. The shipment row is only written when its status changed.
+    Also runs as the background job refreshing stale cache entries.
+    
+    Args:
+        shipment_id: Aramex shipment ID or tracking number
+        full_history: Fetch the whole event history from Aramex
+        previous_status: Status known to be stored, looked up when not given
+        settings: Aramex settings
+    
+    Returns:
+        Dictionary containing tracking information
+    """
+    try:
+        settings = settings if settings is not None else get_aramex_client().settings
+        
+        # Tracking data is as fresh as the moment it was requested; a request
+        # that started earlier must not overwrite the result of a later one
+        requested_at = datetime.now()
+        
+        last_update_only = not full_history and bool(get_stored_events([shipment_id])[shipment_id])
+        
         # Call Aramex API
-        result = track_shipment(shipment_id)
+        result = track_shipment(shipment_id, last_update_only)
         
         if result.get('success') and result.get('tracking_results'):
-            # Update shipment record with latest tracking info
+            # Append new events and keep only the latest one on the shipment
             try:
-                shipment_records = frappe.get_all(
-                    'Aramex Shipment',
-                    filters={'aramex_shipment_id': shipment_id},
-                    fields=['name']
-                )
+                tracking_result = result['tracking_results'][0]
+                status = tracking_result.get('status', 'Unknown')
+                append_tracking_events(result['tracking_results'])
+                
+                if previous_status is None:
+                    cached = get_cached_tracking(shipment_id)
+                    previous_status = cached.get('status') if cached else frappe.db.get_value(
+                        'Aramex Shipment', {'aramex_shipment_id': shipment_id}, 'status'
+                    )
                 
-                if shipment_records:
-                    tracking_result = result['tracking_results'][0]
-                    shipment_doc = frappe.get_doc('Aramex Shipment', shipment_records[0].name)
-                    shipment_doc.status = tracking_result.get('status', 'Unknown')
-                    shipment_doc.tracking_data = json.dumps(result['tracking_results'])
-                    shipment_doc.last_tracking_update = datetime.now()
-                    shipment_doc.save()
+                if status != previous_status:
+                    changes = {
+                        'status': status,
+                        'tracking_data': json.dumps([dict(tracking_result, events=tracking_result.get('events', [])[:1])]),
+                        'last_tracking_update': requested_at
+                    }
+                    if update_shipment_fields(shipment_id, changes, version_field='last_tracking_update'):
+                        publish_shipment_updates([build_shipment_diff(dict(changes, aramex_shipment_id=shipment_id))])
+                else:
+                    # Commit the appended events, if any, without touching the shipment row
                     frappe.db.commit()
-                    
+                
+                tracking_result['events'] = get_stored_events([shipment_id])[shipment_id]
+                set_cached_tracking(shipment_id, result, status, settings)
+            
             except Exception as e:
                 frappe.log_error(f"Error updating shipment tracking: {str(e)}", "Tracking Update Error")
         
@@ -358,7 +850,7 @@ def track_aramex_shipment(shipment_id: str) -> Dict[str, Any]:
         return result
         
     except Exception as e:
-        frappe.log_error(f"Error in track_aramex_shipment: {str(e)}", "Shipment Tracking Error")
+        frappe.log_error(f"Error in refresh_shipment_tracking: {str(e)}", "Shipment Tracking Error")
         return {
             'success': False,
             'message': f'Error tracking shipment: {str(e)}'
@@ -366,24 +858,39 @@ def track_aramex_shipment(shipment_id: str) -> Dict[str, Any]:
 
 
 @frappe.whitelist()
-def get_shipment_history(limit: int = 50) -> Dict[str, Any]:
+def get_shipment_history(limit: int = 50, search: Optional[str] = None, cursor: Optional[str] = None) -> Dict[str, Any]:
     """
     Get shipment history from ERPNext
     
     Args:
         limit: Number of records to retrieve
+        search: Optional text to find in tracking ID, HAWB, reference,
+            customer or destination; matches are ranked best first
+        cursor: next_cursor returned with the previous page of matches
         
     Returns:
         Dictionary containing shipment history
     """
+    fields = [
+        'name', 'reference', 'aramex_shipment_id', 'foreign_hawb',
+        'shipper_name', 'consignee_name', 'weight', 'dimensions',
+        'description', 'status', 'creation_date', 'last_tracking_update'
+    ]
+    
     try:
+        if search:
+            page = search_shipments(search, cursor=cursor, limit=limit, fields=fields)
+            
+            return {
+                'success': True,
+                'shipments': page['rows'],
+                'next_cursor': page['next_cursor'],
+                'message': f"Found {len(page['rows'])} matching shipment records"
+            }
+        
         shipments = frappe.get_all(
             'Aramex Shipment',
-            fields=[
-                'name', 'reference', 'aramex_shipment_id', 'foreign_hawb',
-                'shipper_name', 'consignee_name', 'weight', 'dimensions',
-                'description', 'status', 'creation_date', 'last_tracking_update'
-            ],
+            fields=fields,
             order_by='creation_date desc',
             limit=limit
         )
@@ -394,6 +901,12 @@ def get_shipment_history(limit: int = 50) -> Dict[str, Any]:
             'message': f'Retrieved {len(shipments)} shipment records'
         }
         
+    except ValueError as e:
+        return {
+            'success': False,
+            'shipments': [],
+            'message': f'Invalid search: {str(e)}'
+        }
     except Exception as e:
         frappe.log_error(f"Error getting shipment history: {str(e)}", "Shipment History Error")
         return {
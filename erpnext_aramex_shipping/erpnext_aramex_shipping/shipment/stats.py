@@ -0,0 +1,329 @@
+import frappe
+from typing import Dict, List, Optional, Any
+from datetime import datetime, date, timedelta
+from erpnext_aramex_shipping.shipment.statuses import DELIVERED_STATUSES, get_status_group
+
+# Redis hash of counters: total, status:<group>, day:<YYYY-MM-DD>,
+# week:<YYYY-Www>, delivered_count, delivered_hours and reconciled_at
+STATS_KEY = 'aramex_shipment_stats'
+# Sorted set of shipment counts by destination
+DESTINATIONS_KEY = 'aramex_shipment_destinations'
+RECONCILE_LOCK_KEY = 'aramex_shipment_stats_reconcile'
+# Suffixes of the keys the hooks also write their increments to, and of the
+# keys the reconcile moves them to before replaying them
+DELTA_SUFFIX = 'delta'
+REPLAY_SUFFIX = 'replay'
+
+# Day and week counters kept by the nightly reconcile
+DAY_RETENTION = 90
+WEEK_RETENTION = 104
+
+TOP_DESTINATIONS = 10
+STATUS_GROUP_NAMES = ['pending', 'in_transit', 'delivered', 'failed']
+
+
+def get_key(name: str) -> str:
+    """Site-scoped Redis key"""
+    return frappe.cache().make_key(name)
+
+
+def day_field(value: date) -> str:
+    """Hash field counting shipments created on a day"""
+    return f"day:{value.isoformat()}"
+
+
+def week_field(value: date) -> str:
+    """Hash field counting shipments created in an ISO week"""
+    year, week, _ = value.isocalendar()
+    return f"week:{year}-W{week:02d}"
+
+
+def get_destination(doc) -> str:
+    """Destination label, as shown on the dashboard"""
+    return ', '.join(part for part in (doc.get('destination_city'), doc.get('destination_country_code')) if part)
+
+
+def to_date(value: Any) -> date:
+    """Date of a datetime, date or ISO string, today if empty"""
+    if not value:
+        return date.today()
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.date() if isinstance(value, datetime) else value
+
+
+def increment(pipeline, field: str, amount: Any) -> None:
+    """Queue an increment of a counter, and of its delta for the reconcile"""
+    key = get_key(STATS_KEY)
+    for target in (key, f"{key}:{DELTA_SUFFIX}"):
+        if isinstance(amount, float):
+            pipeline.hincrbyfloat(target, field, amount)
+        else:
+            pipeline.hincrby(target, field, amount)
+
+
+def increment_destination(pipeline, destination: str, amount: int) -> None:
+    """Queue an increment of a destination count, and of its delta for the reconcile"""
+    key = get_key(DESTINATIONS_KEY)
+    for target in (key, f"{key}:{DELTA_SUFFIX}"):
+        pipeline.zincrby(target, amount, destination)
+
+
+def count_shipment(doc, delta: int) -> None:
+    """Add (or with -1 remove) a shipment to every counter it belongs to"""
+    created = to_date(doc.get('creation_date') or doc.get('creation'))
+    destination = get_destination(doc)
+    
+    # Raw hash and sorted-set commands on pre-made keys
+    pipeline = frappe.cache().pipeline()
+    increment(pipeline, 'total', delta)
+    increment(pipeline, f"status:{get_status_group(doc.get('status'))}", delta)
+    increment(pipeline, day_field(created), delta)
+    increment(pipeline, week_field(created), delta)
+    if destination:
+        increment_destination(pipeline, destination, delta)
+    pipeline.execute()
+
+
+def on_shipment_insert(doc, method=None) -> None:
+    """doc_events hook: count a new shipment"""
+    try:
+        count_shipment(doc, 1)
+    except Exception as e:
+        frappe.log_error(f"Error counting shipment {doc.name}: {str(e)}", "Aramex Stats Error")
+
+
+def on_shipment_update(doc, method=None) -> None:
+    """doc_events hook: move a shipment between status counters when its status changes"""
+    try:
+        before = doc.get_doc_before_save()
+        if not before:
+            return
+        
+        old_group = get_status_group(before.get('status'))
+        new_group = get_status_group(doc.get('status'))
+        if old_group == new_group:
+            return
+        
+        pipeline = frappe.cache().pipeline()
+        increment(pipeline, f"status:{old_group}", -1)
+        increment(pipeline, f"status:{new_group}", 1)
+        
+        if doc.get('status') in DELIVERED_STATUSES and before.get('status') not in DELIVERED_STATUSES:
+            created = doc.get('creation_date') or before.get('creation_date')
+            delivered = doc.get('last_tracking_update') or datetime.now()
+            if isinstance(created, datetime) and isinstance(delivered, datetime):
+                increment(pipeline, 'delivered_count', 1)
+                increment(pipeline, 'delivered_hours', max((delivered - created).total_seconds(), 0) / 3600)
+        pipeline.execute()
+    except Exception as e:
+        frappe.log_error(f"Error updating stats for shipment {doc.name}: {str(e)}", "Aramex Stats Error")
+
+
+def on_shipment_trash(doc, method=None) -> None:
+    """doc_events hook: uncount a deleted shipment"""
+    try:
+        count_shipment(doc, -1)
+    except Exception as e:
+        frappe.log_error(f"Error uncounting shipment {doc.name}: {str(e)}", "Aramex Stats Error")
+
+
+def compute_stats() -> Dict[str, Any]:
+    """
+    Compute every counter from the database
+    
+    Only the nightly reconcile pays for these GROUP BY scans; the dashboard
+    reads the counters they seed.
+    
+    Returns:
+        Dictionary with the hash fields and the destination counts
+    """
+    fields: Dict[str, Any] = {f"status:{group}": 0 for group in STATUS_GROUP_NAMES}
+    
+    for row in frappe.db.sql(
+        "SELECT `status`, COUNT(*) AS `count` FROM `tabAramex Shipment` GROUP BY `status`", as_dict=True
+    ):
+        fields[f"status:{get_status_group(row['status'])}"] += row['count']
+    fields['total'] = sum(fields[f"status:{group}"] for group in STATUS_GROUP_NAMES)
+    
+    since = date.today() - timedelta(weeks=WEEK_RETENTION)
+    day_since = date.today() - timedelta(days=DAY_RETENTION)
+    for row in frappe.db.sql(
+        """
+        SELECT DATE(`creation_date`) AS `day`, COUNT(*) AS `count`
+        FROM `tabAramex Shipment`
+        WHERE `creation_date` >= %s
+        GROUP BY DATE(`creation_date`)
+        """,
+        since,
+        as_dict=True
+    ):
+        if row['day'] >= day_since:
+            fields[day_field(row['day'])] = row['count']
+        fields[week_field(row['day'])] = fields.get(week_field(row['day']), 0) + row['count']
+    
+    delivered = sorted(DELIVERED_STATUSES)
+    row = frappe.db.sql(
+        f"""
+        SELECT COUNT(*) AS `count`,
+            COALESCE(SUM(TIMESTAMPDIFF(SECOND, `creation_date`, `last_tracking_update`)), 0) / 3600 AS `hours`
+        FROM `tabAramex Shipment`
+        WHERE `status` IN ({', '.join(['%s'] * len(delivered))})
+            AND `creation_date` IS NOT NULL AND `last_tracking_update` IS NOT NULL
+        """,
+        tuple(delivered),
+        as_dict=True
+    )[0]
+    fields['delivered_count'] = row['count']
+    fields['delivered_hours'] = float(row['hours'] or 0)
+    
+    destinations = {}
+    for row in frappe.db.sql(
+        """
+        SELECT `destination_city`, `destination_country_code`, COUNT(*) AS `count`
+        FROM `tabAramex Shipment`
+        GROUP BY `destination_city`, `destination_country_code`
+        """,
+        as_dict=True
+    ):
+        destination = get_destination(row)
+        if destination:
+            destinations[destination] = destinations.get(destination, 0) + row['count']
+    
+    return {'fields': fields, 'destinations': destinations}
+
+
+def reconcile_stats() -> Dict[str, Any]:
+    """
+    Nightly job rebuilding the counters from the database
+    
+    Counters drift when a hook fails or Redis is flushed. The rebuilt values
+    are written under temporary keys and swapped in with RENAME, so readers
+    never see a half-written set, and day and week counters past their
+    retention are dropped on the way.
+    
+    Hooks keep counting while the database is scanned. They also add every
+    increment to delta keys, which are cleared before the scan and moved
+    aside in the same MULTI/EXEC as the swap; their increments are then
+    replayed onto the swapped-in counters, so none is lost.
+    
+    Returns:
+        The rebuilt hash fields
+    """
+    key = get_key(STATS_KEY)
+    destinations_key = get_key(DESTINATIONS_KEY)
+    frappe.cache().delete(f"{key}:{DELTA_SUFFIX}", f"{destinations_key}:{DELTA_SUFFIX}")
+    
+    computed = compute_stats()
+    fields = dict(computed['fields'], reconciled_at=datetime.now().isoformat())
+    
+    pipeline = frappe.cache().pipeline()
+    pipeline.delete(f"{key}:rebuild", f"{destinations_key}:rebuild")
+    pipeline.hset(f"{key}:rebuild", mapping=fields)
+    pipeline.rename(f"{key}:rebuild", key)
+    if computed['destinations']:
+        pipeline.zadd(f"{destinations_key}:rebuild", computed['destinations'])
+        pipeline.rename(f"{destinations_key}:rebuild", destinations_key)
+    else:
+        pipeline.delete(destinations_key)
+    # RENAME needs an existing key: a zero increment creates the delta hash
+    pipeline.hincrby(f"{key}:{DELTA_SUFFIX}", 'total', 0)
+    pipeline.rename(f"{key}:{DELTA_SUFFIX}", f"{key}:{REPLAY_SUFFIX}")
+    pipeline.zunionstore(f"{destinations_key}:{REPLAY_SUFFIX}", [f"{destinations_key}:{DELTA_SUFFIX}"])
+    pipeline.delete(f"{destinations_key}:{DELTA_SUFFIX}")
+    pipeline.execute()
+    
+    replay_deltas()
+    return fields
+
+
+def replay_deltas() -> None:
+    """Add the increments counted during a reconcile to the swapped-in counters"""
+    key = get_key(STATS_KEY)
+    destinations_key = get_key(DESTINATIONS_KEY)
+    
+    pipeline = frappe.cache().pipeline()
+    pipeline.hgetall(f"{key}:{REPLAY_SUFFIX}")
+    pipeline.zrange(f"{destinations_key}:{REPLAY_SUFFIX}", 0, -1, withscores=True)
+    deltas, destinations = pipeline.execute()
+    
+    pipeline = frappe.cache().pipeline()
+    for field, value in (deltas or {}).items():
+        field = field.decode() if isinstance(field, bytes) else field
+        if field == 'delivered_hours':
+            pipeline.hincrbyfloat(key, field, float(value))
+        elif int(value):
+            pipeline.hincrby(key, field, int(value))
+    for destination, count in destinations or []:
+        if count:
+            pipeline.zincrby(destinations_key, count, destination)
+    pipeline.delete(f"{key}:{REPLAY_SUFFIX}", f"{destinations_key}:{REPLAY_SUFFIX}")
+    pipeline.execute()
+
+
+def ensure_reconciled() -> None:
+    """Rebuild the counters now if they were never built, e.g. after a Redis flush"""
+    key = get_key(STATS_KEY)
+    if frappe.cache().hmget(key, ['reconciled_at'])[0] is not None:
+        return
+    
+    lock_key = get_key(RECONCILE_LOCK_KEY)
+    if frappe.cache().set(lock_key, 1, ex=300, nx=True):
+        try:
+            reconcile_stats()
+        finally:
+            frappe.cache().delete(lock_key)
+
+
+def read_stats(today: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Read the dashboard statistics with one HMGET and one ZREVRANGE
+    
+    Returns:
+        Totals per status group, counts for today, the last 7 and 30 days,
+        daily and weekly series, average delivery time and top destinations
+    """
+    today = today or date.today()
+    days = [today - timedelta(days=offset) for offset in range(30)]
+    weeks = []
+    for offset in range(12):
+        field = week_field(today - timedelta(weeks=offset))
+        if field not in weeks:
+            weeks.append(field)
+    
+    names = (
+        ['total', 'delivered_count', 'delivered_hours', 'reconciled_at']
+        + [f"status:{group}" for group in STATUS_GROUP_NAMES]
+        + [day_field(day) for day in days]
+        + weeks
+    )
+    values = dict(zip(names, frappe.cache().hmget(get_key(STATS_KEY), names)))
+    
+    def number(field: str) -> float:
+        value = values.get(field)
+        return float(value) if value is not None else 0
+    
+    daily = [{'date': day.isoformat(), 'count': int(number(day_field(day)))} for day in days]
+    delivered_count = number('delivered_count')
+    destinations = frappe.cache().zrevrange(get_key(DESTINATIONS_KEY), 0, TOP_DESTINATIONS - 1, withscores=True)
+    reconciled_at = values.get('reconciled_at')
+    
+    return {
+        'total_shipments': int(number('total')),
+        'pending_shipments': int(number('status:pending')),
+        'in_transit_shipments': int(number('status:in_transit')),
+        'delivered_shipments': int(number('status:delivered')),
+        'failed_shipments': int(number('status:failed')),
+        'today_shipments': daily[0]['count'],
+        'this_week_shipments': sum(item['count'] for item in daily[:7]),
+        'this_month_shipments': sum(item['count'] for item in daily),
+        'average_delivery_time': round(number('delivered_hours') / delivered_count / 24, 1) if delivered_count else 0,
+        'daily': daily,
+        'weekly': [{'week': field[len('week:'):], 'count': int(number(field))} for field in weeks],
+        'top_destinations': [
+            {'destination': destination.decode() if isinstance(destination, bytes) else destination, 'count': int(count)}
+            for destination, count in destinations
+            if count > 0
+        ],
+        'reconciled_at': reconciled_at.decode() if isinstance(reconciled_at, bytes) else reconciled_at
+    }
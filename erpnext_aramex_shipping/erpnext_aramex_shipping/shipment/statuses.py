@@ -0,0 +1,29 @@
+from typing import Optional
+
+# Statuses after which a shipment is no longer polled: Aramex update codes
+# for delivered, collected and returned, and the labels used by the app
+TERMINAL_STATUSES = ['SH005', 'SH006', 'SH069', 'Delivered', 'Returned', 'Cancelled']
+DELIVERED_STATUSES = {'SH005', 'SH006', 'Delivered'}
+FAILED_STATUSES = set(TERMINAL_STATUSES) - DELIVERED_STATUSES
+
+# Out for delivery: the status most likely to change within the hour
+OUT_FOR_DELIVERY_STATUSES = {'SH003', 'Out for Delivery'}
+# Created but not yet handed over to Aramex
+CREATED_STATUSES = {'Created', ''}
+
+# Dashboard status groups and the statuses they cover; in transit is
+# everything that is neither waiting for pickup nor finished
+STATUS_GROUPS = {
+    'pending': CREATED_STATUSES,
+    'delivered': DELIVERED_STATUSES,
+    'failed': FAILED_STATUSES
+}
+
+
+def get_status_group(status: Optional[str]) -> str:
+    """Dashboard status group of an Aramex status or update code"""
+    status = status or ''
+    for group, statuses in STATUS_GROUPS.items():
+        if status in statuses:
+            return group
+    return 'in_transit'
@@ -0,0 +1,425 @@
+import frappe
+import json
+import time
+from typing import Dict, List, Optional, Any
+from datetime import datetime
+from erpnext_aramex_shipping.api.aramex import get_aramex_client
+from erpnext_aramex_shipping.api.aramex_async import gather_tracking_batches
+from erpnext_aramex_shipping.shipment.persistence import update_shipments
+from erpnext_aramex_shipping.shipment.events import (
+    append_tracking_events, get_latest_event_times, get_newest_event_time
+)
+from erpnext_aramex_shipping.shipment.statuses import (
+    TERMINAL_STATUSES, DELIVERED_STATUSES, OUT_FOR_DELIVERY_STATUSES, CREATED_STATUSES
+)
+from erpnext_aramex_shipping.shipment.tracking_cache import invalidate_tracking
+from erpnext_aramex_shipping.shipment.realtime import build_shipment_diff, publish_shipment_updates
+
+# Waybills per TrackShipments call and concurrent calls per sweep, unless
+# settings override them
+DEFAULT_TRACKING_BATCH_SIZE = 50
+DEFAULT_TRACKING_CONCURRENCY = 10
+
+# Poll intervals in seconds
+OUT_FOR_DELIVERY_INTERVAL = 30 * 60
+CREATED_INTERVAL = 4 * 3600
+MIN_INTERVAL = 3600
+MAX_INTERVAL = 6 * 3600
+STUCK_INTERVAL = 12 * 3600
+RETRY_INTERVAL = 15 * 60
+
+# Transit time assumed for a lane until deliveries on it have been observed
+DEFAULT_TRANSIT_HOURS = 72
+# Weight of the newest delivery in the per-lane moving average
+TRANSIT_SMOOTHING = 0.2
+
+# Shipments tracked per scheduler run unless settings override it
+DEFAULT_MAX_POLLS_PER_RUN = 5000
+
+SCHEDULE_KEY = 'aramex_tracking_schedule'
+# Set once the schedule has been built from the database; gone after a Redis flush
+SEEDED_KEY = 'aramex_tracking_seeded'
+META_KEY = 'aramex_tracking_meta'
+LANE_TRANSIT_KEY = 'aramex_lane_transit'
+# Held while a poll runs so scheduler runs do not overlap; the TTL frees it
+# if the worker dies mid-run
+POLL_LOCK_KEY = 'aramex_tracking_poll_lock'
+POLL_LOCK_TTL = 15 * 60
+# Deletes the lock only while it still holds the caller's token, so a run
+# that outlived POLL_LOCK_TTL cannot release the lock of the run after it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def chunk(items: List[Any], size: int) -> List[List[Any]]:
+    """Split a list into consecutive chunks of at most `size` items"""
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def get_key(name: str) -> str:
+    """Site-scoped Redis key"""
+    return frappe.cache().make_key(name)
+
+
+def get_lane(shipment_data: Dict[str, Any]) -> str:
+    """Lane of a shipment, e.g. `AE-SA`"""
+    origin = shipment_data.get('origin_country_code') or shipment_data.get('shipper_country_code') or ''
+    destination = shipment_data.get('destination_country_code') or shipment_data.get('consignee_country_code') or ''
+    return f"{origin.upper()}-{destination.upper()}"
+
+
+def get_lane_transit_hours(lanes: List[str]) -> Dict[str, float]:
+    """Observed average transit time per lane, in hours"""
+    if not lanes:
+        return {}
+    
+    values = frappe.cache().hmget(get_key(LANE_TRANSIT_KEY), lanes)
+    return {lane: float(value) if value else DEFAULT_TRANSIT_HOURS for lane, value in zip(lanes, values)}
+
+
+def record_lane_transit(lane: str, created_at: float, delivered_at: float) -> None:
+    """Fold an observed delivery into the lane's moving average transit time"""
+    observed = max(delivered_at - created_at, 0) / 3600
+    key = get_key(LANE_TRANSIT_KEY)
+    # Raw hash commands: RedisWrapper.hget/hset re-prefix the key and pickle values
+    current = frappe.cache().hmget(key, [lane])[0]
+    average = observed if current is None else (1 - TRANSIT_SMOOTHING) * float(current) + TRANSIT_SMOOTHING * observed
+    frappe.cache().pipeline().hset(key, lane, round(average, 2)).execute()
+
+
+def get_poll_interval(status: Optional[str], age_hours: float, transit_hours: float) -> float:
+    """
+    Seconds until a shipment should be tracked again
+    
+    Shipments out for delivery are polled often. Fresh pickups are polled
+    slowly and more often as the expected delivery time approaches.
+    Shipments far past their lane's transit time are treated as stuck and
+    polled rarely.
+    
+    Args:
+        status: Last known status or Aramex update code
+        age_hours: Hours since the shipment was created
+        transit_hours: Typical transit time of the shipment's lane
+    
+    Returns:
+        Poll interval in seconds
+    """
+    status = status or ''
+    if status in OUT_FOR_DELIVERY_STATUSES:
+        return OUT_FOR_DELIVERY_INTERVAL
+    if age_hours > 2 * transit_hours:
+        return STUCK_INTERVAL
+    if status in CREATED_STATUSES:
+        return CREATED_INTERVAL
+    
+    remaining_hours = max(transit_hours - age_hours, 0)
+    return min(max(remaining_hours * 3600 / 4, MIN_INTERVAL), MAX_INTERVAL)
+
+
+def schedule_shipments(shipments: List[Dict[str, Any]], now: Optional[float] = None) -> None:
+    """
+    Add shipments to the tracking schedule, due immediately
+    
+    Args:
+        shipments: Dictionaries with aramex_shipment_id, lane and created (epoch seconds)
+        now: Current time in epoch seconds
+    """
+    if not shipments:
+        return
+    
+    now = now or time.time()
+    pipeline = frappe.cache().pipeline()
+    pipeline.zadd(get_key(SCHEDULE_KEY), {shipment['aramex_shipment_id']: now for shipment in shipments})
+    pipeline.hset(get_key(META_KEY), mapping={
+        shipment['aramex_shipment_id']: json.dumps({'lane': shipment['lane'], 'created': shipment['created']})
+        for shipment in shipments
+    })
+    pipeline.execute()
+
+
+def unschedule_shipments(shipment_ids: List[str]) -> None:
+    """Remove shipments from the tracking schedule for good"""
+    if not shipment_ids:
+        return
+    
+    pipeline = frappe.cache().pipeline()
+    pipeline.zrem(get_key(SCHEDULE_KEY), *shipment_ids)
+    pipeline.hdel(get_key(META_KEY), *shipment_ids)
+    pipeline.execute()
+
+
+def on_shipment_insert(doc, method=None) -> None:
+    """doc_events hook: start tracking a newly created shipment"""
+    if not doc.get('aramex_shipment_id'):
+        return
+    
+    try:
+        shipment_data = json.loads(doc.get('shipment_data') or '{}')
+        schedule_shipments([{
+            'aramex_shipment_id': doc.aramex_shipment_id,
+            'lane': get_lane(shipment_data),
+            'created': time.time()
+        }])
+    except Exception as e:
+        frappe.log_error(f"Error scheduling tracking for {doc.aramex_shipment_id}: {str(e)}", "Aramex Tracking Schedule Error")
+
+
+def seed_schedule() -> int:
+    """
+    Rebuild the tracking schedule from the database
+    
+    Runs when the schedule is missing, e.g. on the first run or after Redis
+    was flushed, and puts every open shipment in the queue as due now.
+    
+    Returns:
+        Number of shipments scheduled
+    """
+    # Only the country codes get_lane reads are extracted from the
+    # shipment_data blob, so the blobs never leave the database
+    shipments = frappe.db.sql(
+        f"""
+        SELECT `aramex_shipment_id`, `creation_date`,
+            JSON_UNQUOTE(JSON_EXTRACT(`shipment_data`, '$.origin_country_code')) AS `origin_country_code`,
+            JSON_UNQUOTE(JSON_EXTRACT(`shipment_data`, '$.shipper_country_code')) AS `shipper_country_code`,
+            JSON_UNQUOTE(JSON_EXTRACT(`shipment_data`, '$.destination_country_code')) AS `destination_country_code`,
+            JSON_UNQUOTE(JSON_EXTRACT(`shipment_data`, '$.consignee_country_code')) AS `consignee_country_code`
+        FROM `tabAramex Shipment`
+        WHERE IFNULL(`aramex_shipment_id`, '') != ''
+            AND `status` NOT IN ({', '.join(['%s'] * len(TERMINAL_STATUSES))})
+        """,
+        tuple(TERMINAL_STATUSES),
+        as_dict=True
+    )
+    
+    schedule_shipments([{
+        'aramex_shipment_id': shipment['aramex_shipment_id'],
+        'lane': get_lane(shipment),
+        'created': shipment['creation_date'].timestamp() if shipment.get('creation_date') else time.time()
+    } for shipment in shipments])
+    frappe.cache().set(get_key(SEEDED_KEY), 1)
+    
+    return len(shipments)
+
+
+def get_due_shipments(now: float, limit: int) -> List[str]:
+    """Shipment IDs whose next poll time has passed, most overdue first"""
+    ids = frappe.cache().zrangebyscore(get_key(SCHEDULE_KEY), '-inf', now, start=0, num=limit)
+    return [shipment_id.decode() if isinstance(shipment_id, bytes) else shipment_id for shipment_id in ids]
+
+
+def get_tracking_meta(shipment_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Lane and creation time stored for scheduled shipments"""
+    values = frappe.cache().hmget(get_key(META_KEY), shipment_ids) if shipment_ids else []
+    return {shipment_id: json.loads(value) for shipment_id, value in zip(shipment_ids, values) if value}
+
+
+def get_shipment_statuses(shipment_ids: List[str]) -> Dict[str, Optional[str]]:
+    """Current status of each shipment, in one query"""
+    rows = frappe.get_all(
+        'Aramex Shipment',
+        filters={'aramex_shipment_id': ['in', shipment_ids]},
+        fields=['aramex_shipment_id', 'status']
+    )
+    return {row['aramex_shipment_id']: row.get('status') for row in rows}
+
+
+def build_status_updates(current: Dict[str, Optional[str]], batch_results: List[Dict[str, Any]],
+                         tracked_at: datetime,
+                         latest_event_times: Optional[Dict[str, datetime]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Turn TrackShipments results into bulk updates for shipments whose status changed
+    
+    A shipment in one of the TERMINAL_STATUSES keeps it, and a result whose
+    newest event is older than the newest event already stored for the
+    shipment (a late push, a slow poll) is skipped. Like a single refresh,
+    the update keeps only the latest event on the shipment; the history is
+    in the event table.
+    
+    Args:
+        current: Current status per Aramex shipment ID
+        batch_results: track_shipments-style results, one per batch
+        tracked_at: Time the sweep started
+        latest_event_times: Newest stored event time per Aramex shipment ID,
+            read before the batch's events were appended
+    
+    Returns:
+        Updates for update_shipments, by Aramex shipment ID
+    """
+    latest_event_times = latest_event_times or {}
+    updates = {}
+    
+    for batch_result in batch_results:
+        for tracking_result in batch_result.get('tracking_results') or []:
+            shipment_id = tracking_result.get('waybill_number')
+            status = tracking_result.get('status')
+            if shipment_id not in current or not status or status == current[shipment_id]:
+                continue
+            if current[shipment_id] in TERMINAL_STATUSES:
+                continue
+            
+            event_time = get_newest_event_time(tracking_result)
+            applied = latest_event_times.get(shipment_id)
+            if event_time and applied and event_time < applied:
+                continue
+            
+            updates[shipment_id] = {
+                'aramex_shipment_id': shipment_id,
+                'status': status,
+                'tracking_data': json.dumps([dict(tracking_result, events=(tracking_result.get('events') or [])[:1])]),
+                'last_tracking_update': tracked_at
+            }
+    
+    return updates
+
+
+def reschedule(shipment_ids: List[str], statuses: Dict[str, Optional[str]], changed: set, tracked: set,
+               meta: Dict[str, Dict[str, Any]], now: float) -> List[str]:
+    """
+    Compute the next poll time of each tracked shipment
+    
+    Terminal shipments leave the queue; delivered ones teach the lane its
+    transit time. Shipments whose batch failed are retried shortly.
+    
+    Returns:
+        IDs of the shipments removed from the queue
+    """
+    lanes = get_lane_transit_hours(sorted({item.get('lane', '') for item in meta.values()}))
+    next_polls = {}
+    finished = []
+    
+    for shipment_id in shipment_ids:
+        status = statuses.get(shipment_id)
+        info = meta.get(shipment_id) or {'lane': '', 'created': now}
+        
+        if status in TERMINAL_STATUSES:
+            finished.append(shipment_id)
+            if shipment_id in changed and status in DELIVERED_STATUSES and info.get('lane'):
+                record_lane_transit(info['lane'], info['created'], now)
+            continue
+        
+        if shipment_id not in tracked:
+            next_polls[shipment_id] = now + RETRY_INTERVAL
+            continue
+        
+        age_hours = (now - info['created']) / 3600
+        transit_hours = lanes.get(info.get('lane', ''), DEFAULT_TRANSIT_HOURS)
+        next_polls[shipment_id] = now + get_poll_interval(status, age_hours, transit_hours)
+    
+    if next_polls:
+        frappe.cache().zadd(get_key(SCHEDULE_KEY), next_polls)
+    unschedule_shipments(finished)
+    
+    return finished
+
+
+def poll_shipments() -> Dict[str, Any]:
+    """
+    Scheduled job tracking the shipments that are due
+    
+    A run still going when the next one fires makes that one return at
+    once: a lock taken with SET NX, expiring after POLL_LOCK_TTL, is held
+    for the whole run. The lock stores a token of this run and is released
+    with a compare-and-delete, so a run that outlived the TTL leaves the
+    next run's lock alone.
+    
+    Returns:
+        Summary of the run; `skipped` when another run holds the lock
+    """
+    lock_key = get_key(POLL_LOCK_KEY)
+    token = frappe.generate_hash(length=20)
+    if not frappe.cache().set(lock_key, token, ex=POLL_LOCK_TTL, nx=True):
+        frappe.logger().info("Aramex tracking poll skipped: the previous run is still going")
+        return {'skipped': True}
+    
+    try:
+        return poll_due_shipments()
+    finally:
+        frappe.cache().eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+
+def poll_due_shipments() -> Dict[str, Any]:
+    """
+    Track the shipments that are due
+    
+    Each shipment carries a next-poll time in a Redis sorted set, computed
+    from its status, its age and its lane's typical transit time, so a run
+    only fetches what is due. The due waybills are grouped up to
+    `tracking_batch_size` per TrackShipments call, the calls run
+    concurrently (`tracking_concurrency`) and ask only for the latest
+    update of each waybill. New events are appended to the event table and
+    all status changes are written with one bulk update and a single commit.
+    
+    Returns:
+        Summary of the run
+    """
+    settings = get_aramex_client().settings
+    batch_size = int(settings.get('tracking_batch_size', DEFAULT_TRACKING_BATCH_SIZE))
+    concurrency = int(settings.get('tracking_concurrency', DEFAULT_TRACKING_CONCURRENCY))
+    limit = int(settings.get('tracking_max_polls_per_run', DEFAULT_MAX_POLLS_PER_RUN))
+    
+    now = time.time()
+    if frappe.cache().get(get_key(SEEDED_KEY)) is None:
+        seed_schedule()
+    
+    due = get_due_shipments(now, limit)
+    if not due:
+        return {'tracked': 0, 'updated': 0, 'new_events': 0, 'failed_batches': 0, 'finished': 0}
+    
+    statuses = get_shipment_statuses(due)
+    # Rows deleted or finished (e.g. tracked by hand) since they were
+    # scheduled leave the queue without a carrier call
+    closed = {
+        shipment_id for shipment_id in due
+        if shipment_id not in statuses or statuses[shipment_id] in TERMINAL_STATUSES
+    }
+    unschedule_shipments(sorted(closed))
+    due = [shipment_id for shipment_id in due if shipment_id not in closed]
+    
+    tracked_at = datetime.now()
+    batches = chunk(due, max(1, batch_size))
+    batch_results = gather_tracking_batches(batches, concurrency, last_update_only=True) if batches else []
+    
+    failed = [result for result in batch_results if not result.get('success')]
+    if failed:
+        frappe.log_error(
+            f"{len(failed)} of {len(batches)} tracking batches failed: {failed[0].get('message')}",
+            "Aramex Tracking Poll Error"
+        )
+    
+    tracked = set()
+    for batch, result in zip(batches, batch_results):
+        if result.get('success'):
+            tracked.update(batch)
+    
+    applied = get_latest_event_times(sorted(tracked))
+    events = append_tracking_events([
+        tracking_result
+        for result in batch_results
+        for tracking_result in result.get('tracking_results') or []
+    ])
+    
+    updates = build_status_updates(statuses, batch_results, tracked_at, applied)
+    updated = update_shipments(list(updates.values()), key_field='aramex_shipment_id') if updates else 0
+    if events and not updates:
+        frappe.db.commit()
+    # Cached views of these waybills now show an outdated status
+    invalidate_tracking(sorted(updates))
+    publish_shipment_updates([build_shipment_diff(update) for update in updates.values()])
+    
+    new_statuses = dict(statuses, **{shipment_id: update['status'] for shipment_id, update in updates.items()})
+    finished = reschedule(due, new_statuses, set(updates), tracked, get_tracking_meta(due), now)
+    
+    summary = {
+        'tracked': len(due),
+        'updated': updated,
+        'new_events': events,
+        'failed_batches': len(failed),
+        'finished': len(finished)
+    }
+    frappe.logger().info(f"Aramex tracking poll: {summary}")
+    
+    return summary
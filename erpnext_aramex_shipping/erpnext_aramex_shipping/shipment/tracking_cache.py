@@ -0,0 +1,97 @@
+import frappe
+import time
+from typing import Dict, List, Optional, Any
+
+# Seconds a tracking result is served as fresh, and how much longer a stale
+# result may still be served while a background job refreshes it, unless
+# settings override them
+DEFAULT_TRACKING_CACHE_TTL = 300
+DEFAULT_TRACKING_STALE_TTL = 3600
+
+CACHE_KEY_PREFIX = 'aramex_tracking'
+REFRESH_LOCK_PREFIX = 'aramex_tracking_refresh'
+REFRESH_QUEUE = 'short'
+
+
+def get_cache_ttls(settings: Dict[str, Any]) -> tuple:
+    """Fresh and stale lifetimes of a cached tracking result, in seconds"""
+    ttl = int(settings.get('tracking_cache_ttl', DEFAULT_TRACKING_CACHE_TTL))
+    stale_ttl = int(settings.get('tracking_cache_stale_ttl', DEFAULT_TRACKING_STALE_TTL))
+    return ttl, stale_ttl
+
+
+def get_cached_tracking(shipment_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Cached tracking entry of a waybill
+    
+    Returns:
+        Dictionary with the result, its status and fetched_at (epoch seconds), or None
+    """
+    try:
+        return frappe.cache().get_value(f"{CACHE_KEY_PREFIX}:{shipment_id}")
+    except Exception:
+        return None
+
+
+def set_cached_tracking(shipment_id: str, result: Dict[str, Any], status: Optional[str],
+                        settings: Dict[str, Any]) -> None:
+    """Cache a tracking result; it outlives its TTL by the stale window"""
+    ttl, stale_ttl = get_cache_ttls(settings)
+    if ttl <= 0:
+        return
+    
+    try:
+        frappe.cache().set_value(
+            f"{CACHE_KEY_PREFIX}:{shipment_id}",
+            {'fetched_at': time.time(), 'status': status, 'result': result},
+            expires_in_sec=ttl + max(stale_ttl, 0)
+        )
+    except Exception as e:
+        frappe.logger().warning(f"Could not cache Aramex tracking for {shipment_id}: {str(e)}")
+
+
+def invalidate_tracking(shipment_ids: List[str]) -> None:
+    """Drop cached tracking results, e.g. after the poller saw a status change"""
+    if not shipment_ids:
+        return
+    
+    try:
+        frappe.cache().delete_value([f"{CACHE_KEY_PREFIX}:{shipment_id}" for shipment_id in shipment_ids])
+    except Exception as e:
+        frappe.logger().warning(f"Could not invalidate Aramex tracking cache: {str(e)}")
+
+
+def is_stale(entry: Dict[str, Any], settings: Dict[str, Any]) -> bool:
+    """Whether a cached entry is past its TTL"""
+    ttl, _ = get_cache_ttls(settings)
+    return time.time() - entry.get('fetched_at', 0) >= ttl
+
+
+def schedule_refresh(shipment_id: str, settings: Dict[str, Any]) -> bool:
+    """
+    Queue a background refresh of a stale waybill
+    
+    A short-lived lock taken with SET NX lets only the first reader of a
+    stale entry queue the job; everyone else keeps getting the cached result.
+    
+    Returns:
+        True if a refresh job was queued
+    """
+    ttl, _ = get_cache_ttls(settings)
+    lock_key = frappe.cache().make_key(f"{REFRESH_LOCK_PREFIX}:{shipment_id}")
+    
+    try:
+        if not frappe.cache().set(lock_key, 1, ex=max(ttl, 1), nx=True):
+            return False
+        
+        frappe.enqueue(
+            'erpnext_aramex_shipping.shipment.shipment.refresh_shipment_tracking',
+            queue=REFRESH_QUEUE,
+            job_id=f"{REFRESH_LOCK_PREFIX}::{shipment_id}",
+            shipment_id=shipment_id
+        )
+        return True
+    except Exception as e:
+        frappe.cache().delete(lock_key)
+        frappe.log_error(f"Error queueing tracking refresh for {shipment_id}: {str(e)}", "Aramex Tracking Cache Error")
+        return False
@@ -0,0 +1,415 @@
+import frappe
+import hashlib
+import hmac
+import json
+import time
+from typing import Dict, List, Optional, Any, Tuple
+from datetime import datetime
+from erpnext_aramex_shipping.api.aramex import get_aramex_client
+from erpnext_aramex_shipping.shipment.events import (
+    append_tracking_events, get_latest_event_times, parse_aramex_datetime
+)
+from erpnext_aramex_shipping.shipment.persistence import update_shipments
+from erpnext_aramex_shipping.shipment.realtime import build_shipment_diff, publish_shipment_updates
+from erpnext_aramex_shipping.shipment.tracking import build_status_updates, get_shipment_statuses
+from erpnext_aramex_shipping.shipment.tracking_cache import invalidate_tracking
+
+SIGNATURE_HEADER = 'X-Aramex-Signature'
+
+# Redis list buffering received notifications until the next flush
+INBOX_KEY = 'aramex_tracking_inbox'
+# Redis list keeping notifications that could not be written, with the error
+DEAD_LETTER_KEY = 'aramex_tracking_dead_letters'
+# Prefix of the per-run Redis lists holding the batch being written; the
+# batch leaves its list only once it is committed
+PROCESSING_KEY = 'aramex_tracking_processing'
+# Sorted set of the processing lists in use, scored by when their batch was taken
+PROCESSING_RUNS_KEY = 'aramex_tracking_processing_runs'
+# Seconds after which a batch still in a processing list is taken to belong
+# to a worker that died mid-flush and goes back to the inbox
+PROCESSING_TIMEOUT = 10 * 60
+
+# Notifications accepted per request, and drained per flush batch and per
+# run, unless settings override them
+DEFAULT_MAX_NOTIFICATIONS_PER_REQUEST = 1000
+DEFAULT_FLUSH_BATCH_SIZE = 5000
+DEFAULT_MAX_FLUSH_BATCHES = 20
+# Runs a batch may fail in a row before it is split to set aside the
+# notifications that cannot be written
+DEFAULT_MAX_FLUSH_ATTEMPTS = 5
+
+
+def sign_payload(body: bytes, secret: str) -> str:
+    """Hex HMAC-SHA256 of a request body"""
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body: bytes, signature: Optional[str], secret: Optional[str]) -> bool:
+    """Check a request signature, optionally prefixed with `sha256=`, in constant time"""
+    if not secret or not signature:
+        return False
+    
+    if signature.startswith('sha256='):
+        signature = signature[len('sha256='):]
+    return hmac.compare_digest(sign_payload(body, secret), signature.strip().lower())
+
+
+def normalize_notification(notification: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Reduce a pushed tracking update to the event shape stored by the app
+    
+    Accepts Aramex field names (WaybillNumber, UpdateCode, UpdateDateTime,
+    ...) as used in TrackShipments results.
+    
+    Returns:
+        Normalized notification, or None if the waybill or date is missing
+    """
+    if not isinstance(notification, dict):
+        return None
+    
+    waybill = notification.get('WaybillNumber') or notification.get('waybill_number')
+    date = notification.get('UpdateDateTime') or notification.get('date')
+    if not waybill or not date:
+        return None
+    
+    return {
+        'waybill': str(waybill),
+        'date': str(date),
+        'code': notification.get('UpdateCode') or notification.get('code') or '',
+        'status': notification.get('UpdateDescription') or notification.get('status') or '',
+        'location': notification.get('UpdateLocation') or notification.get('location') or '',
+        'comments': notification.get('Comments') or notification.get('comments') or ''
+    }
+
+
+def queue_notifications(notifications: List[Dict[str, Any]]) -> int:
+    """Append normalized notifications to the Redis inbox with one RPUSH"""
+    if not notifications:
+        return 0
+    
+    # Raw RPUSH on a pre-made key: RedisWrapper.rpush re-prefixes and pickles
+    pipeline = frappe.cache().pipeline()
+    pipeline.rpush(frappe.cache().make_key(INBOX_KEY), *[json.dumps(item) for item in notifications])
+    pipeline.execute()
+    return len(notifications)
+
+
+@frappe.whitelist(allow_guest=True, methods=['POST'])
+def receive_tracking_notifications() -> Dict[str, Any]:
+    """
+    Accept a batch of pushed tracking notifications
+    
+    The raw body must be signed with HMAC-SHA256 using `webhook_secret` from
+    the Aramex settings, in the X-Aramex-Signature header. Notifications are
+    queued in Redis and written by flush_tracking_notifications, so a burst
+    of pushes costs no database work in the request.
+    
+    Returns:
+        Dictionary containing the number of notifications queued and rejected
+    """
+    try:
+        settings = get_aramex_client().settings
+        body = frappe.request.get_data() or b''
+        
+        if not verify_signature(body, frappe.get_request_header(SIGNATURE_HEADER), settings.get('webhook_secret')):
+            frappe.local.response['http_status_code'] = 401
+            return {
+                'success': False,
+                'message': 'Invalid signature'
+            }
+        
+        payload = json.loads(body)
+        if isinstance(payload, dict):
+            payload = payload.get('notifications') or payload.get('TrackingResults') or [payload]
+        
+        limit = int(settings.get('webhook_max_notifications', DEFAULT_MAX_NOTIFICATIONS_PER_REQUEST))
+        if not isinstance(payload, list) or len(payload) > limit:
+            frappe.local.response['http_status_code'] = 400
+            return {
+                'success': False,
+                'message': f'Expected a list of at most {limit} notifications'
+            }
+        
+        notifications = [normalize_notification(item) for item in payload]
+        queued = queue_notifications([item for item in notifications if item])
+        
+        return {
+            'success': True,
+            'queued': queued,
+            'rejected': len(notifications) - queued,
+            'message': f'Queued {queued} tracking notifications'
+        }
+    
+    except json.JSONDecodeError:
+        frappe.local.response['http_status_code'] = 400
+        return {
+            'success': False,
+            'message': 'Invalid JSON data provided'
+        }
+    except Exception as e:
+        frappe.log_error(f"Error receiving tracking notifications: {str(e)}", "Aramex Webhook Error")
+        frappe.local.response['http_status_code'] = 500
+        return {
+            'success': False,
+            'message': f'Error receiving tracking notifications: {str(e)}'
+        }
+
+
+def claim_notifications(processing_key: str, limit: int) -> List[bytes]:
+    """
+    Move up to `limit` notifications from the head of the inbox to a
+    processing list, with one LMOVE each in a single MULTI/EXEC
+    
+    The batch stays in the processing list until release_notifications, so a
+    worker killed mid-flush leaves it to be re-driven instead of losing it.
+    """
+    cache = frappe.cache()
+    inbox_key = cache.make_key(INBOX_KEY)
+    # Raw LLEN: RedisWrapper.llen re-prefixes the key
+    count = min(limit, cache.pipeline().llen(inbox_key).execute()[0])
+    if not count:
+        return []
+    
+    pipeline = cache.pipeline()
+    pipeline.zadd(cache.make_key(PROCESSING_RUNS_KEY), {processing_key: time.time()})
+    for _ in range(count):
+        pipeline.lmove(inbox_key, processing_key, 'LEFT', 'RIGHT')
+    _, *items = pipeline.execute()
+    # Another run may have drained the inbox since LLEN
+    return [item for item in items if item is not None]
+
+
+def release_notifications(processing_key: str, requeue: Optional[List[str]] = None) -> None:
+    """
+    Drop a batch from its processing list once it is committed, putting
+    `requeue` back at the head of the inbox, in order, in the same MULTI/EXEC
+    """
+    pipeline = frappe.cache().pipeline()
+    if requeue:
+        pipeline.lpush(frappe.cache().make_key(INBOX_KEY), *reversed(requeue))
+    pipeline.delete(processing_key)
+    pipeline.zrem(frappe.cache().make_key(PROCESSING_RUNS_KEY), processing_key)
+    pipeline.execute()
+
+
+def redrive_stale_notifications() -> int:
+    """
+    Put batches left in processing lists for longer than PROCESSING_TIMEOUT
+    back at the head of the inbox, in order
+    
+    Each notification moves with its own LMOVE, so runs re-driving the same
+    list at once neither lose nor duplicate any.
+    
+    Returns:
+        Number of notifications put back
+    """
+    cache = frappe.cache()
+    runs_key = cache.make_key(PROCESSING_RUNS_KEY)
+    inbox_key = cache.make_key(INBOX_KEY)
+    
+    redriven = 0
+    for processing_key in cache.zrangebyscore(runs_key, '-inf', time.time() - PROCESSING_TIMEOUT):
+        count = cache.pipeline().llen(processing_key).execute()[0]
+        pipeline = cache.pipeline()
+        for _ in range(count):
+            pipeline.lmove(processing_key, inbox_key, 'RIGHT', 'LEFT')
+        pipeline.zrem(runs_key, processing_key)
+        *items, _ = pipeline.execute()
+        redriven += sum(item is not None for item in items)
+    
+    return redriven
+
+
+def dead_letter_notifications(failed: List[Tuple[Any, str]]) -> None:
+    """Move notifications that cannot be written, with their errors, to the dead-letter list and log them"""
+    if not failed:
+        return
+    
+    pipeline = frappe.cache().pipeline()
+    pipeline.rpush(
+        frappe.cache().make_key(DEAD_LETTER_KEY),
+        *[json.dumps({'notification': notification, 'error': error}, default=str) for notification, error in failed]
+    )
+    pipeline.execute()
+    
+    details = '; '.join(
+        f"{notification.get('waybill') if isinstance(notification, dict) else notification}: {error}"
+        for notification, error in failed[:20]
+    )
+    frappe.log_error(
+        f"{len(failed)} tracking notifications could not be written and were moved to {DEAD_LETTER_KEY}: {details}",
+        "Aramex Webhook Error"
+    )
+
+
+def decode_notifications(items: List[bytes]) -> Tuple[List[Dict[str, Any]], int, List[Tuple[Any, str]]]:
+    """
+    Decode popped notifications
+    
+    Returns:
+        The notifications, the most flush attempts any of them has had, and
+        the items that are not valid JSON with their error
+    """
+    notifications = []
+    attempts = 0
+    invalid = []
+    for item in items:
+        try:
+            notification = json.loads(item)
+        except ValueError as e:
+            invalid.append((item.decode(errors='replace') if isinstance(item, bytes) else item, str(e)))
+            continue
+        attempts = max(attempts, int(notification.pop('attempts', 0)))
+        notifications.append(notification)
+    
+    return notifications, attempts, invalid
+
+
+def group_notifications(notifications: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Group notifications into one tracking result per waybill
+    
+    Events are ordered newest first and the newest one sets the status,
+    whatever order the pushes arrived in.
+    """
+    events: Dict[str, List[Dict[str, Any]]] = {}
+    for notification in notifications:
+        event = dict(notification)
+        events.setdefault(event.pop('waybill'), []).append(event)
+    
+    tracking_results = []
+    for waybill, waybill_events in events.items():
+        waybill_events.sort(key=lambda event: parse_aramex_datetime(event['date']) or datetime.min, reverse=True)
+        tracking_results.append({
+            'waybill_number': waybill,
+            'status': waybill_events[0]['code'],
+            'events': waybill_events
+        })
+    
+    return tracking_results
+
+
+def apply_notifications(notifications: List[Dict[str, Any]]) -> int:
+    """
+    Write a batch of notifications: append the events, then update every
+    changed status with one bulk update and a single commit
+    
+    Pushes can arrive late and out of order, so a waybill whose newest
+    pushed event is older than one already stored keeps its status, and
+    finished shipments are never reopened (see build_status_updates).
+    
+    Returns:
+        Number of shipments whose status changed
+    """
+    tracking_results = group_notifications(notifications)
+    waybills = [result['waybill_number'] for result in tracking_results]
+    applied = get_latest_event_times(waybills)
+    append_tracking_events(tracking_results)
+    
+    statuses = get_shipment_statuses(waybills)
+    updates = build_status_updates(statuses, [{'tracking_results': tracking_results}], datetime.now(), applied)
+    
+    if updates:
+        update_shipments(list(updates.values()), key_field='aramex_shipment_id')
+    else:
+        frappe.db.commit()
+    
+    invalidate_tracking(sorted(updates))
+    publish_shipment_updates([build_shipment_diff(update) for update in updates.values()])
+    
+    return len(updates)
+
+
+def apply_isolating_failures(notifications: List[Dict[str, Any]]) -> Tuple[int, List[Tuple[Any, str]]]:
+    """
+    Write notifications in ever smaller halves until the ones that fail on
+    their own are found
+    
+    Returns:
+        Number of shipments whose status changed, and the notifications
+        that could not be written with their errors
+    """
+    try:
+        return apply_notifications(notifications), []
+    except Exception as e:
+        frappe.db.rollback()
+        if len(notifications) == 1:
+            return 0, [(notifications[0], str(e))]
+    
+    middle = len(notifications) // 2
+    first_updated, first_failed = apply_isolating_failures(notifications[:middle])
+    second_updated, second_failed = apply_isolating_failures(notifications[middle:])
+    return first_updated + second_updated, first_failed + second_failed
+
+
+def flush_tracking_notifications() -> Dict[str, Any]:
+    """
+    Scheduled job draining the webhook inbox into Aramex Shipment
+    
+    Runs every minute and works through up to `webhook_max_flush_batches`
+    batches of `webhook_flush_batch_size` notifications. Each batch is moved
+    to a processing list of the run and removed from it only after its
+    commit; batches left there by a worker that died mid-flush are put back
+    in the inbox at the start of a later run. A batch that fails to write
+    goes back to the head of the inbox for the next run, carrying its
+    attempt count. Once it has failed `webhook_max_flush_attempts` times
+    it is split to write what can be written, and the notifications that
+    still fail on their own are moved to the dead-letter list, so one bad
+    notification cannot block the inbox.
+    
+    Returns:
+        Summary of the run
+    """
+    settings = get_aramex_client().settings
+    batch_size = int(settings.get('webhook_flush_batch_size', DEFAULT_FLUSH_BATCH_SIZE))
+    max_batches = int(settings.get('webhook_max_flush_batches', DEFAULT_MAX_FLUSH_BATCHES))
+    max_attempts = int(settings.get('webhook_max_flush_attempts', DEFAULT_MAX_FLUSH_ATTEMPTS))
+    
+    redriven = redrive_stale_notifications()
+    if redriven:
+        frappe.logger().info(f"Aramex tracking notifications re-driven from dead flush runs: {redriven}")
+    
+    processing_key = frappe.cache().make_key(f"{PROCESSING_KEY}:{frappe.generate_hash(length=10)}")
+    processed = 0
+    updated = 0
+    dead_lettered = 0
+    
+    for _ in range(max(1, max_batches)):
+        items = claim_notifications(processing_key, max(1, batch_size))
+        if not items:
+            break
+        
+        notifications, attempts, failed = decode_notifications(items)
+        
+        try:
+            updated += apply_notifications(notifications) if notifications else 0
+        except Exception as e:
+            frappe.db.rollback()
+            attempts += 1
+            
+            if attempts < max_attempts:
+                dead_letter_notifications(failed)
+                release_notifications(
+                    processing_key,
+                    requeue=[json.dumps(dict(notification, attempts=attempts)) for notification in notifications]
+                )
+                frappe.log_error(
+                    f"Error flushing {len(items)} tracking notifications (attempt {attempts} of {max_attempts}): {str(e)}",
+                    "Aramex Webhook Error"
+                )
+                break
+            
+            isolated, isolated_failed = apply_isolating_failures(notifications)
+            updated += isolated
+            failed += isolated_failed
+        
+        dead_letter_notifications(failed)
+        release_notifications(processing_key)
+        dead_lettered += len(failed)
+        processed += len(items)
+    
+    summary = {'processed': processed, 'updated': updated, 'dead_lettered': dead_lettered}
+    if processed:
+        frappe.logger().info(f"Aramex tracking notifications flushed: {summary}")
+    
+    return summary
@@ -8,6 +8,7 @@ class ShippingDashboard {
         this.selectedRate = null;
         this.currentShipment = null;
         this.configuration = null;
+        this.historyTable = null;
         
         this.init();
     }
@@ -450,6 +451,7 @@ class ShippingDashboard {
             
             if (response.success) {
                 this.displayTrackingResults(response.tracking_results);
+                this.updateShipmentStatus(response.tracking_results);
                 resultsContainer.style.display = 'block';
                 resultsContainer.scrollIntoView({ behavior: 'smooth' });
                 this.showAlert('Tracking information retrieved successfully!', 'success');
@@ -546,40 +548,81 @@ class ShippingDashboard {
         const container = document.getElementById('history-container');
         
         if (!shipments || shipments.length === 0) {
+            this.historyTable = null;
             container.innerHTML = '<p class="no-history">No shipment history available.</p>';
             return;
         }
         
-        const table = document.createElement('table');
-        table.className = 'history-table';
-        
-        table.innerHTML = `
-            <thead>
-                <tr>
-                    <th>Reference</th>
-                    <th>Shipper</th>
-                    <th>Consignee</th>
-                    <th>Weight</th>
-                    <th>Status</th>
-                    <th>Created</th>
-                </tr>
-            </thead>
-            <tbody>
-                ${shipments.map(shipment => `
-                    <tr>
-                        <td>${shipment.reference || 'N/A'}</td>
-                        <td>${shipment.shipper_name || 'N/A'}</td>
-                        <td>${shipment.consignee_name || 'N/A'}</td>
-                        <td>${shipment.weight || 'N/A'}</td>
-                        <td><span class="status-badge status-${(shipment.status || 'unknown').toLowerCase().replace(' ', '-')}">${shipment.status || 'Unknown'}</span></td>
-                        <td>${this.formatDate(shipment.creation_date)}</td>
-                    </tr>
-                `).join('')}
-            </tbody>
-        `;
+        // The table is built once; refreshes only re-fill the rows in view
+        if (!this.historyTable) {
+            container.innerHTML = `
+                <div class="virtual-scroll">
+                    <table class="history-table">
+                        <thead>
+                            <tr>
+                                <th>Reference</th>
+                                <th>Shipper</th>
+                                <th>Consignee</th>
+                                <th>Weight</th>
+                                <th>Status</th>
+                                <th>Created</th>
+                            </tr>
+                        </thead>
+                        <tbody></tbody>
+                    </table>
+                </div>
+            `;
+            
+            this.historyTable = new VirtualTable({
+                scrollContainer: container.querySelector('.virtual-scroll'),
+                tbody: container.querySelector('tbody'),
+                rowHeight: 45,
+                getKey: shipment => shipment.aramex_shipment_id || shipment.name,
+                createRow: () => this.createHistoryRow(),
+                updateRow: (row, shipment) => this.updateHistoryRow(row, shipment)
+            });
+        }
         
-        container.innerHTML = '';
-        container.appendChild(table);
+        this.historyTable.setRows(shipments);
+    }
+
+    /**
+     * Create an empty history row, filled by updateHistoryRow
+     */
+    createHistoryRow() {
+        const row = document.createElement('tr');
+        row.innerHTML = '<td></td><td></td><td></td><td></td><td><span class="status-badge"></span></td><td></td>';
+        return row;
+    }
+
+    /**
+     * Fill a history row from a shipment
+     */
+    updateHistoryRow(row, shipment) {
+        const cells = row.cells;
+        const status = shipment.status || 'Unknown';
+        
+        cells[0].textContent = shipment.reference || 'N/A';
+        cells[1].textContent = shipment.shipper_name || 'N/A';
+        cells[2].textContent = shipment.consignee_name || 'N/A';
+        cells[3].textContent = shipment.weight || 'N/A';
+        cells[4].firstElementChild.className = `status-badge status-${status.toLowerCase().replace(' ', '-')}`;
+        cells[4].firstElementChild.textContent = status;
+        cells[5].textContent = this.formatDate(shipment.creation_date);
+    }
+
+    /**
+     * Patch the history rows of tracked shipments with their new status
+     */
+    updateShipmentStatus(trackingResults) {
+        if (!this.historyTable || !trackingResults) return;
+        
+        trackingResults.forEach(result => {
+            const index = this.historyTable.indexByKey.get(result.waybill_number);
+            if (index !== undefined && result.status) {
+                this.historyTable.patchRow({ ...this.historyTable.rows[index], status: result.status });
+            }
+        });
     }
 
     /**
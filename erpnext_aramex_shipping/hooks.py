@@ -68,6 +68,7 @@ app_version = app_version
 
 # before_install = "erpnext_aramex_shipping.install.before_install"
 # after_install = "erpnext_aramex_shipping.install.after_install"
+after_migrate = "erpnext_aramex_shipping.install.after_migrate"
 
 # Uninstallation
 # ------------
@@ -113,6 +114,24 @@ app_version = app_version
 #	}
 # }
 
+doc_events = {
+	"Aramex Shipment": {
+		"after_insert": [
+			"erpnext_aramex_shipping.shipment.tracking.on_shipment_insert",
+			"erpnext_aramex_shipping.shipment.stats.on_shipment_insert",
+			"erpnext_aramex_shipping.shipment.search.on_shipment_insert"
+		],
+		"on_update": [
+			"erpnext_aramex_shipping.shipment.stats.on_shipment_update",
+			"erpnext_aramex_shipping.shipment.search.on_shipment_update"
+		],
+		"on_trash": [
+			"erpnext_aramex_shipping.shipment.stats.on_shipment_trash",
+			"erpnext_aramex_shipping.shipment.search.on_shipment_trash"
+		]
+	}
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -134,6 +153,20 @@ app_version = app_version
 # 	],
 # }
 
+scheduler_events = {
+	"daily": [
+		"erpnext_aramex_shipping.shipment.stats.reconcile_stats"
+	],
+	"cron": {
+		"* * * * *": [
+			"erpnext_aramex_shipping.shipment.webhook.flush_tracking_notifications"
+		],
+		"*/5 * * * *": [
+			"erpnext_aramex_shipping.shipment.tracking.poll_shipments"
+		]
+	}
+}
+
 # Testing
 # -------
 
@@ -214,10 +247,18 @@ website_route_rules = [
 whitelisted_methods = [
     "erpnext_aramex_shipping.api.aramex.get_shipping_rates",
     "erpnext_aramex_shipping.api.aramex.create_shipment",
+    "erpnext_aramex_shipping.api.aramex.create_shipments",
     "erpnext_aramex_shipping.api.aramex.generate_shipping_label",
     "erpnext_aramex_shipping.api.aramex.track_shipment",
+    "erpnext_aramex_shipping.api.rate_cache.get_rate_cache_stats",
     "erpnext_aramex_shipping.shipment.shipment.fetch_shipping_rates",
+    "erpnext_aramex_shipping.shipment.shipment.shop_shipping_rates",
+    "erpnext_aramex_shipping.shipment.shipment.fetch_shipping_rates_bulk",
     "erpnext_aramex_shipping.shipment.shipment.create_aramex_shipment",
+    "erpnext_aramex_shipping.shipment.shipment.create_aramex_shipments",
     "erpnext_aramex_shipping.shipment.shipment.print_shipping_label",
     "erpnext_aramex_shipping.shipment.shipment.track_aramex_shipment",
+    "erpnext_aramex_shipping.shipment.jobs.enqueue_aramex_shipment",
+    "erpnext_aramex_shipping.shipment.jobs.get_shipment_job_status",
+    "erpnext_aramex_shipping.shipment.webhook.receive_tracking_notifications",
 ]
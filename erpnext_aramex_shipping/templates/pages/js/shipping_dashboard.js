@@ -3,12 +3,20 @@ class ShippingDashboard {
     constructor() {
         this.shipments = [];
         this.filteredShipments = [];
-        this.currentPage = 1;
-        this.itemsPerPage = 10;
+        this.table = null;
+        this.search = new ShipmentSearch(shipment => shipment.tracking_id, shipment => this.getSearchText(shipment));
+        this.searchTimer = null;
+        this.searchSequence = 0;
+        this.pollTimer = null;
+        this.nextCursor = null;
+        this.loadingMore = false;
+        this.syncCursor = null;
+        this.statsTimer = null;
         this.init();
     }
 
     init() {
+        this.table = this.createShipmentsTable();
         this.bindEvents();
         this.loadShipments();
         this.setupRealTimeUpdates();
@@ -24,6 +32,19 @@ class ShippingDashboard {
         // Search functionality
         document.getElementById('searchInput').addEventListener('input', (e) => this.handleSearch(e.target.value));
         
+        // Row actions, delegated so recycled rows need no listeners of their own
+        document.getElementById('shipmentsTableBody').addEventListener('click', (e) => {
+            const button = e.target.closest('button[data-action]');
+            if (!button) return;
+            
+            const trackingId = button.closest('tr').dataset.trackingId;
+            if (button.dataset.action === 'view') {
+                this.viewShipment(trackingId);
+            } else {
+                this.trackShipment(trackingId);
+            }
+        });
+        
         // Filter functionality
         document.getElementById('statusFilter').addEventListener('change', (e) => this.handleFilter());
         document.getElementById('dateFilter').addEventListener('change', (e) => this.handleFilter());
@@ -50,21 +71,57 @@ class ShippingDashboard {
         });
     }
 
+    getServerFilters() {
+        const filters = {};
+        const status = document.getElementById('statusFilter').value;
+        const period = document.getElementById('dateFilter').value;
+        
+        if (status) filters.status = status;
+        if (period && period !== 'all') filters.period = period;
+        return filters;
+    }
+
+    async fetchShipments(params) {
+        const response = await fetch(`/api/method/erpnext_aramex_shipping.api.aramex.get_shipments?${params}`, {
+            method: 'GET',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Frappe-CSRF-Token': frappe.csrf_token
+            }
+        });
+        
+        const data = await response.json();
+        return data.message || {};
+    }
+
+    fetchShipmentsPage(cursor = null) {
+        const params = new URLSearchParams({
+            filters: JSON.stringify(this.getServerFilters()),
+            limit: 100
+        });
+        if (cursor) params.set('cursor', cursor);
+        return this.fetchShipments(params);
+    }
+
     async loadShipments() {
+        // Once a first page is loaded, only the changes since are fetched
+        if (this.syncCursor) {
+            return this.syncShipments();
+        }
+        
         this.showLoading(true);
         
         try {
-            const response = await fetch('/api/method/erpnext_aramex_shipping.api.aramex.get_shipments', {
-                method: 'GET',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-Frappe-CSRF-Token': frappe.csrf_token
-                }
-            });
-            
-            const data = await response.json();
-            this.shipments = data.message || [];
+            // Status and date filters are applied by the server; only the
+            // first page is loaded, later pages follow the cursor
+            const page = await this.fetchShipmentsPage();
+            this.shipments = page.shipments || [];
+            this.search.setShipments(this.shipments);
+            this.nextCursor = page.next_cursor || null;
+            this.syncCursor = page.since || null;
             this.filteredShipments = [...this.shipments];
+            this.searchSequence++;
+            this.table.scrollToTop();
             this.updateDashboard();
         } catch (error) {
             console.error('Error loading shipments:', error);
@@ -74,74 +131,188 @@ class ShippingDashboard {
         }
     }
 
+    async loadMoreShipments() {
+        // Called by the table when it is scrolled to the last loaded rows
+        if (!this.nextCursor || this.loadingMore) return;
+        this.loadingMore = true;
+        
+        try {
+            const page = await this.fetchShipmentsPage(this.nextCursor);
+            const loaded = new Set(this.shipments.map(shipment => shipment.tracking_id));
+            const added = (page.shipments || []).filter(shipment => !loaded.has(shipment.tracking_id));
+            this.shipments.push(...added);
+            this.search.upsert(added);
+            this.nextCursor = page.next_cursor || null;
+            this.applySearch();
+        } catch (error) {
+            console.error('Error loading more shipments:', error);
+        } finally {
+            this.loadingMore = false;
+        }
+    }
+
+    async syncShipments() {
+        try {
+            let changes;
+            do {
+                changes = await this.fetchShipments(new URLSearchParams({ since: this.syncCursor }));
+                if (!changes.success) throw new Error(changes.message);
+                
+                this.mergeShipments(changes.shipments || [], changes.deleted || []);
+                this.syncCursor = changes.since;
+            } while (changes.has_more);
+            
+            this.applySearch();
+            this.updateStats();
+        } catch (error) {
+            console.error('Error syncing shipments:', error);
+            // Start over with a full load next time
+            this.syncCursor = null;
+        }
+    }
+
+    mergeShipments(changed, deleted) {
+        const byName = new Map(this.shipments.map(shipment => [shipment.name, shipment]));
+        const removed = [];
+        const upserted = [];
+        const drop = (name) => {
+            if (byName.has(name)) {
+                removed.push(byName.get(name).tracking_id);
+                byName.delete(name);
+            }
+        };
+        deleted.forEach(drop);
+        
+        // Rows older than the last loaded one belong to pages not loaded yet
+        const oldest = this.nextCursor && this.shipments.length
+            ? new Date(this.shipments[this.shipments.length - 1].created_at)
+            : null;
+        
+        changed.forEach(shipment => {
+            const loaded = byName.has(shipment.name);
+            if (!this.matchesServerFilters(shipment)) {
+                drop(shipment.name);
+            } else if (loaded || !oldest || new Date(shipment.created_at) >= oldest) {
+                const merged = { ...byName.get(shipment.name), ...shipment };
+                byName.set(shipment.name, merged);
+                upserted.push(merged);
+            }
+        });
+        
+        this.search.remove(removed);
+        this.search.upsert(upserted);
+        
+        this.shipments = [...byName.values()].sort((a, b) =>
+            new Date(b.created_at) - new Date(a.created_at) || (b.name > a.name ? 1 : -1)
+        );
+    }
+
+    matchesServerFilters(shipment) {
+        const filters = this.getServerFilters();
+        if (filters.status && shipment.status !== filters.status) return false;
+        if (filters.period) {
+            const days = { today: 0, week: 7, month: 30 }[filters.period];
+            const from = new Date();
+            from.setHours(0, 0, 0, 0);
+            from.setDate(from.getDate() - days);
+            if (new Date(shipment.created_at) < from) return false;
+        }
+        return true;
+    }
+
     updateDashboard() {
         this.updateStats();
         this.renderShipments();
     }
 
-    updateStats() {
-        const stats = {
-            total: this.shipments.length,
-            delivered: this.shipments.filter(s => s.status === 'delivered').length,
-            inTransit: this.shipments.filter(s => s.status === 'in_transit').length,
-            failed: this.shipments.filter(s => s.status === 'failed').length
-        };
+    async updateStats() {
+        // Counters are maintained on the server; the loaded page is only a
+        // slice of all shipments
+        try {
+            const response = await fetch('/api/method/erpnext_aramex_shipping.api.aramex.get_dashboard_stats', {
+                headers: {
+                    'X-Frappe-CSRF-Token': frappe.csrf_token
+                }
+            });
+            
+            const data = await response.json();
+            const stats = (data.message && data.message.stats) || {};
+            
+            document.getElementById('totalShipments').textContent = stats.total_shipments || 0;
+            document.getElementById('deliveredShipments').textContent = stats.delivered_shipments || 0;
+            document.getElementById('inTransitShipments').textContent = stats.in_transit_shipments || 0;
+            document.getElementById('failedShipments').textContent = stats.failed_shipments || 0;
+        } catch (error) {
+            console.error('Error loading dashboard stats:', error);
+        }
+    }
+
+    scheduleStatsUpdate() {
+        // Coalesce bursts of realtime updates into one stats request
+        if (this.statsTimer) return;
+        this.statsTimer = setTimeout(() => {
+            this.statsTimer = null;
+            this.updateStats();
+        }, 5000);
+    }
 
-        document.getElementById('totalShipments').textContent = stats.total;
-        document.getElementById('deliveredShipments').textContent = stats.delivered;
-        document.getElementById('inTransitShipments').textContent = stats.inTransit;
-        document.getElementById('failedShipments').textContent = stats.failed;
+    createShipmentsTable() {
+        // Only the rows in view are in the DOM; nodes are recycled on scroll
+        return new VirtualTable({
+            scrollContainer: document.getElementById('shipmentsTableScroll'),
+            tbody: document.getElementById('shipmentsTableBody'),
+            rowHeight: 65,
+            getKey: shipment => shipment.tracking_id,
+            createRow: () => this.createShipmentRow(),
+            updateRow: (row, shipment) => this.updateShipmentRow(row, shipment),
+            onEndReached: () => this.loadMoreShipments()
+        });
     }
 
     renderShipments() {
-        const tbody = document.getElementById('shipmentsTableBody');
-        
-        if (this.filteredShipments.length === 0) {
-            this.showEmptyState(true);
-            return;
-        }
-        
-        this.showEmptyState(false);
-        
-        tbody.innerHTML = this.filteredShipments
-            .slice((this.currentPage - 1) * this.itemsPerPage, this.currentPage * this.itemsPerPage)
-            .map(shipment => this.createShipmentRow(shipment))
-            .join('');
+        this.showEmptyState(this.filteredShipments.length === 0);
+        this.table.setRows(this.filteredShipments);
     }
 
-    createShipmentRow(shipment) {
-        const statusClass = this.getStatusClass(shipment.status);
-        const statusText = this.getStatusText(shipment.status);
-        
-        return `
-            <tr class="table-row">
-                <td class="px-6 py-4 whitespace-nowrap">
-                    <div class="text-sm font-medium text-gray-900">${shipment.tracking_id}</div>
-                </td>
-                <td class="px-6 py-4 whitespace-nowrap">
-                    <div class="text-sm text-gray-900">${shipment.customer_name}</div>
-                </td>
-                <td class="px-6 py-4 whitespace-nowrap">
-                    <div class="text-sm text-gray-900">${shipment.destination}</div>
-                </td>
-                <td class="px-6 py-4 whitespace-nowrap">
-                    <span class="status-badge ${statusClass}">${statusText}</span>
-                </td>
-                <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-500">
-                    ${new Date(shipment.created_at).toLocaleDateString()}
-                </td>
-                <td class="px-6 py-4 whitespace-nowrap text-right text-sm font-medium">
-                    <button onclick="dashboard.viewShipment('${shipment.tracking_id}')" 
-                            class="text-blue-600 hover:text-blue-900 mr-3">
-                        View
-                    </button>
-                    <button onclick="dashboard.trackShipment('${shipment.tracking_id}')" 
-                            class="text-green-600 hover:text-green-900">
-                        Track
-                    </button>
-                </td>
-            </tr>
+    createShipmentRow() {
+        // Built once per pooled row; updateShipmentRow fills it
+        const row = document.createElement('tr');
+        row.className = 'table-row';
+        row.innerHTML = `
+            <td class="px-6 py-4 whitespace-nowrap">
+                <div class="text-sm font-medium text-gray-900"></div>
+            </td>
+            <td class="px-6 py-4 whitespace-nowrap">
+                <div class="text-sm text-gray-900"></div>
+            </td>
+            <td class="px-6 py-4 whitespace-nowrap">
+                <div class="text-sm text-gray-900"></div>
+            </td>
+            <td class="px-6 py-4 whitespace-nowrap">
+                <span class="status-badge"></span>
+            </td>
+            <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-500"></td>
+            <td class="px-6 py-4 whitespace-nowrap text-right text-sm font-medium">
+                <button data-action="view" class="text-blue-600 hover:text-blue-900 mr-3">
+                    View
+                </button>
+                <button data-action="track" class="text-green-600 hover:text-green-900">
+                    Track
+                </button>
+            </td>
         `;
+        return row;
+    }
+
+    updateShipmentRow(row, shipment) {
+        const cells = row.cells;
+        row.dataset.trackingId = shipment.tracking_id;
+        cells[0].firstElementChild.textContent = shipment.tracking_id;
+        cells[1].firstElementChild.textContent = shipment.customer_name;
+        cells[2].firstElementChild.textContent = shipment.destination;
+        cells[3].firstElementChild.className = `status-badge ${this.getStatusClass(shipment.status)}`;
+        cells[3].firstElementChild.textContent = this.getStatusText(shipment.status);
+        cells[4].textContent = new Date(shipment.created_at).toLocaleDateString();
     }
 
     getStatusClass(status) {
@@ -165,53 +336,42 @@ class ShippingDashboard {
     }
 
     handleSearch(query) {
-        if (!query.trim()) {
-            this.filteredShipments = [...this.shipments];
-        } else {
-            this.filteredShipments = this.shipments.filter(shipment =>
-                shipment.tracking_id.toLowerCase().includes(query.toLowerCase()) ||
-                shipment.customer_name.toLowerCase().includes(query.toLowerCase()) ||
-                shipment.destination.toLowerCase().includes(query.toLowerCase())
-            );
-        }
-        this.currentPage = 1;
-        this.renderShipments();
+        // Search once typing pauses rather than on every keystroke
+        clearTimeout(this.searchTimer);
+        this.searchTimer = setTimeout(() => {
+            this.table.scrollToTop();
+            this.applySearch();
+        }, 150);
     }
 
-    handleFilter() {
-        const statusFilter = document.getElementById('statusFilter').value;
-        const dateFilter = document.getElementById('dateFilter').value;
+    async applySearch() {
+        const sequence = ++this.searchSequence;
+        const keys = await this.search.search(document.getElementById('searchInput').value);
+        // A newer search or reload has superseded this one
+        if (sequence !== this.searchSequence) return;
         
-        this.filteredShipments = this.shipments.filter(shipment => {
-            let matchesStatus = !statusFilter || shipment.status === statusFilter;
-            let matchesDate = true;
-            
-            if (dateFilter !== 'all') {
-                const shipmentDate = new Date(shipment.created_at);
-                const today = new Date();
-                
-                switch (dateFilter) {
-                    case 'today':
-                        matchesDate = shipmentDate.toDateString() === today.toDateString();
-                        break;
-                    case 'week':
-                        const weekAgo = new Date(today.getTime() - 7 * 24 * 60 * 60 * 1000);
-                        matchesDate = shipmentDate >= weekAgo;
-                        break;
-                    case 'month':
-                        const monthAgo = new Date(today.getTime() - 30 * 24 * 60 * 60 * 1000);
-                        matchesDate = shipmentDate >= monthAgo;
-                        break;
-                }
-            }
-            
-            return matchesStatus && matchesDate;
-        });
-        
-        this.currentPage = 1;
+        this.filteredShipments = keys
+            ? this.shipments.filter(shipment => keys.has(shipment.tracking_id))
+            : [...this.shipments];
         this.renderShipments();
     }
 
+    getSearchText(shipment) {
+        // Fields are joined with newlines so a match never spans two of them
+        return [shipment.tracking_id, shipment.customer_name, shipment.destination].join('\n').toLowerCase();
+    }
+
+    matchesSearch(shipment, query) {
+        query = query.trim().toLowerCase();
+        return !query || this.getSearchText(shipment).includes(query);
+    }
+
+    handleFilter() {
+        // Filters run on the server against the indexed columns
+        this.syncCursor = null;
+        this.loadShipments();
+    }
+
     async handleNewShipment(event) {
         event.preventDefault();
         
@@ -264,7 +424,7 @@ class ShippingDashboard {
 
     async trackShipment(trackingId) {
         try {
-            const response = await fetch(`/api/method/erpnext_aramex_shipping.api.aramex.track_shipment?tracking_id=${trackingId}`, {
+            const response = await fetch(`/api/method/erpnext_aramex_shipping.shipment.shipment.track_aramex_shipment?shipment_id=${encodeURIComponent(trackingId)}`, {
                 headers: {
                     'X-Frappe-CSRF-Token': frappe.csrf_token
                 }
@@ -281,24 +441,94 @@ class ShippingDashboard {
     }
 
     setupRealTimeUpdates() {
-        // Set up periodic refresh every 30 seconds
-        setInterval(() => {
-            this.loadShipments();
-        }, 30000);
+        // The server pushes compact diffs for changed shipments; the list is
+        // only polled while the socket is down
+        if (!window.frappe.realtime) {
+            this.startPolling();
+            return;
+        }
         
-        // Listen for WebSocket updates if available
-        if (window.frappe.realtime) {
-            frappe.realtime.on('shipment_updated', (data) => {
-                this.updateShipmentStatus(data);
-            });
+        // Diffs are published to the Aramex Shipment room, which the server
+        // lets a socket join only with read permission on the doctype
+        frappe.realtime.doctype_subscribe('Aramex Shipment');
+        frappe.realtime.on('shipment_updated', (data) => {
+            this.applyShipmentUpdates(data.shipments || [data]);
+        });
+        
+        frappe.realtime.on('disconnect', () => this.startPolling());
+        frappe.realtime.on('connect', () => {
+            frappe.realtime.doctype_subscribe('Aramex Shipment');
+            // Updates pushed while disconnected were missed, reload once
+            if (this.pollTimer) {
+                this.stopPolling();
+                this.loadShipments();
+            }
+        });
+        
+        if (!this.isSocketConnected()) {
+            this.startPolling();
         }
     }
 
-    updateShipmentStatus(data) {
-        const shipmentIndex = this.shipments.findIndex(s => s.tracking_id === data.tracking_id);
-        if (shipmentIndex !== -1) {
-            this.shipments[shipmentIndex] = { ...this.shipments[shipmentIndex], ...data };
-            this.handleSearch(document.getElementById('searchInput').value);
+    isSocketConnected() {
+        const socket = frappe.realtime.socket;
+        return Boolean(socket && socket.connected);
+    }
+
+    startPolling() {
+        if (this.pollTimer) return;
+        this.pollTimer = setInterval(() => {
+            this.loadShipments();
+        }, 30000);
+    }
+
+    stopPolling() {
+        clearInterval(this.pollTimer);
+        this.pollTimer = null;
+    }
+
+    applyShipmentUpdates(diffs) {
+        const query = document.getElementById('searchInput').value;
+        const merged = [];
+        let changed = false;
+        let refilter = false;
+        
+        diffs.forEach(diff => {
+            const { created, ...fields } = diff;
+            const shipmentIndex = this.shipments.findIndex(s => s.tracking_id === fields.tracking_id);
+            
+            if (shipmentIndex !== -1) {
+                const shipment = { ...this.shipments[shipmentIndex], ...fields };
+                changed = true;
+                if (!this.matchesServerFilters(shipment)) {
+                    // Left the status or date filter, dropped by the merge below
+                    merged.push(shipment);
+                    return;
+                }
+                this.shipments[shipmentIndex] = shipment;
+                this.search.upsert([shipment]);
+                // Patch the one row in place unless it enters or leaves the filtered list
+                const shown = this.table.patchRow(shipment);
+                if (shown !== this.matchesSearch(shipment, query)) {
+                    refilter = true;
+                }
+            } else if (created && fields.name) {
+                // New rows go through the same name-keyed merge as delta sync,
+                // which applies the filters and keeps the created_at order
+                merged.push(fields);
+                changed = true;
+            }
+        });
+        
+        if (merged.length) {
+            this.mergeShipments(merged, []);
+            refilter = true;
+        }
+        if (changed) {
+            this.scheduleStatsUpdate();
+        }
+        if (refilter) {
+            this.applySearch();
         }
     }
 
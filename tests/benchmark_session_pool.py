@@ -0,0 +1,97 @@
+"""
+Benchmark pooled keep-alive sessions against a bare requests.post per call
+
+Runs a local stub of the Aramex RateCalculator endpoint so no network access
+or Aramex credentials are needed:
+    
+    python tests/benchmark_session_pool.py --requests 500
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from erpnext_aramex_shipping.api.session_pool import SessionPool
+
+
+class StubAramexHandler(BaseHTTPRequestHandler):
+    """Minimal HTTP/1.1 handler that answers every POST like CalculateRate"""
+    
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, Nagle plus
+    # delayed ACKs add ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+    
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        
+        body = json.dumps({
+            'HasErrors': False,
+            'Notifications': [],
+            'TotalAmount': {'Value': 25.5, 'CurrencyCode': 'AED'}
+        }).encode()
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server():
+    """Start the stub server on a free port in a background thread"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubAramexHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def run(label, post, url, count):
+    """Time `count` sequential POSTs and print latency percentiles"""
+    payload = {'ClientInfo': {}, 'ShipmentDetails': {'ActualWeight': {'Value': 1.5, 'Unit': 'KG'}}}
+    headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+    timings = []
+    
+    for _ in range(count):
+        started = time.perf_counter()
+        response = post(url, headers=headers, json=payload, timeout=30)
+        response.raise_for_status()
+        response.json()
+        timings.append((time.perf_counter() - started) * 1000)
+    
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<14} mean {statistics.mean(timings):7.3f} ms   "
+          f"p50 {statistics.median(timings):7.3f} ms   p95 {p95:7.3f} ms")
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500, help='requests per variant')
+    args = parser.parse_args()
+    
+    server = start_stub_server()
+    url = f"http://127.0.0.1:{server.server_address[1]}/ShippingAPI.V2/RateCalculator/CalculateRate"
+    
+    try:
+        bare = run('requests.post', requests.post, url, args.requests)
+        pool = SessionPool(pool_size=4)
+        pooled = run('SessionPool', pool.post, url, args.requests)
+        pool.clear()
+    finally:
+        server.shutdown()
+    
+    print(f"Speed-up: {bare / pooled:.2f}x (plain HTTP; TLS handshakes make the gap larger)")
+
+
+if __name__ == '__main__':
+    main()
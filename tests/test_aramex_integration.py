@@ -1,11 +1,14 @@
 import unittest
 import json
+import time
 from unittest.mock import Mock, patch, MagicMock
 import frappe
 from erpnext_aramex_shipping.api.aramex import AramexAPI, get_shipping_rates, create_shipment, generate_shipping_label, track_shipment
+from erpnext_aramex_shipping.api.session_pool import SessionPool
 from erpnext_aramex_shipping.shipment.shipment import (
     validate_address_data, validate_shipment_data, fetch_shipping_rates,
-    create_aramex_shipment, print_shipping_label, track_aramex_shipment
+    fetch_shipping_rates_bulk, shop_shipping_rates, create_aramex_shipment, print_shipping_label, track_aramex_shipment,
+    refresh_shipment_tracking
 )
 #test
 
@@ -40,6 +43,12 @@ class TestAramexAPI(unittest.TestCase):
             'weight_unit': 'KG',
             'description': 'Test package'
         }
+        
+        # Keep the shared circuit breaker closed regardless of Redis state
+        cache_patcher = patch('frappe.cache')
+        self.mock_cache = cache_patcher.start().return_value
+        self.mock_cache.get.return_value = None
+        self.addCleanup(cache_patcher.stop)
     
     @patch('frappe.get_site_config')
     def test_aramex_api_initialization(self, mock_get_site_config):
@@ -64,7 +73,7 @@ class TestAramexAPI(unittest.TestCase):
         self.assertEqual(client_info['AccountNumber'], '12345')
         self.assertEqual(client_info['Source'], 24)
     
-    @patch('requests.post')
+    @patch('requests.Session.post')
     @patch('frappe.get_site_config')
     def test_successful_api_request(self, mock_get_site_config, mock_post):
         """Test successful API request"""
@@ -85,7 +94,7 @@ class TestAramexAPI(unittest.TestCase):
         self.assertFalse(result.get('HasErrors'))
         self.assertEqual(result['TotalAmount']['Value'], 25.50)
     
-    @patch('requests.post')
+    @patch('requests.Session.post')
     @patch('frappe.get_site_config')
     @patch('frappe.log_error')
     def test_api_request_with_errors(self, mock_log_error, mock_get_site_config, mock_post):
@@ -110,14 +119,14 @@ class TestAramexAPI(unittest.TestCase):
         
         self.assertIn('Test error message', str(context.exception))
     
-    @patch('erpnext_aramex_shipping.api.aramex.AramexAPI')
-    def test_get_shipping_rates_success(self, mock_api_class):
+    @patch('erpnext_aramex_shipping.api.aramex.get_aramex_client')
+    def test_get_shipping_rates_success(self, mock_get_client):
         """Test successful shipping rates retrieval"""
         mock_api = Mock()
         mock_api.make_api_request.return_value = {
             'TotalAmount': {'Value': 30.00, 'CurrencyCode': 'AED'}
         }
-        mock_api_class.return_value = mock_api
+        mock_get_client.return_value = mock_api
         
         result = get_shipping_rates(self.sample_shipment_data)
         
@@ -125,19 +134,583 @@ class TestAramexAPI(unittest.TestCase):
         self.assertEqual(len(result['rates']), 1)
         self.assertEqual(result['rates'][0]['total_amount'], 30.00)
     
-    @patch('erpnext_aramex_shipping.api.aramex.AramexAPI')
+    @patch('erpnext_aramex_shipping.api.aramex.get_aramex_client')
     @patch('frappe.log_error')
-    def test_get_shipping_rates_failure(self, mock_log_error, mock_api_class):
+    def test_get_shipping_rates_failure(self, mock_log_error, mock_get_client):
         """Test shipping rates retrieval failure"""
         mock_api = Mock()
         mock_api.make_api_request.side_effect = Exception('API Error')
-        mock_api_class.return_value = mock_api
+        mock_get_client.return_value = mock_api
         
         result = get_shipping_rates(self.sample_shipment_data)
         
         self.assertFalse(result['success'])
         self.assertEqual(len(result['rates']), 0)
         self.assertIn('API Error', result['message'])
+    
+    @patch('erpnext_aramex_shipping.api.aramex.get_aramex_client')
+    def test_create_shipments_batches_and_maps_results(self, mock_get_client):
+        """Test that shipments are packed into batches and results map back by reference"""
+        from erpnext_aramex_shipping.api.aramex import create_shipments
+        
+        mock_api = Mock()
+        mock_api.settings = {'shipment_batch_size': 2}
+        mock_api.get_client_info.return_value = {'UserName': 'testuser'}
+        mock_api.make_api_request.side_effect = [
+            {
+                'HasErrors': True,
+                'Shipments': [
+                    {'Reference1': 'REF-2', 'HasErrors': True,
+                     'Notifications': [{'Code': 'ERR01', 'Message': 'Invalid city'}]},
+                    {'Reference1': 'REF-1', 'HasErrors': False, 'ID': '1001',
+                     'ShipmentLabel': {'LabelURL': 'https://labels/1001'}}
+                ]
+            },
+            {'HasErrors': False, 'Shipments': [{'Reference1': 'REF-3', 'HasErrors': False, 'ID': '1003'}]}
+        ]
+        mock_get_client.return_value = mock_api
+        shipments = [dict(self.sample_shipment_data, reference=f'REF-{i}') for i in (1, 2, 3)]
+        
+        result = create_shipments(shipments)
+        
+        self.assertEqual(mock_api.make_api_request.call_count, 2)
+        self.assertEqual(len(mock_api.make_api_request.call_args_list[0].args[1]['Shipments']), 2)
+        self.assertEqual([item['success'] for item in result['results']], [True, False, True])
+        self.assertEqual(result['results'][0]['label_url'], 'https://labels/1001')
+        self.assertIn('Invalid city', result['results'][1]['message'])
+        self.assertEqual(result['results'][2]['shipment_id'], '1003')
+    
+    @patch('erpnext_aramex_shipping.api.aramex.get_settings_hash')
+    @patch('erpnext_aramex_shipping.api.aramex.AramexAPI')
+    def test_client_is_cached_until_settings_change(self, mock_api_class, mock_settings_hash):
+        """Test that the memoized client is rebuilt only when the settings hash changes"""
+        from erpnext_aramex_shipping.api.aramex import get_aramex_client, clear_aramex_client_cache
+        
+        clear_aramex_client_cache()
+        mock_api_class.side_effect = [Mock(), Mock()]
+        mock_settings_hash.return_value = 'hash-1'
+        
+        first = get_aramex_client()
+        self.assertIs(get_aramex_client(), first)
+        self.assertEqual(mock_api_class.call_count, 1)
+        
+        mock_settings_hash.return_value = 'hash-2'
+        second = get_aramex_client()
+        
+        self.assertIsNot(second, first)
+        self.assertEqual(mock_api_class.call_count, 2)
+        clear_aramex_client_cache()
+
+
+    @patch('time.sleep')
+    @patch('requests.Session.post')
+    @patch('frappe.get_site_config')
+    def test_idempotent_request_is_retried(self, mock_get_site_config, mock_post, mock_sleep):
+        """Test that a timed out tracking request is retried with backoff"""
+        import requests
+        
+        mock_get_site_config.return_value.get.return_value = self.mock_settings
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'HasErrors': False, 'TrackingResults': []}
+        mock_post.side_effect = [requests.exceptions.ReadTimeout('timed out'), mock_response]
+        
+        api = AramexAPI()
+        result = api.make_api_request('ShippingAPI.V2/Tracking/TrackShipments', {'Shipments': ['1']})
+        
+        self.assertFalse(result['HasErrors'])
+        self.assertEqual(mock_post.call_count, 2)
+        mock_sleep.assert_called_once()
+        self.assertEqual(mock_post.call_args.kwargs['timeout'], (5.0, 20.0))
+    
+    @patch('time.sleep')
+    @patch('requests.Session.post')
+    @patch('frappe.get_site_config')
+    @patch('frappe.log_error')
+    def test_create_shipments_is_not_retried(self, mock_log_error, mock_get_site_config, mock_post, mock_sleep):
+        """Test that non-idempotent shipment creation is attempted only once"""
+        import requests
+        
+        mock_get_site_config.return_value.get.return_value = self.mock_settings
+        mock_post.side_effect = requests.exceptions.ReadTimeout('timed out')
+        
+        api = AramexAPI()
+        
+        with self.assertRaises(Exception):
+            api.make_api_request('ShippingAPI.V2/Shipping/CreateShipments', {'Shipments': []})
+        
+        self.assertEqual(mock_post.call_count, 1)
+        mock_sleep.assert_not_called()
+    
+    @patch('requests.Session.post')
+    @patch('frappe.get_site_config')
+    def test_open_circuit_fails_fast(self, mock_get_site_config, mock_post):
+        """Test that no request is sent while the circuit breaker is open"""
+        from erpnext_aramex_shipping.api.resilience import CircuitOpenError
+        
+        mock_get_site_config.return_value.get.return_value = self.mock_settings
+        self.mock_cache.get.return_value = b'1'
+        
+        api = AramexAPI()
+        
+        with self.assertRaises(CircuitOpenError):
+            api.make_api_request('ShippingAPI.V2/RateCalculator/CalculateRate', {})
+        
+        mock_post.assert_not_called()
+
+
+class ScopedKeyRedis:
+    """
+    Redis double that scopes keys the way frappe's RedisWrapper does
+    
+    make_key adds the site prefix, and the wrapper methods (exists, hgetall,
+    get_value, ...) call it again on whatever they are given, while raw
+    commands (get, set, hmget, hincrby, ...) use the key as passed. A key
+    scoped twice misses, as it would against a real site cache.
+    """
+    
+    def __init__(self, prefix='site1|'):
+        self.prefix = prefix
+        self.data = {}
+    
+    def make_key(self, key):
+        return f"{self.prefix}{key}"
+    
+    # RedisWrapper methods that scope their key
+    def exists(self, *keys):
+        return sum(self.make_key(key) in self.data for key in keys)
+    
+    def hgetall(self, name):
+        return dict(self.data.get(self.make_key(name), {}))
+    
+    # Raw commands
+    def get(self, key):
+        return self.data.get(key)
+    
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value).encode()
+        return True
+    
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+    
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+        return int(self.data[key])
+    
+    def expire(self, key, seconds):
+        return key in self.data
+    
+    def hincrby(self, name, field, amount=1):
+        values = self.data.setdefault(name, {})
+        values[field.encode()] = str(int(values.get(field.encode(), 0)) + amount).encode()
+        return int(values[field.encode()])
+    
+    def hmget(self, name, fields):
+        return [self.data.get(name, {}).get(field.encode()) for field in fields]
+    
+    def pipeline(self):
+        redis = self
+        
+        class Pipeline:
+            def __init__(self):
+                self.calls = []
+            
+            def __getattr__(self, command):
+                return lambda *args, **kwargs: self.calls.append((getattr(redis, command), args, kwargs))
+            
+            def execute(self):
+                return [method(*args, **kwargs) for method, args, kwargs in self.calls]
+        
+        return Pipeline()
+
+
+class TestRedisKeyScoping(unittest.TestCase):
+    """Test cases for Redis state read back through site-scoped keys"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.redis = ScopedKeyRedis()
+        cache_patcher = patch('frappe.cache', return_value=self.redis)
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+    
+    def test_circuit_breaker_opens_with_scoped_keys(self):
+        """Test that the breaker sees its own open flag once the threshold is reached"""
+        from erpnext_aramex_shipping.api.resilience import CircuitBreaker
+        
+        breaker = CircuitBreaker('https://ws.aramex.net', failure_threshold=2, failure_window=60, cooldown=30)
+        self.assertTrue(breaker.allow_request())
+        
+        breaker.record_failure()
+        breaker.record_failure()
+        
+        self.assertIn('site1|aramex_circuit:https://ws.aramex.net:open', self.redis.data)
+        self.assertFalse(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        
+        breaker.record_success()
+        self.redis.delete(breaker.get_key('open'))
+        self.assertTrue(breaker.allow_request())
+    
+    @patch('erpnext_aramex_shipping.api.rate_cache.get_aramex_client')
+    def test_rate_cache_stats_read_scoped_counters(self, mock_client):
+        """Test that the stats endpoint reads the counters the cache increments"""
+        from erpnext_aramex_shipping.api.rate_cache import RateCache, get_rate_cache_stats
+        
+        mock_client.return_value.settings = {}
+        cache = RateCache()
+        cache.count('hits')
+        cache.count('hits')
+        cache.count('hits')
+        cache.count('misses')
+        cache.flush_counts()
+        
+        result = get_rate_cache_stats()
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['stats']['hits'], 3)
+        self.assertEqual(result['stats']['misses'], 1)
+        self.assertEqual(result['stats']['hit_ratio'], 0.75)
+
+
+class TestSessionPool(unittest.TestCase):
+    """Test cases for the keep-alive session pool"""
+    
+    def test_session_is_reused_between_calls(self):
+        """Test that a released session is handed out again"""
+        pool = SessionPool(pool_size=2)
+        session, reused = pool.acquire()
+        self.assertFalse(reused)
+        pool.release(session)
+        
+        again, reused = pool.acquire()
+        self.assertIs(again, session)
+        self.assertTrue(reused)
+    
+    def test_pool_size_is_bounded(self):
+        """Test that sessions beyond the pool size are closed on release"""
+        pool = SessionPool(pool_size=1)
+        first, _ = pool.acquire()
+        second, _ = pool.acquire()
+        second.close = Mock()
+        
+        pool.release(first)
+        pool.release(second)
+        
+        self.assertEqual(len(pool), 1)
+        second.close.assert_called_once()
+    
+    @patch('time.monotonic')
+    def test_idle_sessions_are_evicted(self, mock_monotonic):
+        """Test that sessions idle longer than the timeout are not reused"""
+        pool = SessionPool(pool_size=2, idle_timeout=60)
+        mock_monotonic.return_value = 1000
+        session, _ = pool.acquire()
+        pool.release(session)
+        
+        mock_monotonic.return_value = 1061
+        fresh, reused = pool.acquire()
+        
+        self.assertIsNot(fresh, session)
+        self.assertFalse(reused)
+        self.assertEqual(len(pool), 0)
+    
+    @patch('requests.Session.post')
+    def test_stale_pooled_session_reconnects(self, mock_post):
+        """Test that a dropped keep-alive connection is retried on a fresh session"""
+        import requests
+        
+        pool = SessionPool(pool_size=2)
+        session, _ = pool.acquire()
+        pool.release(session)
+        
+        mock_response = Mock()
+        mock_post.side_effect = [requests.exceptions.ConnectionError('reset'), mock_response]
+        
+        response = pool.post('https://ws.dev.aramex.net/test', json={})
+        
+        self.assertIs(response, mock_response)
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(len(pool), 1)
+
+
+class TestAsyncAramexAPI(unittest.TestCase):
+    """Test cases for the asyncio Aramex client"""
+    
+    def test_gather_limited_bounds_concurrency(self):
+        """Test that gather_limited keeps results in order and caps concurrency"""
+        import asyncio
+        from erpnext_aramex_shipping.api.aramex_async import gather_limited
+        
+        state = {'running': 0, 'peak': 0}
+        
+        async def job(value):
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+            await asyncio.sleep(0.001)
+            state['running'] -= 1
+            return value * 2
+        
+        results = asyncio.run(gather_limited([job(i) for i in range(50)], limit=5))
+        
+        self.assertEqual(results, [i * 2 for i in range(50)])
+        self.assertEqual(state['peak'], 5)
+    
+    def test_gather_with_deadline_drops_slow_calls(self):
+        """Test that calls still running at the deadline come back as None"""
+        import asyncio
+        from erpnext_aramex_shipping.api.aramex_async import gather_with_deadline
+        
+        async def job(value, delay):
+            await asyncio.sleep(delay)
+            return value
+        
+        results = asyncio.run(gather_with_deadline([job('fast', 0), job('slow', 5), job('quick', 0.01)], 0.2))
+        
+        self.assertEqual(results, ['fast', None, 'quick'])
+    
+    @patch('erpnext_aramex_shipping.api.aramex_async.aiohttp')
+    def test_async_rates_use_shared_payload_builder(self, mock_aiohttp):
+        """Test that the async client sends the same payload as the sync one"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from erpnext_aramex_shipping.api.aramex import build_rate_payload
+        from erpnext_aramex_shipping.api.aramex_async import AsyncAramexAPI
+        
+        sync_api = Mock()
+        sync_api.get_client_info.return_value = {'UserName': 'testuser'}
+        api = AsyncAramexAPI(api=sync_api)
+        api.make_api_request = AsyncMock(return_value={
+            'TotalAmount': {'Value': 30.00, 'CurrencyCode': 'AED'}
+        })
+        shipment = {'origin_city': 'Dubai', 'destination_city': 'Riyadh', 'weight': 2}
+        
+        result = asyncio.run(api.get_shipping_rates(shipment))
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['rates'][0]['total_amount'], 30.00)
+        endpoint, payload = api.make_api_request.call_args.args
+        self.assertEqual(endpoint, 'ShippingAPI.V2/RateCalculator/CalculateRate')
+        self.assertEqual(payload, build_rate_payload(sync_api, shipment))
+
+    @patch('erpnext_aramex_shipping.api.aramex_async.aiohttp', None)
+    @patch('frappe.log_error')
+    def test_without_aiohttp_requests_run_on_threads(self, mock_log_error):
+        """Test that without aiohttp only HTTP runs on threads, in the caller's context"""
+        import asyncio
+        import contextvars
+        import threading
+        import requests
+        from erpnext_aramex_shipping.api.aramex_async import AsyncAramexAPI, gather_limited
+        
+        site = contextvars.ContextVar('site')
+        site.set('site1')
+        calls = []
+        
+        def send_request(url, payload, policy):
+            calls.append((threading.current_thread().name, site.get(None)))
+            if payload['DestinationAddress']['City'] == 'Muscat':
+                raise requests.exceptions.ConnectTimeout('connect timed out')
+            response = Mock()
+            response.json.return_value = {'TotalAmount': {'Value': 30.00, 'CurrencyCode': 'AED'}}
+            return response
+        
+        sync_api = Mock()
+        sync_api.base_url = 'https://ws.dev.aramex.net'
+        sync_api.get_client_info.return_value = {'UserName': 'testuser'}
+        sync_api.send_request.side_effect = send_request
+        shipments = [{'origin_city': 'Dubai', 'destination_city': city, 'weight': 2} for city in ['Riyadh', 'Doha', 'Muscat']]
+        
+        async def run():
+            async with AsyncAramexAPI(api=sync_api, concurrency=2) as api:
+                return await gather_limited([api.get_shipping_rates(data) for data in shipments], 2)
+        
+        log_threads = []
+        mock_log_error.side_effect = lambda *args: log_threads.append(threading.current_thread())
+        
+        results = asyncio.run(run())
+        
+        self.assertEqual([result['success'] for result in results], [True, True, False])
+        self.assertEqual(results[0]['rates'][0]['total_amount'], 30.00)
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(all(name.startswith('aramex') and value == 'site1' for name, value in calls))
+        sync_api.make_api_request.assert_not_called()
+        # The failure is written to the error log from the caller's thread
+        self.assertEqual(log_threads, [threading.main_thread()])
+    
+    @patch('erpnext_aramex_shipping.api.aramex_async.aiohttp', None)
+    def test_without_aiohttp_exit_waits_for_threads(self):
+        """Test that leaving the client cancels queued calls and waits for running ones"""
+        import asyncio
+        import threading
+        import time
+        from erpnext_aramex_shipping.api.aramex_async import AsyncAramexAPI, gather_with_deadline
+        
+        finished = []
+        
+        def send_request(url, payload, policy):
+            time.sleep(0.2)
+            finished.append(threading.current_thread().name)
+            return Mock()
+        
+        sync_api = Mock()
+        sync_api.base_url = 'https://ws.dev.aramex.net'
+        sync_api.send_request.side_effect = send_request
+        
+        async def run():
+            async with AsyncAramexAPI(api=sync_api, concurrency=1) as api:
+                return await gather_with_deadline([api.track_shipment(str(i)) for i in range(3)], 0.05, 3)
+        
+        results = asyncio.run(run())
+        
+        self.assertEqual(results, [None, None, None])
+        # The running call finished before run() returned; the queued ones never started
+        self.assertEqual(len(finished), 1)
+
+
+class TestRateCache(unittest.TestCase):
+    """Test cases for the rate quote cache"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        cache_patcher = patch('frappe.cache')
+        self.mock_redis = cache_patcher.start().return_value
+        self.mock_redis.get_value.return_value = None
+        self.addCleanup(cache_patcher.stop)
+        
+        self.profile = {
+            'origin_city': 'Dubai', 'origin_country_code': 'AE',
+            'destination_city': 'Riyadh', 'destination_country_code': 'SA',
+            'weight': 1.2, 'length': 20, 'width': 15, 'height': 10
+        }
+    
+    def test_same_billing_bracket_shares_key(self):
+        """Test that carts in the same weight bracket and lane share a cache key"""
+        from erpnext_aramex_shipping.api.rate_cache import get_rate_cache_key
+        
+        heavier = dict(self.profile, weight=1.5, origin_city=' dubai ', length=19.4)
+        next_bracket = dict(self.profile, weight=1.6)
+        
+        self.assertEqual(get_rate_cache_key(self.profile), get_rate_cache_key(heavier))
+        self.assertNotEqual(get_rate_cache_key(self.profile), get_rate_cache_key(next_bracket))
+        self.assertNotEqual(
+            get_rate_cache_key(self.profile),
+            get_rate_cache_key(dict(self.profile, product_type='PDX'))
+        )
+    
+    def test_lru_eviction_and_counters(self):
+        """Test that the least recently used entry is evicted and hits are counted"""
+        from erpnext_aramex_shipping.api.rate_cache import RateCache
+        
+        cache = RateCache(ttl=60, max_entries=2)
+        cache.set('a', {'rates': [1]})
+        cache.set('b', {'rates': [2]})
+        cache.get('a')
+        cache.set('c', {'rates': [3]})
+        
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'rates': [1]})
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 1)
+    
+    @patch('time.time')
+    def test_entries_expire_after_ttl(self, mock_time):
+        """Test that entries are not served after their TTL"""
+        from erpnext_aramex_shipping.api.rate_cache import RateCache
+        
+        cache = RateCache(ttl=60)
+        mock_time.return_value = 1000
+        cache.set('a', {'rates': [1]})
+        
+        mock_time.return_value = 1061
+        self.assertIsNone(cache.get('a'))
+    
+    def test_redis_entry_fills_local_cache(self):
+        """Test that a quote cached by another worker is served from Redis"""
+        import time
+        from erpnext_aramex_shipping.api.rate_cache import RateCache
+        
+        self.mock_redis.get_value.return_value = {'expires_at': time.time() + 30, 'value': {'rates': [9]}}
+        cache = RateCache(ttl=60)
+        
+        self.assertEqual(cache.get('shared'), {'rates': [9]})
+        self.assertEqual(len(cache), 1)
+    
+    def test_counters_reach_redis_in_batches(self):
+        """Test that local hits are counted in process and flushed every STATS_FLUSH_EVENTS"""
+        from erpnext_aramex_shipping.api.rate_cache import RateCache, STATS_FLUSH_EVENTS
+        
+        pipeline = self.mock_redis.pipeline.return_value
+        cache = RateCache(ttl=60)
+        cache.set('a', {'rates': [1]})
+        
+        for _ in range(STATS_FLUSH_EVENTS - 1):
+            cache.get('a')
+        pipeline.hincrby.assert_not_called()
+        self.mock_redis.hincrby.assert_not_called()
+        
+        cache.get('a')
+        pipeline.hincrby.assert_called_once_with(self.mock_redis.make_key.return_value, 'hits', STATS_FLUSH_EVENTS)
+        pipeline.execute.assert_called_once()
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Test cases for coalescing identical in-flight requests"""
+    
+    def test_concurrent_threads_share_one_call(self):
+        """Test that threads with the same key wait on a single call"""
+        import threading
+        import time
+        from erpnext_aramex_shipping.api.single_flight import SingleFlight
+        
+        group = SingleFlight(wait_timeout=5, distributed=False)
+        calls = []
+        results = []
+        
+        def fetch():
+            calls.append(1)
+            time.sleep(0.05)
+            return {'TotalAmount': {'Value': 30.00}}
+        
+        threads = [
+            threading.Thread(target=lambda: results.append(group.do('rate-key', fetch)))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(result['TotalAmount']['Value'] == 30.00 for result in results))
+    
+    @patch('frappe.cache')
+    def test_follower_reuses_result_from_other_worker(self, mock_cache):
+        """Test that a worker that loses the Redis lock reuses the leader's result"""
+        from erpnext_aramex_shipping.api.single_flight import SingleFlight
+        
+        redis = mock_cache.return_value
+        redis.set.return_value = None
+        redis.get.return_value = json.dumps({'result': {'TrackingResults': []}, 'error': None})
+        fetch = Mock()
+        
+        result = SingleFlight(wait_timeout=1).do('track-key', fetch)
+        
+        self.assertEqual(result, {'TrackingResults': []})
+        fetch.assert_not_called()
+    
+    def test_request_key_ignores_transaction_references(self):
+        """Test that requests differing only in references coalesce"""
+        from erpnext_aramex_shipping.api.single_flight import get_request_key
+        
+        first = {'Transaction': {'Reference1': 'RATE_1'}, 'ShipmentDetails': {'Weight': 1}}
+        second = {'Transaction': {'Reference1': 'RATE_2'}, 'ShipmentDetails': {'Weight': 1}}
+        
+        self.assertEqual(get_request_key('rate', first), get_request_key('rate', second))
 
 
 class TestShipmentValidation(unittest.TestCase):
@@ -295,6 +868,79 @@ class TestShipmentBusinessLogic(unittest.TestCase):
         self.assertFalse(result['success'])
         self.assertIn('Validation errors', result['message'])
     
+    @patch('erpnext_aramex_shipping.shipment.shipment.gather_shipping_rates')
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_rate_cache')
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_aramex_client')
+    @patch('frappe.logger')
+    def test_fetch_shipping_rates_bulk_dedupes_profiles(self, mock_logger, mock_get_client,
+                                                         mock_get_rate_cache, mock_gather):
+        """Test that bulk quoting sends identical profiles once and keeps input order"""
+        mock_get_client.return_value.settings = {'rate_bulk_concurrency': 8}
+        mock_get_rate_cache.return_value.get.return_value = None
+        mock_gather.return_value = [
+            {'success': True, 'rates': [{'total_amount': 25.5}], 'message': 'Success'}
+        ]
+        shipment = json.loads(self.valid_shipment_json)
+        profiles = [
+            dict(shipment, sales_order='SO-0001'),
+            {'weight': 1.5, 'sales_order': 'SO-0002'},
+            dict(shipment, weight=1.3, sales_order='SO-0003')
+        ]
+        
+        result = fetch_shipping_rates_bulk(json.dumps(profiles))
+        
+        self.assertTrue(result['success'])
+        self.assertEqual([item['sales_order'] for item in result['results']], ['SO-0001', 'SO-0002', 'SO-0003'])
+        self.assertEqual([item['success'] for item in result['results']], [True, False, True])
+        self.assertIn('Validation errors', result['results'][1]['message'])
+        # 1.5 KG and 1.3 KG fall in the same billing bracket
+        self.assertEqual(len(mock_gather.call_args.args[0]), 1)
+        self.assertEqual(mock_gather.call_args.args[1], 8)
+    
+    @patch('erpnext_aramex_shipping.shipment.shipment.gather_shipping_rates_by_deadline')
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_rate_cache')
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_aramex_client')
+    @patch('frappe.logger')
+    def test_shop_shipping_rates_ranks_and_drops_slow_products(self, mock_logger, mock_get_client,
+                                                               mock_get_rate_cache, mock_gather):
+        """Test that rate shopping ranks quotes by price and reports missing products"""
+        mock_get_client.return_value.settings = {}
+        mock_get_rate_cache.return_value.get.return_value = None
+        mock_gather.return_value = [
+            {'success': True, 'rates': [{'total_amount': 40.0, 'currency': 'AED'}]},
+            {'success': True, 'rates': [{'total_amount': 25.0, 'currency': 'AED'}]},
+            None
+        ]
+        
+        result = shop_shipping_rates(self.valid_shipment_json, deadline=2)
+        
+        self.assertTrue(result['success'])
+        self.assertEqual([rate['product_type'] for rate in result['rates']], ['PDX', 'PPX'])
+        self.assertEqual(result['rates'][0]['rank'], 1)
+        self.assertEqual([item['product_type'] for item in result['unavailable']], ['CDS'])
+        self.assertEqual(mock_gather.call_args.args[1], 2.0)
+        # International lane: only the Express group is quoted
+        self.assertEqual({quote['product_group'] for quote in mock_gather.call_args.args[0]}, {'EXP'})
+        self.assertEqual(mock_get_rate_cache.return_value.set.call_count, 2)
+    
+    @patch('erpnext_aramex_shipping.shipment.shipment.gather_shipping_rates_by_deadline')
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_rate_cache')
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_aramex_client')
+    @patch('frappe.logger')
+    def test_shop_shipping_rates_reads_transit_days_from_settings(self, mock_logger, mock_get_client,
+                                                                  mock_get_rate_cache, mock_gather):
+        """Test that configured transit days label quotes and break price ties"""
+        mock_get_client.return_value.settings = {'product_transit_days': '{"PDX": 1}'}
+        mock_get_rate_cache.return_value.get.return_value = None
+        mock_gather.return_value = [
+            {'success': True, 'rates': [{'total_amount': 30.0, 'currency': 'AED'}]} for _ in range(3)
+        ]
+        
+        result = shop_shipping_rates(self.valid_shipment_json)
+        
+        self.assertEqual([rate['product_type'] for rate in result['rates']], ['PDX', 'PPX', 'CDS'])
+        self.assertEqual([rate['transit_days'] for rate in result['rates']], [1, 2, 3])
+    
     @patch('erpnext_aramex_shipping.api.aramex.create_shipment')
     @patch('frappe.get_doc')
     @patch('frappe.db.commit')
@@ -329,27 +975,27 @@ class TestShipmentBusinessLogic(unittest.TestCase):
         self.assertFalse(result['success'])
         self.assertIn('Validation errors', result['message'])
     
-    @patch('erpnext_aramex_shipping.api.aramex.generate_shipping_label')
-    @patch('frappe.get_all')
-    @patch('frappe.get_doc')
-    @patch('frappe.db.commit')
+    @patch('erpnext_aramex_shipping.shipment.shipment.generate_shipping_label')
+    @patch('frappe.get_hooks')
+    @patch('frappe.db')
     @patch('frappe.logger')
-    def test_print_shipping_label_success(self, mock_logger, mock_commit, mock_get_doc, mock_get_all, mock_generate):
+    def test_print_shipping_label_success(self, mock_logger, mock_db, mock_get_hooks, mock_generate):
         """Test successful label printing"""
         mock_generate.return_value = {
             'success': True,
             'label_url': 'http://example.com/label.pdf'
         }
-        
-        mock_get_all.return_value = [{'name': 'ERPNEXT_SHIP_001'}]
-        mock_doc = Mock()
-        mock_doc.save.return_value = None
-        mock_get_doc.return_value = mock_doc
+        mock_get_hooks.return_value = {}
         
         result = print_shipping_label('SHIP123')
         
         self.assertTrue(result['success'])
         self.assertEqual(result['label_url'], 'http://example.com/label.pdf')
+        # One targeted UPDATE, no document load
+        mock_db.sql.assert_called_once()
+        query, values = mock_db.sql.call_args.args
+        self.assertIn('WHERE `aramex_shipment_id` = %s', query)
+        self.assertEqual(values[0], 'http://example.com/label.pdf')
     
     def test_print_shipping_label_missing_id(self):
         """Test label printing with missing shipment ID"""
@@ -358,12 +1004,16 @@ class TestShipmentBusinessLogic(unittest.TestCase):
         self.assertFalse(result['success'])
         self.assertIn('Shipment ID is required', result['message'])
     
-    @patch('erpnext_aramex_shipping.api.aramex.track_shipment')
-    @patch('frappe.get_all')
-    @patch('frappe.get_doc')
-    @patch('frappe.db.commit')
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_cached_tracking', return_value=None)
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_aramex_client')
+    @patch('erpnext_aramex_shipping.shipment.shipment.append_tracking_events')
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_stored_events')
+    @patch('erpnext_aramex_shipping.shipment.shipment.track_shipment')
+    @patch('frappe.get_hooks')
+    @patch('frappe.db')
     @patch('frappe.logger')
-    def test_track_aramex_shipment_success(self, mock_logger, mock_commit, mock_get_doc, mock_get_all, mock_track):
+    def test_track_aramex_shipment_success(self, mock_logger, mock_db, mock_get_hooks, mock_track,
+                                           mock_get_events, mock_append, mock_get_client, mock_get_cached):
         """Test successful shipment tracking"""
         mock_track.return_value = {
             'success': True,
@@ -376,16 +1026,94 @@ class TestShipmentBusinessLogic(unittest.TestCase):
             }]
         }
         
-        mock_get_all.return_value = [{'name': 'ERPNEXT_SHIP_001'}]
-        mock_doc = Mock()
-        mock_doc.save.return_value = None
-        mock_get_doc.return_value = mock_doc
+        mock_get_hooks.return_value = {}
+        mock_get_events.return_value = {'SHIP123': []}
+        mock_get_client.return_value.settings = {}
         
         result = track_aramex_shipment('SHIP123')
         
         self.assertTrue(result['success'])
         self.assertEqual(len(result['tracking_results']), 1)
         self.assertEqual(result['tracking_results'][0]['status'], 'In Transit')
+        # Nothing stored yet, so the full history is requested and appended
+        mock_track.assert_called_once_with('SHIP123', False)
+        mock_append.assert_called_once()
+        # Conditional UPDATE guarded by the last tracking update timestamp
+        mock_db.sql.assert_called_once()
+        query, values = mock_db.sql.call_args.args
+        self.assertIn('`last_tracking_update` <= %s', query)
+        self.assertEqual(values[0], 'In Transit')
+    
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_cached_tracking', return_value=None)
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_aramex_client')
+    @patch('erpnext_aramex_shipping.shipment.shipment.update_shipment_fields')
+    @patch('erpnext_aramex_shipping.shipment.shipment.append_tracking_events')
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_stored_events')
+    @patch('erpnext_aramex_shipping.shipment.shipment.track_shipment')
+    @patch('frappe.db')
+    @patch('frappe.logger')
+    def test_track_aramex_shipment_incremental(self, mock_logger, mock_db, mock_track, mock_get_events, mock_append,
+                                               mock_update, mock_get_client, mock_get_cached):
+        """Test that only the latest update is requested once events are stored"""
+        stored = [
+            {'date': '/Date(1704171600000+0400)/', 'location': 'Riyadh', 'status': 'In transit', 'comments': '', 'code': 'SH002'},
+            {'date': '/Date(1704096000000+0400)/', 'location': 'Dubai', 'status': 'Picked up', 'comments': '', 'code': 'SH001'}
+        ]
+        mock_get_events.return_value = {'SHIP123': stored}
+        mock_get_client.return_value.settings = {}
+        mock_db.get_value.return_value = 'SH001'
+        mock_track.return_value = {
+            'success': True,
+            'tracking_results': [{'waybill_number': 'SHIP123', 'status': 'SH002', 'events': stored[:1]}]
+        }
+        
+        result = track_aramex_shipment('SHIP123')
+        
+        mock_track.assert_called_once_with('SHIP123', True)
+        tracking_data = json.loads(mock_update.call_args.args[1]['tracking_data'])
+        self.assertEqual(len(tracking_data[0]['events']), 1)
+        # The response still carries the stored history
+        self.assertEqual(result['tracking_results'][0]['events'], stored)
+    
+    @patch('erpnext_aramex_shipping.shipment.shipment.update_shipment_fields')
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_stored_events')
+    @patch('erpnext_aramex_shipping.shipment.shipment.append_tracking_events')
+    @patch('erpnext_aramex_shipping.shipment.shipment.track_shipment')
+    @patch('erpnext_aramex_shipping.shipment.shipment.get_aramex_client')
+    @patch('frappe.enqueue')
+    @patch('frappe.db')
+    @patch('frappe.cache')
+    @patch('frappe.logger')
+    def test_track_aramex_shipment_cached(self, mock_logger, mock_cache, mock_db, mock_enqueue, mock_get_client,
+                                          mock_track, mock_append, mock_get_events, mock_update):
+        """Test that cached results are served and stale ones refreshed once in the background"""
+        mock_get_client.return_value.settings = {'tracking_cache_ttl': 300}
+        cached = {'success': True, 'tracking_results': [{'waybill_number': 'SHIP123', 'status': 'SH003'}]}
+        redis = mock_cache.return_value
+        redis.get_value.return_value = {'fetched_at': time.time(), 'status': 'SH003', 'result': cached}
+        
+        result = track_aramex_shipment('SHIP123')
+        
+        self.assertTrue(result['cached'])
+        mock_track.assert_not_called()
+        mock_enqueue.assert_not_called()
+        
+        # Stale: still served from cache, one refresh queued for all readers
+        redis.get_value.return_value['fetched_at'] = time.time() - 600
+        redis.set.side_effect = [True, None]
+        track_aramex_shipment('SHIP123')
+        track_aramex_shipment('SHIP123')
+        
+        mock_track.assert_not_called()
+        mock_enqueue.assert_called_once()
+        
+        # The refresh writes nothing when the status did not change
+        mock_track.return_value = {'success': True, 'tracking_results': [{'waybill_number': 'SHIP123', 'status': 'SH003', 'events': []}]}
+        mock_get_events.return_value = {'SHIP123': []}
+        refresh_shipment_tracking(mock_enqueue.call_args.kwargs['shipment_id'])
+        
+        mock_update.assert_not_called()
+        redis.set_value.assert_called_once()
     
     def test_track_aramex_shipment_missing_id(self):
         """Test shipment tracking with missing shipment ID"""
@@ -419,6 +1147,76 @@ class TestUtilityFunctions(unittest.TestCase):
         self.assertEqual(len(result['shipments']), 1)
         self.assertEqual(result['shipments'][0]['reference'], 'REF001')
     
+    @patch('frappe.db')
+    def test_get_shipments_pages_with_keyset_cursor(self, mock_db):
+        """Test that shipments are read page by page with a keyset cursor and indexed filters"""
+        from datetime import datetime
+        from erpnext_aramex_shipping.api.aramex import get_shipments
+        
+        rows = [
+            {'name': f'SHP{i}', 'aramex_shipment_id': str(1000 + i), 'consignee_name': 'Jane', 'status': 'SH005',
+             'destination_city': 'Dubai', 'destination_country_code': 'AE', 'creation_date': datetime(2024, 1, 3 - i)}
+            for i in range(3)
+        ]
+        mock_db.sql.return_value = rows
+        
+        first = get_shipments(json.dumps({'status': 'delivered', 'customer': 'Ja'}), limit=2)
+        
+        self.assertTrue(first['success'])
+        self.assertTrue(first['has_more'])
+        self.assertEqual([s['tracking_id'] for s in first['shipments']], ['1000', '1001'])
+        self.assertEqual(first['shipments'][0]['status'], 'delivered')
+        self.assertEqual(first['shipments'][0]['destination'], 'Dubai, AE')
+        query, values = mock_db.sql.call_args.args
+        self.assertNotIn('shipment_data', query)
+        self.assertNotIn('OFFSET', query)
+        self.assertIn('ORDER BY `creation_date` DESC, `name` DESC', query)
+        self.assertEqual(values[-2:], ('Ja%', 3))
+        
+        mock_db.sql.return_value = rows[2:]
+        second = get_shipments({'status': 'delivered'}, cursor=first['next_cursor'], limit=2)
+        
+        self.assertFalse(second['has_more'])
+        self.assertIsNone(second['next_cursor'])
+        query, values = mock_db.sql.call_args.args
+        self.assertIn('`creation_date` < %s OR (`creation_date` = %s AND `name` < %s)', query)
+        self.assertEqual(values[-4:], ('2024-01-02 00:00:00', '2024-01-02 00:00:00', 'SHP1', 3))
+    
+    @patch('frappe.db')
+    def test_get_shipments_since_returns_only_changes(self, mock_db):
+        """Test that a delta sync reads changed rows by modified and deletions from tombstones"""
+        from datetime import datetime
+        from erpnext_aramex_shipping.api.aramex import get_shipments
+        from erpnext_aramex_shipping.shipment.listing import encode_sync_cursor, decode_sync_cursor
+        
+        changed = {'name': 'SHP7', 'aramex_shipment_id': '1007', 'status': 'SH003',
+                   'creation_date': datetime(2024, 1, 1), 'modified': datetime(2024, 1, 5, 12)}
+        mock_db.sql.side_effect = [[changed], [('SHP3',)]]
+        
+        result = get_shipments(since=encode_sync_cursor('2024-01-05 11:00:00', None, '2024-01-05 11:00:00'))
+        
+        self.assertTrue(result['success'])
+        self.assertEqual([s['name'] for s in result['shipments']], ['SHP7'])
+        self.assertEqual(result['deleted'], ['SHP3'])
+        self.assertFalse(result['has_more'])
+        rows_query, values = mock_db.sql.call_args_list[0].args
+        self.assertIn('WHERE `modified` > %s AND `modified` <= %s', rows_query)
+        self.assertEqual(values[0], '2024-01-05 11:00:00')
+        self.assertIn('tabDeleted Document', mock_db.sql.call_args_list[1].args[0])
+        # The next sync starts after everything read up to the settle bound
+        modified, name, deleted_at = decode_sync_cursor(result['since'])
+        self.assertIsNone(name)
+        self.assertEqual(modified, deleted_at)
+    
+    def test_get_shipments_rejects_bad_cursor(self):
+        """Test that a tampered cursor is reported instead of raising"""
+        from erpnext_aramex_shipping.api.aramex import get_shipments
+        
+        result = get_shipments(cursor='not-a-cursor')
+        
+        self.assertFalse(result['success'])
+        self.assertIn('Invalid', result['message'])
+    
     def test_get_country_codes(self):
         """Test country codes retrieval"""
         from erpnext_aramex_shipping.shipment.shipment import get_country_codes
@@ -443,6 +1241,993 @@ class TestUtilityFunctions(unittest.TestCase):
         self.assertIn('dimension_units', config)
         self.assertIn('weight_units', config)
         self.assertIn('currency_codes', config)
+    
+    def test_created_shipment_diff_carries_its_name(self):
+        """Test that a pushed new shipment can be merged by name like a synced row"""
+        from erpnext_aramex_shipping.shipment.realtime import build_shipment_diff
+        
+        diff = build_shipment_diff({
+            'name': 'SHIP-0001', 'aramex_shipment_id': '1001', 'status': 'SH003',
+            'destination_city': 'Riyadh', 'destination_country_code': 'SA', 'creation_date': '2024-01-10'
+        }, created=True)
+        
+        self.assertEqual(diff['name'], 'SHIP-0001')
+        self.assertEqual(diff['tracking_id'], '1001')
+        self.assertEqual(diff['created_at'], '2024-01-10')
+        self.assertTrue(diff['created'])
+        # Status pushes carry only what changed
+        self.assertNotIn('name', build_shipment_diff({'aramex_shipment_id': '1001', 'status': 'SH005'}))
+
+
+class TestReferenceAllocator(unittest.TestCase):
+    """Test cases for the shipment reference allocator"""
+    
+    @patch('frappe.cache')
+    def test_references_come_from_reserved_blocks(self, mock_cache):
+        """Test that one Redis round trip serves a whole block of unique references"""
+        from erpnext_aramex_shipping.shipment.references import ReferenceAllocator
+        
+        redis = mock_cache.return_value
+        redis.incrby.side_effect = [10, 20]
+        allocator = ReferenceAllocator(block_size=10)
+        
+        references = [allocator.new_reference('SHIP') for _ in range(15)]
+        
+        self.assertEqual(redis.incrby.call_count, 2)
+        self.assertEqual(len(set(references)), 15)
+        self.assertEqual([ref.rsplit('_', 1)[1] for ref in references[:2]], ['0000000001', '0000000002'])
+        self.assertTrue(references[10].endswith('_0000000011'))
+        self.assertRegex(references[0], r'^SHIP_\d{14}_\d{10}$')
+    
+    @patch('frappe.db.sql')
+    @patch('frappe.cache')
+    def test_database_fallback_is_marked(self, mock_cache, mock_sql):
+        """Test that blocks reserved from the database cannot collide with Redis ones"""
+        from erpnext_aramex_shipping.shipment.references import ReferenceAllocator
+        
+        mock_cache.return_value.incrby.side_effect = Exception('Redis down')
+        mock_sql.side_effect = [[('0',)], None, [(5,)]]
+        
+        reference = ReferenceAllocator(block_size=5).new_reference('RATE')
+        
+        self.assertTrue(reference.endswith('_D0000000001'))
+
+
+class TestShipmentPersistence(unittest.TestCase):
+    """Test cases for batched shipment persistence"""
+    
+    def make_doc(self, values, names):
+        """Mock document named by set_new_name from `names`, with a default filled in"""
+        doc = Mock()
+        doc.name = values.get('name')
+        doc.get.side_effect = values.get
+        doc.set_new_name.side_effect = lambda set_name=None: setattr(doc, 'name', set_name or next(names))
+        doc.get_valid_dict.side_effect = lambda **kwargs: dict(
+            {key: value for key, value in values.items() if key != 'doctype'},
+            name=doc.name, naming_series='SHIP-.#####', docstatus=0
+        )
+        return doc
+    
+    @patch('frappe.get_attr')
+    @patch('frappe.get_hooks')
+    @patch('frappe.db')
+    def test_insert_shipments_writes_once_and_runs_hooks(self, mock_db, mock_get_hooks, mock_get_attr):
+        """Test that many records go out in one INSERT and one commit, with after_insert hooks"""
+        from erpnext_aramex_shipping.shipment.persistence import insert_shipments
+        
+        names = iter(['SHIP-00001', 'SHIP-00002', 'SHIP-00003'])
+        mock_get_hooks.return_value = {'Aramex Shipment': {'after_insert': ['app.hooks.count_shipment']}}
+        records = [{'doctype': 'Aramex Shipment', 'reference': f'SHIP-{i}', 'status': 'Created'} for i in range(3)]
+        
+        with patch('frappe.get_doc', side_effect=lambda values: self.make_doc(values, names)):
+            inserted = insert_shipments(records)
+        
+        # Named by the doctype's autoname rule and validated before the write
+        self.assertEqual(inserted, ['SHIP-00001', 'SHIP-00002', 'SHIP-00003'])
+        mock_db.bulk_insert.assert_called_once()
+        fields, values = mock_db.bulk_insert.call_args.args[1:]
+        self.assertIn('reference', fields)
+        self.assertEqual([row[fields.index('name')] for row in values], inserted)
+        # Columns filled on the document, not only those of the records, are written
+        self.assertEqual({row[fields.index('naming_series')] for row in values}, {'SHIP-.#####'})
+        mock_db.commit.assert_called_once()
+        self.assertEqual(mock_get_attr.return_value.call_count, 3)
+        hooked = [call.args[0] for call in mock_get_attr.return_value.call_args_list]
+        self.assertTrue(all(doc.run_method.call_args.args == ('before_insert',) for doc in hooked))
+        self.assertTrue(all(doc.run_before_save_methods.call_count == 1 for doc in hooked))
+    
+    def test_insert_relies_only_on_present_document_internals(self):
+        """Test that the Document internals prepare_insert calls exist in the installed Frappe"""
+        from erpnext_aramex_shipping.shipment.persistence import INSERT_INTERNALS
+        
+        try:
+            from frappe.model.document import Document
+        except ImportError:
+            self.skipTest('Frappe is not installed')
+        
+        for method in INSERT_INTERNALS + ('set_new_name', 'run_before_save_methods', 'get_valid_dict'):
+            self.assertTrue(callable(getattr(Document, method, None)), method)
+    
+    @patch('frappe.get_hooks')
+    @patch('frappe.db')
+    def test_insert_shipments_writes_nothing_when_a_record_is_invalid(self, mock_db, mock_get_hooks):
+        """Test that a record failing validation stops the whole batch before the INSERT"""
+        from erpnext_aramex_shipping.shipment.persistence import insert_shipments
+        
+        names = iter(['SHIP-00001', 'SHIP-00002'])
+        
+        def get_doc(values):
+            doc = self.make_doc(values, names)
+            if values.get('reference') == 'SHIP-1':
+                doc._validate.side_effect = Exception('Value missing for Aramex Shipment: Weight')
+            return doc
+        
+        records = [{'reference': f'SHIP-{i}', 'status': 'Created'} for i in range(2)]
+        
+        with patch('frappe.get_doc', side_effect=get_doc):
+            with self.assertRaises(Exception):
+                insert_shipments(records)
+        
+        mock_db.bulk_insert.assert_not_called()
+        mock_db.commit.assert_not_called()
+    
+    @patch('frappe.get_hooks')
+    @patch('frappe.db')
+    def test_update_shipments_uses_one_case_statement(self, mock_db, mock_get_hooks):
+        """Test that status updates for many rows are written by a single UPDATE"""
+        from erpnext_aramex_shipping.shipment.persistence import update_shipments
+        
+        mock_get_hooks.return_value = {}
+        
+        updated = update_shipments([
+            {'aramex_shipment_id': '1001', 'status': 'Delivered'},
+            {'aramex_shipment_id': '1002', 'status': 'In Transit', 'tracking_data': '{}'}
+        ], key_field='aramex_shipment_id')
+        
+        self.assertEqual(updated, 2)
+        mock_db.sql.assert_called_once()
+        query, values = mock_db.sql.call_args.args
+        self.assertIn('`status` = CASE `aramex_shipment_id` WHEN %s THEN %s WHEN %s THEN %s', query)
+        self.assertEqual(values[-2:], ('1001', '1002'))
+        mock_db.commit.assert_called_once()
+    
+    @patch('frappe.get_all')
+    @patch('frappe.get_attr')
+    @patch('frappe.get_hooks')
+    @patch('frappe.db')
+    def test_update_shipments_restamps_rows_after_hooks(self, mock_db, mock_get_hooks, mock_get_attr, mock_get_all):
+        """Test that rows are stamped modified again after slow hooks, just before the commit"""
+        from erpnext_aramex_shipping.shipment.persistence import update_shipments
+        
+        calls = []
+        mock_get_hooks.return_value = {'Aramex Shipment': {'on_update': ['app.hooks.index_shipment']}}
+        mock_get_all.return_value = [{'name': 'SHP1', 'aramex_shipment_id': '1001', 'status': 'SH003'}]
+        mock_get_attr.return_value.side_effect = lambda doc, event: calls.append('hook')
+        mock_db.sql.side_effect = lambda query, values: calls.append(query.split()[0] + (
+            ' modified' if query.startswith('UPDATE') and 'SET `modified`' in query else ''))
+        mock_db.commit.side_effect = lambda: calls.append('commit')
+        
+        with patch('frappe.get_doc', side_effect=lambda values: Mock()):
+            update_shipments([{'aramex_shipment_id': '1001', 'status': 'SH005'}], key_field='aramex_shipment_id')
+        
+        self.assertEqual(calls, ['UPDATE', 'hook', 'UPDATE modified', 'commit'])
+        self.assertEqual(mock_db.sql.call_args.args[1][1:], ('1001',))
+    
+    def test_update_shipments_rejects_unsafe_fields(self):
+        """Test that field names are checked before they are put into SQL"""
+        from erpnext_aramex_shipping.shipment.persistence import update_shipments
+        
+        with patch('frappe.get_hooks', return_value={}), patch('frappe.db'):
+            with self.assertRaises(ValueError):
+                update_shipments([{'name': 'SHP-1', 'status`=1; --': 'x'}])
+
+
+class TestTrackingPoller(unittest.TestCase):
+    """Test cases for the scheduled tracking poller"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        cache_patcher = patch('frappe.cache')
+        self.mock_redis = cache_patcher.start().return_value
+        self.mock_redis.make_key.side_effect = lambda key: key
+        self.mock_redis.get.return_value = b'1'
+        self.mock_redis.hmget.side_effect = lambda key, fields: [
+            json.dumps({'lane': 'AE-SA', 'created': 0}) if key == 'aramex_tracking_meta' else None
+            for _ in fields
+        ]
+        self.addCleanup(cache_patcher.stop)
+    
+    @patch('erpnext_aramex_shipping.shipment.tracking.append_tracking_events')
+    @patch('erpnext_aramex_shipping.shipment.tracking.update_shipments')
+    @patch('erpnext_aramex_shipping.shipment.tracking.gather_tracking_batches')
+    @patch('erpnext_aramex_shipping.shipment.tracking.get_aramex_client')
+    @patch('erpnext_aramex_shipping.shipment.tracking.get_shipment_statuses')
+    @patch('frappe.logger')
+    def test_poll_tracks_due_shipments_in_batches(self, mock_logger, mock_get_statuses, mock_get_client,
+                                                   mock_gather, mock_update, mock_append):
+        """Test that due shipments are tracked in batches and only changed statuses are written"""
+        from erpnext_aramex_shipping.shipment.tracking import poll_shipments
+        
+        due = [str(1000 + i) for i in range(6)]
+        self.mock_redis.zrangebyscore.return_value = [shipment_id.encode() for shipment_id in due]
+        mock_get_statuses.return_value = dict({shipment_id: 'SH003' for shipment_id in due[:5]}, **{'1005': 'SH005'})
+        mock_get_client.return_value.settings = {'tracking_batch_size': 2}
+        mock_gather.return_value = [
+            {'success': True, 'tracking_results': [
+                {'waybill_number': '1000', 'status': 'SH005'},
+                {'waybill_number': '1001', 'status': 'SH003'}
+            ]},
+            {'success': True, 'tracking_results': [{'waybill_number': '1002', 'status': 'SH004'}]},
+            {'success': False, 'tracking_results': [], 'message': 'timeout'}
+        ]
+        mock_update.return_value = 2
+        mock_append.return_value = 3
+        
+        with patch('frappe.log_error'), patch('frappe.publish_realtime') as mock_publish, \
+                patch('frappe.generate_hash', return_value='run-token'), \
+                patch('erpnext_aramex_shipping.shipment.realtime.get_shipment_room', return_value='doctype:Aramex Shipment'):
+            summary = poll_shipments()
+        
+        # 1005 was already delivered, so it leaves the queue without a carrier call
+        self.assertEqual(mock_gather.call_args.args[0], [['1000', '1001'], ['1002', '1003'], ['1004']])
+        self.assertTrue(mock_gather.call_args.kwargs['last_update_only'])
+        # One realtime message carrying only the changed dashboard fields
+        event, message = mock_publish.call_args.args
+        self.assertEqual(event, 'shipment_updated')
+        # Only sockets allowed to read shipments are in the doctype room
+        self.assertEqual(mock_publish.call_args.kwargs['room'], 'doctype:Aramex Shipment')
+        self.assertEqual([(d['tracking_id'], d['aramex_status'], d['status']) for d in message['shipments']],
+                         [('1000', 'SH005', 'delivered'), ('1002', 'SH004', 'in_transit')])
+        self.assertNotIn('tracking_data', message['shipments'][0])
+        updates = mock_update.call_args.args[0]
+        self.assertEqual([(u['aramex_shipment_id'], u['status']) for u in updates], [('1000', 'SH005'), ('1002', 'SH004')])
+        self.assertEqual(summary, {'tracked': 5, 'updated': 2, 'new_events': 3, 'failed_batches': 1, 'finished': 1})
+        
+        next_polls = self.mock_redis.zadd.call_args.args[1]
+        self.assertNotIn('1000', next_polls)
+        # Shipments of the failed batch are retried before the next regular poll
+        self.assertLess(next_polls['1004'], next_polls['1002'])
+        # The run lock holds this run's token and is released only if it still does
+        self.assertEqual(self.mock_redis.set.call_args.args, ('aramex_tracking_poll_lock', 'run-token'))
+        script, numkeys, *args = self.mock_redis.eval.call_args.args
+        self.assertIn("redis.call('get', KEYS[1]) == ARGV[1]", script)
+        self.assertEqual((numkeys, args), (1, ['aramex_tracking_poll_lock', 'run-token']))
+        self.mock_redis.delete.assert_not_called()
+    
+    @patch('erpnext_aramex_shipping.shipment.tracking.gather_tracking_batches')
+    @patch('frappe.logger')
+    def test_poll_is_skipped_while_a_run_holds_the_lock(self, mock_logger, mock_gather):
+        """Test that a scheduler run overlapping the previous one does nothing"""
+        from erpnext_aramex_shipping.shipment.tracking import poll_shipments
+        
+        self.mock_redis.set.return_value = None
+        
+        summary = poll_shipments()
+        
+        self.assertEqual(summary, {'skipped': True})
+        self.assertEqual(self.mock_redis.set.call_args.kwargs, {'ex': 15 * 60, 'nx': True})
+        mock_gather.assert_not_called()
+        self.mock_redis.zrangebyscore.assert_not_called()
+        self.mock_redis.eval.assert_not_called()
+    
+    @patch('frappe.db.sql')
+    def test_seed_schedule_reads_lanes_without_shipment_blobs(self, mock_sql):
+        """Test that seeding selects the lane's country codes instead of the shipment_data blob"""
+        from erpnext_aramex_shipping.shipment.tracking import seed_schedule
+        
+        mock_sql.return_value = [{
+            'aramex_shipment_id': '1001', 'creation_date': None, 'origin_country_code': None,
+            'shipper_country_code': 'AE', 'destination_country_code': None, 'consignee_country_code': 'SA'
+        }]
+        
+        self.assertEqual(seed_schedule(), 1)
+        
+        query = mock_sql.call_args.args[0]
+        self.assertEqual(query.count('`shipment_data`'), query.count('JSON_EXTRACT(`shipment_data`'))
+        meta = self.mock_redis.pipeline.return_value.hset.call_args.kwargs['mapping']
+        self.assertEqual(json.loads(meta['1001'])['lane'], 'AE-SA')
+    
+    def test_poll_interval_follows_status_and_age(self):
+        """Test that the next poll time depends on status, age and lane transit time"""
+        from erpnext_aramex_shipping.shipment.tracking import get_poll_interval
+        
+        out_for_delivery = get_poll_interval('SH003', 40, 48)
+        in_transit = get_poll_interval('SH004', 40, 48)
+        fresh = get_poll_interval('SH004', 2, 48)
+        stuck = get_poll_interval('SH004', 200, 48)
+        
+        self.assertLess(out_for_delivery, in_transit)
+        self.assertLess(in_transit, fresh)
+        self.assertLess(fresh, stuck)
+    
+    @patch('frappe.db')
+    def test_append_tracking_events_ignores_duplicates(self, mock_db):
+        """Test that events are appended with one INSERT IGNORE keyed on waybill, date and code"""
+        from erpnext_aramex_shipping.shipment.events import append_tracking_events, parse_aramex_datetime
+        
+        mock_db._cursor.rowcount = 1
+        inserted = append_tracking_events([
+            {'waybill_number': '1000', 'events': [
+                {'date': '/Date(1704096000000+0400)/', 'location': 'Dubai', 'status': 'Picked up', 'code': 'SH001'}
+            ]},
+            {'waybill_number': '1001', 'events': [
+                {'date': '/Date(1704096000000+0400)/', 'location': 'Dubai', 'status': 'Picked up', 'code': 'SH001'}
+            ]}
+        ])
+        
+        self.assertEqual(inserted, 1)
+        mock_db.sql.assert_called_once()
+        query, values = mock_db.sql.call_args.args
+        self.assertIn('INSERT IGNORE', query)
+        self.assertEqual((values[0], values[8]), ('1000', '1001'))
+        self.assertEqual(parse_aramex_datetime('/Date(1704096000000+0400)/'), values[3])
+        self.assertIsNone(parse_aramex_datetime('not a date'))
+
+
+class TestDashboardStats(unittest.TestCase):
+    """Test cases for incrementally maintained dashboard statistics"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        cache_patcher = patch('frappe.cache')
+        self.mock_redis = cache_patcher.start().return_value
+        self.mock_redis.make_key.side_effect = lambda key: key
+        self.pipeline = self.mock_redis.pipeline.return_value
+        self.addCleanup(cache_patcher.stop)
+    
+    def test_hooks_update_counters_incrementally(self):
+        """Test that inserts and status changes touch only the affected counters"""
+        from datetime import datetime
+        from erpnext_aramex_shipping.shipment.stats import on_shipment_insert, on_shipment_update
+        
+        doc = Mock(name='SHP1')
+        doc.get.side_effect = dict(status='Created', creation_date=datetime(2024, 1, 1, 10),
+                                   destination_city='Dubai', destination_country_code='AE').get
+        on_shipment_insert(doc)
+        
+        increments = [call.args for call in self.pipeline.hincrby.call_args_list]
+        self.assertEqual([args for args in increments if args[0] == 'aramex_shipment_stats'], [
+            ('aramex_shipment_stats', 'total', 1),
+            ('aramex_shipment_stats', 'status:pending', 1),
+            ('aramex_shipment_stats', 'day:2024-01-01', 1),
+            ('aramex_shipment_stats', 'week:2024-W01', 1)
+        ])
+        # Every increment is also logged for a reconcile that may be running
+        self.assertEqual([args[1:] for args in increments if args[0] == 'aramex_shipment_stats:delta'],
+                         [args[1:] for args in increments if args[0] == 'aramex_shipment_stats'])
+        self.assertEqual([call.args for call in self.pipeline.zincrby.call_args_list], [
+            ('aramex_shipment_destinations', 1, 'Dubai, AE'),
+            ('aramex_shipment_destinations:delta', 1, 'Dubai, AE')
+        ])
+        
+        self.pipeline.reset_mock()
+        delivered = Mock(name='SHP1')
+        delivered.get.side_effect = dict(status='SH005', creation_date=datetime(2024, 1, 1, 10),
+                                         last_tracking_update=datetime(2024, 1, 3, 10)).get
+        delivered.get_doc_before_save.return_value = doc
+        on_shipment_update(delivered)
+        
+        increments = [call.args[1:] for call in self.pipeline.hincrby.call_args_list
+                      if call.args[0] == 'aramex_shipment_stats']
+        self.assertEqual(increments, [('status:pending', -1), ('status:delivered', 1), ('delivered_count', 1)])
+        self.assertEqual([call.args for call in self.pipeline.hincrbyfloat.call_args_list], [
+            ('aramex_shipment_stats', 'delivered_hours', 48.0),
+            ('aramex_shipment_stats:delta', 'delivered_hours', 48.0)
+        ])
+    
+    @patch('erpnext_aramex_shipping.shipment.stats.compute_stats')
+    def test_reconcile_replays_increments_made_during_the_scan(self, mock_compute):
+        """Test that hook increments counted while the database was scanned survive the swap"""
+        from erpnext_aramex_shipping.shipment.stats import reconcile_stats
+        
+        events = []
+        self.mock_redis.delete.side_effect = lambda *keys: events.append(('clear', keys))
+        mock_compute.side_effect = lambda: events.append('scan') or {
+            'fields': {'total': 10, 'status:in_transit': 4, 'status:delivered': 6}, 'destinations': {'Dubai, AE': 10}
+        }
+        self.pipeline.execute.side_effect = [
+            [],
+            [{b'total': b'1', b'status:in_transit': b'-1', b'status:delivered': b'2', b'delivered_hours': b'24.5'},
+             [(b'Dubai, AE', 1.0)]],
+            []
+        ]
+        
+        fields = reconcile_stats()
+        
+        self.assertEqual(events[:2], [('clear', ('aramex_shipment_stats:delta', 'aramex_shipment_destinations:delta')), 'scan'])
+        self.assertEqual(fields['total'], 10)
+        # The deltas are moved aside in the same transaction as the swap
+        self.pipeline.rename.assert_any_call('aramex_shipment_stats:rebuild', 'aramex_shipment_stats')
+        self.pipeline.rename.assert_any_call('aramex_shipment_stats:delta', 'aramex_shipment_stats:replay')
+        # ... then added to the live counters
+        replayed = [call.args for call in self.pipeline.hincrby.call_args_list if call.args[0] == 'aramex_shipment_stats']
+        self.assertEqual(replayed, [
+            ('aramex_shipment_stats', 'total', 1),
+            ('aramex_shipment_stats', 'status:in_transit', -1),
+            ('aramex_shipment_stats', 'status:delivered', 2)
+        ])
+        self.pipeline.hincrbyfloat.assert_called_once_with('aramex_shipment_stats', 'delivered_hours', 24.5)
+        self.pipeline.zincrby.assert_called_once_with('aramex_shipment_destinations', 1.0, b'Dubai, AE')
+    
+    def test_read_stats_uses_one_hmget(self):
+        """Test that the dashboard reads every counter in one round trip"""
+        from datetime import date
+        from erpnext_aramex_shipping.shipment.stats import read_stats
+        
+        counters = {
+            'total': b'10', 'status:delivered': b'6', 'status:in_transit': b'3', 'status:failed': b'1',
+            'delivered_count': b'2', 'delivered_hours': b'96', 'day:2024-01-10': b'2', 'day:2024-01-08': b'3',
+            'week:2024-W02': b'5'
+        }
+        self.mock_redis.hmget.side_effect = lambda key, fields: [counters.get(field) for field in fields]
+        self.mock_redis.zrevrange.return_value = [(b'Dubai, AE', 7.0), (b'Riyadh, SA', 3.0)]
+        
+        stats = read_stats(today=date(2024, 1, 10))
+        
+        self.mock_redis.hmget.assert_called_once()
+        self.assertEqual(stats['total_shipments'], 10)
+        self.assertEqual(stats['delivered_shipments'], 6)
+        self.assertEqual(stats['today_shipments'], 2)
+        self.assertEqual(stats['this_week_shipments'], 5)
+        self.assertEqual(stats['average_delivery_time'], 2.0)
+        self.assertEqual(stats['weekly'][0], {'week': '2024-W02', 'count': 5})
+        self.assertEqual(stats['top_destinations'][0], {'destination': 'Dubai, AE', 'count': 7})
+
+
+class TestShipmentSearch(unittest.TestCase):
+    """Test cases for the trigram shipment search index"""
+    
+    def test_query_trigrams(self):
+        """Test that queries map to trigrams with a word-start bonus and a match threshold"""
+        from erpnext_aramex_shipping.shipment.search import get_query_trigrams, get_trigrams
+        
+        self.assertEqual(get_query_trigrams('Dubai'), ({'dub', 'uba', 'bai', ' du'}, {'dub', 'uba', 'bai'}, 3))
+        self.assertEqual(get_query_trigrams(' DU '), ({' du'}, {' du'}, 1))
+        self.assertTrue(get_query_trigrams('Dubai')[0] <= get_trigrams(['Dubai']))
+        with self.assertRaises(ValueError):
+            get_query_trigrams('d')
+    
+    @patch('frappe.db')
+    def test_get_shipments_search_is_ranked_and_paginated(self, mock_db):
+        """Test that a search filter reads ranked matches from the trigram table"""
+        from erpnext_aramex_shipping.api.aramex import get_shipments
+        from erpnext_aramex_shipping.shipment.search import decode_search_cursor
+        
+        postings = [('bai', 5000), ('dub', 40), ('uba', 900)]
+        mock_db.sql.side_effect = [postings, [
+            {'name': f'SHP{i}', 'aramex_shipment_id': str(1000 + i), 'status': 'SH003', 'search_score': 4}
+            for i in (9, 8, 7)
+        ]]
+        
+        result = get_shipments(filters=json.dumps({'search': 'Dubai', 'status': 'delivered'}), limit=2)
+        
+        self.assertTrue(result['success'])
+        self.assertEqual([s['name'] for s in result['shipments']], ['SHP9', 'SHP8'])
+        self.assertTrue(result['has_more'])
+        self.assertEqual(decode_search_cursor(result['next_cursor']), (4, 'SHP8'))
+        
+        # Candidates come from the rarest trigram only, filtered, then capped
+        # newest first before scoring
+        query, values = mock_db.sql.call_args.args
+        self.assertIn('FROM `aramex_shipment_trigram`', query)
+        self.assertIn('HAVING `score` >= %s', query)
+        self.assertIn('ORDER BY `creation` DESC', query)
+        self.assertIn('ORDER BY `search_score` DESC, `name` DESC', query)
+        self.assertLess(query.index('`status` IN'), query.index('AS `candidates`'))
+        self.assertNotIn('LIKE', query)
+        self.assertNotIn('OFFSET', query)
+        self.assertEqual(values[0], 'dub')
+        cap = values.index(5000)
+        self.assertEqual(values[cap:cap + 6], (5000, ' du', 'bai', 'dub', 'uba', 3))
+        self.assertEqual(values[-1], 3)
+        
+        # The next page follows on from the last row's score and name
+        mock_db.sql.side_effect = [postings, []]
+        result = get_shipments(
+            filters=json.dumps({'search': 'Dubai', 'status': 'delivered'}), limit=2, cursor=result['next_cursor']
+        )
+        
+        self.assertTrue(result['success'])
+        self.assertFalse(result['has_more'])
+        self.assertIsNone(result['next_cursor'])
+        query, values = mock_db.sql.call_args.args
+        self.assertIn('WHERE `matches`.`score` < %s OR (`matches`.`score` = %s AND `name` < %s)', query)
+        self.assertEqual(values[-4:], (4, 4, 'SHP8', 3))
+    
+    @patch('frappe.db')
+    def test_search_anchors_on_enough_rare_trigrams(self, mock_db):
+        """Test that a typo-tolerant search takes candidates from every trigram a match may not miss"""
+        from erpnext_aramex_shipping.shipment.search import get_anchor_trigrams
+        
+        mock_db.sql.return_value = [('abc', 3), ('bcd', 5000), ('cde', 1), ('def', 70), ('efg', 5000)]
+        
+        # Five trigrams with four required: a match misses at most one, so holds one of the two rarest
+        self.assertEqual(get_anchor_trigrams({'abc', 'bcd', 'cde', 'def', 'efg'}, 4), ['cde', 'abc'])
+        self.assertEqual(mock_db.sql.call_args.args[1][:3], ('abc', 'abc', 5000))
+        
+        mock_db.sql.reset_mock()
+        self.assertEqual(get_anchor_trigrams({' du'}, 1), [' du'])
+        mock_db.sql.assert_not_called()
+    
+    @patch('frappe.get_all')
+    @patch('frappe.db')
+    def test_update_hook_reindexes_only_on_searched_changes(self, mock_db, mock_get_all):
+        """Test that status updates leave the index alone and a new consignee re-indexes"""
+        from erpnext_aramex_shipping.shipment.search import on_shipment_update
+        
+        before = Mock()
+        before.get.side_effect = dict(consignee_name='John Doe', status='SH003').get
+        doc = Mock()
+        doc.name = 'SHP1'
+        doc.get_doc_before_save.return_value = before
+        doc.get.side_effect = dict(consignee_name='John Doe', status='SH005').get
+        
+        on_shipment_update(doc)
+        mock_db.sql.assert_not_called()
+        
+        doc.get.side_effect = dict(consignee_name='Jane Doe', status='SH005').get
+        mock_get_all.return_value = [{'name': 'SHP1', 'consignee_name': 'Jane Doe'}]
+        on_shipment_update(doc)
+        
+        delete, insert = [call.args for call in mock_db.sql.call_args_list]
+        self.assertIn('DELETE FROM `aramex_shipment_trigram`', delete[0])
+        self.assertEqual(delete[1], ('SHP1',))
+        self.assertIn('INSERT IGNORE INTO `aramex_shipment_trigram`', insert[0])
+        self.assertIn(' ja', insert[1])
+
+
+class StandInAramexSender:
+    """Local stand-in for Aramex pushing signed tracking notifications"""
+    
+    def __init__(self, secret, waybills):
+        self.secret = secret
+        self.waybills = waybills
+        self.sequence = 0
+    
+    def build_batch(self, size):
+        """Signed body of `size` notifications spread over the waybills"""
+        from erpnext_aramex_shipping.shipment.webhook import sign_payload
+        
+        notifications = []
+        for _ in range(size):
+            self.sequence += 1
+            notifications.append({
+                'WaybillNumber': self.waybills[self.sequence % len(self.waybills)],
+                'UpdateCode': 'SH003' if self.sequence % 2 else 'SH004',
+                'UpdateDescription': 'In transit',
+                'UpdateDateTime': f'/Date({1704096000000 + self.sequence * 1000}+0400)/',
+                'UpdateLocation': 'Dubai'
+            })
+        body = json.dumps(notifications).encode()
+        return body, sign_payload(body, self.secret)
+
+
+class InMemoryInbox:
+    """Redis double backing the webhook lists and run set with Python lists and a dict"""
+    
+    def __init__(self):
+        self.lists = {}
+        self.runs = {}
+    
+    @property
+    def items(self):
+        return self.lists.setdefault('aramex_tracking_inbox', [])
+    
+    @property
+    def dead_letters(self):
+        return self.lists.setdefault('aramex_tracking_dead_letters', [])
+    
+    def pipeline(self):
+        return InMemoryPipeline(self)
+    
+    def rpush(self, key, *values):
+        target = self.lists.setdefault(key, [])
+        target.extend(values)
+        return len(target)
+    
+    def lpush(self, key, *values):
+        self.lists.setdefault(key, [])[0:0] = list(reversed(values))
+    
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+    
+    def lmove(self, source, destination, where_from, where_to):
+        items = self.lists.get(source)
+        if not items:
+            return None
+        item = items.pop(0 if where_from == 'LEFT' else -1)
+        if not items:
+            # Redis drops a list once its last item is gone
+            del self.lists[source]
+        target = self.lists.setdefault(destination, [])
+        target.insert(0 if where_to == 'LEFT' else len(target), item)
+        return item
+    
+    def delete(self, *keys):
+        for key in keys:
+            self.lists.pop(key, None)
+    
+    def zadd(self, key, mapping):
+        self.runs.update(mapping)
+    
+    def zrem(self, key, *members):
+        for member in members:
+            self.runs.pop(member, None)
+    
+    def zrangebyscore(self, key, low, high):
+        return [member for member, score in self.runs.items() if score <= high]
+
+
+class InMemoryPipeline:
+    """Pipeline over InMemoryInbox, running the queued commands on execute"""
+    
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+    
+    def __getattr__(self, name):
+        def queue(*args):
+            self.commands.append(lambda: getattr(self.redis, name)(*args))
+            return self
+        return queue
+    
+    def execute(self):
+        return [command() for command in self.commands]
+
+
+class TestTrackingWebhook(unittest.TestCase):
+    """Test cases for pushed tracking notifications"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.inbox = InMemoryInbox()
+        cache_patcher = patch('frappe.cache')
+        mock_cache = cache_patcher.start()
+        mock_cache.return_value.pipeline.side_effect = self.inbox.pipeline
+        mock_cache.return_value.zrangebyscore.side_effect = self.inbox.zrangebyscore
+        mock_cache.return_value.make_key.side_effect = lambda key: key
+        self.addCleanup(cache_patcher.stop)
+        
+        client_patcher = patch('erpnext_aramex_shipping.shipment.webhook.get_aramex_client')
+        self.settings = {'webhook_secret': 's3cret', 'webhook_flush_batch_size': 2000}
+        client_patcher.start().return_value.settings = self.settings
+        self.addCleanup(client_patcher.stop)
+        
+        self.waybills = [str(1000 + i) for i in range(500)]
+        self.sender = StandInAramexSender('s3cret', self.waybills)
+    
+    def receive(self, body, signature):
+        from erpnext_aramex_shipping.shipment.webhook import receive_tracking_notifications
+        
+        with patch('frappe.request') as mock_request, patch('frappe.get_request_header', return_value=signature), \
+                patch('frappe.local') as mock_local:
+            mock_request.get_data.return_value = body
+            mock_local.response = {}
+            return receive_tracking_notifications(), mock_local.response
+    
+    def test_rejects_bad_signature(self):
+        """Test that unsigned or tampered batches are refused before queueing"""
+        body, signature = self.sender.build_batch(3)
+        
+        result, response = self.receive(body + b' ', signature)
+        
+        self.assertFalse(result['success'])
+        self.assertEqual(response['http_status_code'], 401)
+        self.assertEqual(self.inbox.items, [])
+    
+    @patch('erpnext_aramex_shipping.shipment.webhook.publish_shipment_updates')
+    @patch('erpnext_aramex_shipping.shipment.webhook.update_shipments')
+    @patch('erpnext_aramex_shipping.shipment.webhook.append_tracking_events')
+    @patch('erpnext_aramex_shipping.shipment.webhook.get_shipment_statuses')
+    @patch('frappe.db')
+    def test_burst_is_flushed_with_bulk_writes(self, mock_db, mock_get_statuses, mock_append, mock_update, mock_publish):
+        """Test that a burst of pushed events costs one bulk write per flush batch"""
+        from erpnext_aramex_shipping.shipment.webhook import flush_tracking_notifications
+        
+        for _ in range(10):
+            result, _ = self.receive(*self.sender.build_batch(500))
+            self.assertEqual(result['queued'], 500)
+        self.assertEqual(len(self.inbox.items), 5000)
+        
+        mock_get_statuses.side_effect = lambda ids: {shipment_id: 'SH003' for shipment_id in ids}
+        summary = flush_tracking_notifications()
+        
+        self.assertEqual(summary['processed'], 5000)
+        self.assertEqual(self.inbox.items, [])
+        # Every batch left its processing list once committed
+        self.assertEqual([key for key, items in self.inbox.lists.items() if items and 'processing' in key], [])
+        self.assertEqual(self.inbox.runs, {})
+        # 5000 events in batches of 2000: three bulk updates, not 5000 saves
+        self.assertEqual(mock_update.call_count, 3)
+        # The newest event of each waybill decides its status
+        latest = {update['aramex_shipment_id']: update['status'] for update in mock_update.call_args.args[0]}
+        self.assertEqual(latest[self.waybills[0]], 'SH004')
+    
+    @patch('erpnext_aramex_shipping.shipment.webhook.apply_notifications', side_effect=Exception('DB down'))
+    @patch('frappe.db')
+    @patch('frappe.log_error')
+    def test_failed_flush_requeues(self, mock_log_error, mock_db, mock_apply):
+        """Test that a batch that fails to write goes back to the inbox in order, counting the attempt"""
+        from erpnext_aramex_shipping.shipment.webhook import flush_tracking_notifications
+        
+        self.receive(*self.sender.build_batch(5))
+        queued = [json.loads(item) for item in self.inbox.items]
+        
+        summary = flush_tracking_notifications()
+        
+        self.assertEqual(summary['processed'], 0)
+        self.assertEqual([json.loads(item) for item in self.inbox.items],
+                         [dict(notification, attempts=1) for notification in queued])
+        mock_db.rollback.assert_called_once()
+        self.assertEqual(self.inbox.runs, {})
+    
+    @patch('erpnext_aramex_shipping.shipment.webhook.apply_notifications')
+    @patch('frappe.db')
+    @patch('frappe.logger')
+    def test_batch_of_a_killed_flush_is_redriven(self, mock_logger, mock_db, mock_apply):
+        """Test that a batch still in a processing list after a worker died goes back to the inbox and is written"""
+        from erpnext_aramex_shipping.shipment.webhook import flush_tracking_notifications
+        
+        self.receive(*self.sender.build_batch(5))
+        queued = list(self.inbox.items)
+        written = []
+        
+        def die(notifications):
+            raise SystemExit('worker killed')
+        
+        mock_apply.side_effect = die
+        with patch('frappe.generate_hash', return_value='dead'), self.assertRaises(SystemExit):
+            flush_tracking_notifications()
+        
+        # Nothing is lost: the batch waits in the dead run's processing list
+        self.assertEqual(self.inbox.items, [])
+        self.assertEqual(self.inbox.lists['aramex_tracking_processing:dead'], queued)
+        
+        mock_apply.side_effect = lambda notifications: written.extend(notifications) or len(notifications)
+        # A run within the timeout leaves the list alone, as its worker may still be writing it
+        self.assertEqual(flush_tracking_notifications()['processed'], 0)
+        
+        self.inbox.runs['aramex_tracking_processing:dead'] -= 10 * 60
+        summary = flush_tracking_notifications()
+        
+        self.assertEqual(summary['processed'], 5)
+        self.assertEqual([notification['waybill'] for notification in written],
+                         [json.loads(item)['waybill'] for item in queued])
+        self.assertNotIn('aramex_tracking_processing:dead', self.inbox.lists)
+        self.assertEqual(self.inbox.runs, {})
+    
+    @patch('erpnext_aramex_shipping.shipment.webhook.apply_notifications')
+    @patch('frappe.db')
+    @patch('frappe.log_error')
+    def test_poison_notification_is_dead_lettered(self, mock_log_error, mock_db, mock_apply):
+        """Test that a batch failing every attempt is split and only the bad notification is set aside"""
+        from erpnext_aramex_shipping.shipment.webhook import flush_tracking_notifications
+        
+        self.settings['webhook_max_flush_attempts'] = 3
+        self.receive(*self.sender.build_batch(8))
+        poison = json.loads(self.inbox.items[5])['waybill']
+        written = []
+        
+        def apply(notifications):
+            if any(notification['waybill'] == poison for notification in notifications):
+                raise Exception('Data too long for column')
+            written.extend(notifications)
+            return len(notifications)
+        
+        mock_apply.side_effect = apply
+        
+        for _ in range(2):
+            self.assertEqual(flush_tracking_notifications()['processed'], 0)
+        summary = flush_tracking_notifications()
+        
+        self.assertEqual(summary, {'processed': 8, 'updated': 7, 'dead_lettered': 1})
+        self.assertEqual(self.inbox.items, [])
+        self.assertEqual(len(written), 7)
+        self.assertNotIn('attempts', written[0])
+        dead = json.loads(self.inbox.dead_letters[0])
+        self.assertEqual(dead['notification']['waybill'], poison)
+        self.assertEqual(dead['error'], 'Data too long for column')
+        self.assertIn(poison, mock_log_error.call_args.args[0])
+    
+    @patch('erpnext_aramex_shipping.shipment.webhook.publish_shipment_updates')
+    @patch('erpnext_aramex_shipping.shipment.webhook.update_shipments')
+    @patch('erpnext_aramex_shipping.shipment.webhook.append_tracking_events')
+    @patch('erpnext_aramex_shipping.shipment.webhook.get_shipment_statuses')
+    @patch('erpnext_aramex_shipping.shipment.webhook.get_latest_event_times')
+    @patch('frappe.db')
+    def test_late_pushes_do_not_roll_back_statuses(self, mock_db, mock_latest, mock_get_statuses, mock_append,
+                                                  mock_update, mock_publish):
+        """Test that older pushes and pushes for finished shipments leave the status alone"""
+        from datetime import datetime
+        from erpnext_aramex_shipping.shipment.webhook import apply_notifications
+        
+        mock_get_statuses.return_value = {'1001': 'SH004', '1002': 'SH005', '1003': 'SH004'}
+        mock_latest.return_value = {'1001': datetime(2024, 1, 3, 12, 0), '1003': datetime(2024, 1, 2, 12, 0)}
+        
+        updated = apply_notifications([
+            # Older than the stored event: a late push
+            {'waybill': '1001', 'date': '2024-01-02T08:00:00', 'code': 'SH014', 'status': 'Picked up'},
+            # Already delivered
+            {'waybill': '1002', 'date': '2024-01-05T08:00:00', 'code': 'SH004', 'status': 'In transit'},
+            {'waybill': '1003', 'date': '2024-01-03T08:00:00', 'code': 'SH003', 'status': 'Out for delivery'},
+            {'waybill': '1003', 'date': '2024-01-01T08:00:00', 'code': 'SH014', 'status': 'Picked up'}
+        ])
+        
+        self.assertEqual(updated, 1)
+        updates = mock_update.call_args.args[0]
+        self.assertEqual([(u['aramex_shipment_id'], u['status']) for u in updates], [('1003', 'SH003')])
+        # Only the newest event is kept on the shipment; the history stays in the event table
+        self.assertEqual([event['code'] for event in json.loads(updates[0]['tracking_data'])[0]['events']], ['SH003'])
+        # Stored event times are read before the batch's events are appended
+        self.assertEqual(sorted(mock_latest.call_args.args[0]), ['1001', '1002', '1003'])
+
+
+class TestShipmentJobs(unittest.TestCase):
+    """Test cases for queued shipment creation"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        cache_patcher = patch('frappe.cache')
+        self.mock_redis = cache_patcher.start().return_value
+        self.mock_redis.make_key.side_effect = lambda key: key
+        self.addCleanup(cache_patcher.stop)
+        
+        client_patcher = patch('erpnext_aramex_shipping.shipment.jobs.get_aramex_client')
+        client_patcher.start().return_value.settings = {}
+        self.addCleanup(client_patcher.stop)
+        
+        self.shipment = {
+            'shipper_name': 'John Doe', 'shipper_address_line1': '123 Test Street',
+            'shipper_city': 'Dubai', 'shipper_country_code': 'AE',
+            'shipper_phone': '+971501234567', 'shipper_email': 'john@example.com',
+            'consignee_name': 'Jane Smith', 'consignee_address_line1': '456 Destination Ave',
+            'consignee_city': 'Riyadh', 'consignee_country_code': 'SA',
+            'consignee_phone': '+966501234567', 'consignee_email': 'jane@example.com',
+            'weight': 1.5, 'length': 20, 'width': 15, 'height': 10,
+            'number_of_pieces': 1, 'description': 'Test package', 'reference': 'SHIP-1'
+        }
+    
+    @patch('frappe.enqueue')
+    def test_repeated_idempotency_key_is_not_queued_again(self, mock_enqueue):
+        """Test that a retried request returns the existing job instead of a new one"""
+        from erpnext_aramex_shipping.shipment.jobs import enqueue_aramex_shipment
+        
+        self.mock_redis.set.return_value = None
+        self.mock_redis.get.return_value = json.dumps({'status': 'finished', 'job_id': 'job-1', 'result': {'shipment_id': '1001'}})
+        
+        result = enqueue_aramex_shipment(json.dumps(self.shipment), idempotency_key='key-1')
+        
+        self.assertTrue(result['duplicate'])
+        self.assertEqual(result['result']['shipment_id'], '1001')
+        mock_enqueue.assert_not_called()
+    
+    @patch('frappe.publish_realtime')
+    @patch('erpnext_aramex_shipping.shipment.jobs.create_aramex_shipment')
+    def test_job_creates_shipment_once_and_publishes_result(self, mock_create, mock_publish):
+        """Test that the job records its result and skips creation when re-run"""
+        from erpnext_aramex_shipping.shipment.jobs import process_shipment_job
+        
+        mock_create.return_value = {'success': True, 'shipment_id': '1001'}
+        self.mock_redis.get.return_value = json.dumps({'status': 'queued', 'job_id': 'job-1'})
+        
+        result = process_shipment_job(self.shipment, 'key-1', user='ops@example.com')
+        
+        self.assertEqual(result['shipment_id'], '1001')
+        stored = json.loads(self.mock_redis.set.call_args.args[1])
+        self.assertEqual(stored['status'], 'finished')
+        self.assertEqual(mock_publish.call_args.kwargs['user'], 'ops@example.com')
+        
+        self.mock_redis.get.return_value = self.mock_redis.set.call_args.args[1]
+        process_shipment_job(self.shipment, 'key-1')
+        
+        self.assertEqual(mock_create.call_count, 1)
+    
+    @patch('erpnext_aramex_shipping.shipment.jobs.get_shipment_queue', return_value='aramex')
+    @patch('frappe.enqueue')
+    @patch('frappe.generate_hash')
+    def test_requests_without_key_get_their_own_key(self, mock_hash, mock_enqueue, mock_queue):
+        """Test that identical shipments sent without a key are queued separately"""
+        from erpnext_aramex_shipping.shipment.jobs import enqueue_aramex_shipment
+        
+        mock_hash.side_effect = ['key-a', 'key-b']
+        self.mock_redis.set.return_value = True
+        
+        first = enqueue_aramex_shipment(json.dumps(self.shipment))
+        second = enqueue_aramex_shipment(json.dumps(self.shipment))
+        
+        self.assertEqual([first['idempotency_key'], second['idempotency_key']], ['key-a', 'key-b'])
+        self.assertFalse(second['duplicate'])
+        self.assertEqual(mock_enqueue.call_count, 2)
+    
+    @patch('frappe.log_error')
+    @patch('frappe.publish_realtime')
+    @patch('frappe.db.get_value')
+    @patch('erpnext_aramex_shipping.shipment.jobs.create_aramex_shipment')
+    def test_interrupted_job_is_not_sent_again(self, mock_create, mock_get_value, mock_publish, mock_log_error):
+        """Test that a job re-run after it started adopts the stored shipment or waits for review"""
+        from erpnext_aramex_shipping.shipment.jobs import process_shipment_job
+        
+        self.mock_redis.get.return_value = json.dumps({'status': 'started', 'job_id': 'job-1'})
+        mock_get_value.return_value = {'name': 'SHIP-0001', 'aramex_shipment_id': '1001'}
+        
+        result = process_shipment_job(self.shipment, 'key-1')
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['erpnext_shipment_id'], 'SHIP-0001')
+        self.assertEqual(json.loads(self.mock_redis.set.call_args.args[1])['status'], 'finished')
+        
+        mock_get_value.return_value = None
+        
+        result = process_shipment_job(self.shipment, 'key-1')
+        
+        self.assertTrue(result['needs_review'])
+        self.assertEqual(json.loads(self.mock_redis.set.call_args.args[1])['status'], 'needs_review')
+        mock_log_error.assert_called_once()
+        mock_create.assert_not_called()
+    
+    @patch('frappe.publish_realtime')
+    @patch('erpnext_aramex_shipping.shipment.jobs.create_aramex_shipment')
+    def test_unanswered_create_keeps_the_key_for_review(self, mock_create, mock_publish):
+        """Test that a create Aramex may have acted on holds its key for the full TTL"""
+        from erpnext_aramex_shipping.shipment.jobs import process_shipment_job, DEFAULT_IDEMPOTENCY_TTL
+        
+        self.mock_redis.get.return_value = json.dumps({'status': 'queued', 'job_id': 'job-1'})
+        mock_create.return_value = {'success': False, 'needs_review': True, 'message': 'No answer from Aramex'}
+        
+        process_shipment_job(self.shipment, 'key-1', user='ops@example.com')
+        
+        key, state = self.mock_redis.set.call_args.args
+        self.assertEqual(json.loads(state)['status'], 'needs_review')
+        self.assertEqual(self.mock_redis.set.call_args.kwargs['ex'], DEFAULT_IDEMPOTENCY_TTL)
+        self.assertEqual(key, 'aramex_shipment_job:ops@example.com:key-1')
+        
+        mock_create.return_value = {'success': False, 'message': 'Aramex API Error: Invalid city'}
+        self.mock_redis.get.return_value = json.dumps({'status': 'queued', 'job_id': 'job-1'})
+        
+        process_shipment_job(self.shipment, 'key-1', user='ops@example.com')
+        
+        self.assertEqual(json.loads(self.mock_redis.set.call_args.args[1])['status'], 'failed')
+        self.assertEqual(self.mock_redis.set.call_args.kwargs['ex'], 300)
+    
+    @patch('frappe.session')
+    def test_job_status_is_scoped_to_the_session_user(self, mock_session):
+        """Test that the status endpoint reads only the session user's jobs"""
+        from erpnext_aramex_shipping.shipment.jobs import get_shipment_job_status
+        
+        mock_session.user = 'other@example.com'
+        self.mock_redis.get.return_value = None
+        
+        result = get_shipment_job_status('key-1')
+        
+        self.assertFalse(result['success'])
+        self.mock_redis.get.assert_called_once_with('aramex_shipment_job:other@example.com:key-1')
+    
+    def test_transport_failures_after_sending_are_ambiguous(self):
+        """Test that only failures proving Aramex never acted count as definite"""
+        import requests
+        
+        def http_error(status):
+            return requests.exceptions.HTTPError(response=Mock(status_code=status))
+        
+        self.assertTrue(AramexAPI.is_ambiguous_failure(requests.exceptions.ReadTimeout()))
+        self.assertTrue(AramexAPI.is_ambiguous_failure(requests.exceptions.ConnectionError()))
+        self.assertTrue(AramexAPI.is_ambiguous_failure(http_error(502)))
+        self.assertFalse(AramexAPI.is_ambiguous_failure(requests.exceptions.ConnectTimeout()))
+        self.assertFalse(AramexAPI.is_ambiguous_failure(http_error(400)))
+    
+    @patch('frappe.log_error')
+    @patch('erpnext_aramex_shipping.api.aramex.get_aramex_client')
+    def test_create_shipment_reports_unanswered_requests_for_review(self, mock_client, mock_log_error):
+        """Test that create_shipment flags a request Aramex may have acted on"""
+        from erpnext_aramex_shipping.api.resilience import AmbiguousRequestError
+        
+        mock_client.return_value.make_api_request.side_effect = AmbiguousRequestError('Read timed out')
+        
+        with patch('erpnext_aramex_shipping.api.aramex.build_shipment_payload'):
+            result = create_shipment(self.shipment)
+        
+        self.assertFalse(result['success'])
+        self.assertTrue(result['needs_review'])
 
 
 if __name__ == '__main__':